@@ -1,33 +1,295 @@
-from flask import Flask, json, jsonify, request
-from config import get_es
+from flask import Flask, Response, json, jsonify, request
+from config import get_es, pool_stats
+from cache import get_search_cache, get_index_generation, make_cache_key
+from queries.suggestions import term_cache_stats, search_with_suggestions, get_suggested_queries, search_suggestions
 from flask_cors import CORS
-from queries.intersection import intersection_query
-from queries.metadata import metadata
+from queries.intersection import intersection_query, chunk_text_cache_stats
+from queries.metadata import metadata, metadata_cache_stats, preload_metadata
 from queries.phrase import phrase_query
 from queries.filter import search_episodes
 from queries.bm25 import bm25_query
+from queries.batch import run_batch, get_query_plan
+from queries.chunks import use_chunk_layout
+from queries.nested import use_nested_layout
+from queries.pagination import CursorError, search_page, fetch_page, first_page_cursor
 
 app = Flask(__name__)
 CORS(app)
 
-es = get_es()
 EPISODES_INDEX = "episodes"
 TRANSACRIPTS_INDEX = "podcast_transcripts"
 
+# streaming formats of /search, picked with ?stream=<format> or the Accept header
+STREAM_MIMETYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+# warm the episode metadata cache with the hot episodes (METADATA_PRELOAD)
+try:
+    preload_metadata()
+except Exception as e:
+    print(f"Error preloading metadata: {e}")
+
 @app.route('/')
 def home():
     return "Backend is running!" 
 
+@app.route('/stats/pool')
+def stats_pool():
+    return jsonify(pool_stats())
+
+@app.route('/stats/cache')
+def stats_cache():
+    cache = get_search_cache()
+    return jsonify({
+        "results": cache.stats() if cache else {"enabled": False},
+        "terms": term_cache_stats(),
+        "metadata": metadata_cache_stats(),
+        "chunk_texts": chunk_text_cache_stats()
+    })
+
 @app.route('/search', methods=['POST'])
 def search():
     
     try:
         params = request.get_json()
+        stream_format = getStreamFormat(request.args, request.headers)
+        if isPlainSearch(params, stream_format):
+            return cachedQuerySelector(params)
+        if params.get("cursor") or params.get("paginate"):
+            if stream_format:
+                # the cursor of the next page comes as the last item
+                return Response(
+                    formatStream(streamPageSelector(params), stream_format),
+                    mimetype=STREAM_MIMETYPES[stream_format],
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+                )
+            return jsonify(paginatedQuerySelector(params))
+        return Response(
+            formatStream(streamQuerySelector(params), stream_format),
+            mimetype=STREAM_MIMETYPES[stream_format],
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    except Exception as e:
+        error, status = searchError(e)
+        return jsonify(error), status
+
+
+def isPlainSearch(params, stream_format):
+    """
+    True for the /search payloads answered with one list of results, neither streamed nor
+    paginated (asgi.py runs these on AsyncElasticsearch and hands the others to this app).
+    """
+    return isinstance(params, dict) and not (stream_format or params.get("cursor") or params.get("paginate"))
+
+
+def searchError(e):
+    """
+    JSON body and status of a failed /search: 400 for a bad cursor, 500 otherwise.
+    """
+    if isinstance(e, CursorError):
+        return {"error": str(e)}, 400
+    print(f"Error during search: {e}")
+    return {"error": str(e)}, 500
+
+
+@app.route('/search/batch', methods=['POST'])
+def search_batch():
+    """
+    Runs a list of /search payloads with one Elasticsearch request per stage for all of them.
+    Returns one {"results": [...]} or {"error": "..."} per payload, in order.
+    """
+    try:
+        payloads = request.get_json()
+        if not isinstance(payloads, list):
+            return jsonify({"error": "Expected a list of search payloads"}), 400
+        return jsonify(cachedBatchSelector(payloads))
+    except Exception as e:
+        print(f"Error during batch search: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+def cachedBatchSelector(payloads):
+    es = get_es()
+    generation = get_index_generation(es)
+    cache = get_search_cache()
+    if cache is None:
+        return run_batch(payloads, es)
+
+    keys = [make_cache_key(params, generation) if isinstance(params, dict) else None for params in payloads]
+    output = [{"results": cached} if key and (cached := cache.get(key)) is not None else None for key in keys]
+    missing = [i for i, result in enumerate(output) if result is None]
+    for i, result in zip(missing, run_batch([payloads[i] for i in missing], es)):
+        output[i] = result
+        if "results" in result and keys[i]:
+            cache.set(keys[i], result["results"])
+    return output
+
+
+def cachedQuerySelector(params):
+    # also flushes the term correction cache when the indices changed
+    generation = get_index_generation(get_es())
+    cache = get_search_cache()
+    if cache is None:
+        return querySelector(params)
+
+    key = make_cache_key(params, generation)
+    result = cache.get(key)
+    if result is None:
         result = querySelector(params)
-        return result
+        cache.set(key, result)
+    return result
+
+
+def getStreamFormat(args, headers):
+    stream_format = args.get("stream")
+    if stream_format in STREAM_MIMETYPES:
+        return stream_format
+    accept = headers.get("Accept", "")
+    for stream_format, mimetype in STREAM_MIMETYPES.items():
+        if mimetype in accept:
+            return stream_format
+    return None
+
+
+def formatStream(items, stream_format):
+    """
+    Serializes the streamed items: one JSON document per line (ndjson), or one "data:" event
+    per item followed by an "end" event (sse). Errors are sent as an {"error": ...} item.
+    """
+    try:
+        for item in items:
+            data = json.dumps(item)
+            yield f"data: {data}\n\n" if stream_format == "sse" else data + "\n"
     except Exception as e:
         print(f"Error during search: {e}")
-        return jsonify({"error": str(e)}), 500
+        data = json.dumps({"error": str(e)})
+        yield f"event: error\ndata: {data}\n\n" if stream_format == "sse" else data + "\n"
+        return
+    if stream_format == "sse":
+        yield "event: end\ndata: {}\n\n"
+
+
+def streamQuerySelector(params):
+    """
+    Streaming cachedQuerySelector: yields the joined results one at a time, and caches the
+    full list once the last one has been sent.
+    """
+    es = get_es()
+    generation = get_index_generation(es)
+    cache = get_search_cache()
+    key = make_cache_key(params, generation) if cache else None
+    result = cache.get(key) if cache else None
+    if result is not None:
+        yield from result
+        return
+
+    result = []
+    for item in streamFilter(params, es):
+        result.append(item)
+        yield item
+    if cache:
+        cache.set(key, result)
+
+
+def streamFilter(params, es):
+    """
+    Streaming handleFilter. Runs the search stages of the query plan (first search, then the
+    spelling suggestions when it has too few hits) and yields the results of each stage as soon
+    as they are formatted, so the first hits go out before the suggestion fallback runs.
+    """
+    if params["filter"] != "general":
+        for meta in search_episodes(params['q'], params['filter'], es=es):
+            yield {"transcript": {}, "metadata": meta}
+        return
+
+    plan = get_query_plan(params)
+    q, top_k = params["q"], plan["top_k"]
+    response, suggestions = search_with_suggestions(
+        plan["build_body"](q), q, es, plan["index_name"],
+        suggest_index=plan["suggest_index"], field=plan["field"], **plan["term_options"]
+    )
+    hits = response["hits"]["hits"]
+    for hit in hits:
+        hit["_source"]["query"] = q
+    yield from streamHits(plan, hits, es)
+
+    if len(hits) < top_k:
+        if suggestions is None:
+            suggestions = get_suggested_queries(q, es, plan["suggest_index"], plan["field"], **plan["term_options"])
+        first_suggested = len(hits)
+        search_suggestions(suggestions, plan["build_body"], hits, top_k, es=es, index_name=plan["index_name"])
+        yield from streamHits(plan, hits[first_suggested:], es)
+
+
+def streamHits(plan, hits, es):
+    """
+    Formats the hits of one search stage and yields them joined with their metadata, fetched with
+    one lookup for the stage. Hits are formatted one at a time; in the chunk and nested layouts,
+    where formatting fetches neighbour chunks, the first hit is formatted alone and the others
+    together so that they share one lookup.
+    """
+    if not hits:
+        return
+    metadata_by_episode = {
+        (meta["show_id"], meta["episode_id"]): meta
+        for meta in metadata([hit["_source"] for hit in hits], es=es)
+    }
+    if use_chunk_layout() or use_nested_layout():
+        batches = [hits[:1], hits[1:]]
+    else:
+        batches = [[hit] for hit in hits]
+    for batch in batches:
+        if not batch:
+            continue
+        for transcript in plan["format"](batch, es):
+            yield {
+                "transcript": transcript,
+                "metadata": metadata_by_episode.get((transcript["show_id"], transcript["episode_id"]), {})
+            }
+
+
+def paginatedQuerySelector(params):
+    """
+    One page of a paginated search: {"results": [...], "cursor": "..."}. The first page (payload
+    with "paginate": true) is a plain /search, from the result cache when possible; the next ones
+    ({"cursor": ...}) are read from a point in time. cursor is None after the last page, and
+    for the first page in the layouts without cursors.
+    """
+    if not params.get("cursor"):
+        results = cachedQuerySelector(params)
+        return {"results": results, "cursor": first_page_cursor(params, results)}
+
+    es = get_es()
+    plan, results, cursor = search_page(params["cursor"], es)
+    if plan["general"]:
+        results = joinMetadata(results, es)
+    else:
+        results = [{"transcript": {}, "metadata": meta} for meta in results]
+    return {"results": results, "cursor": cursor}
+
+
+def streamPageSelector(params):
+    """
+    Streaming paginatedQuerySelector: yields the results one at a time, then {"cursor": ...}.
+    """
+    if not params.get("cursor"):
+        results = []
+        for item in streamQuerySelector(params):
+            results.append(item)
+            yield item
+        yield {"cursor": first_page_cursor(params, results)}
+        return
+
+    es = get_es()
+    plan, hits, cursor = fetch_page(params["cursor"], es)
+    if plan["general"]:
+        yield from streamHits(plan, hits, es)
+    else:
+        for meta in plan["format"](hits, es):
+            yield {"transcript": {}, "metadata": meta}
+    yield {"cursor": cursor}
 
 
 def querySelector(params):
@@ -37,26 +299,14 @@ def querySelector(params):
 
 
 def handleFilter(params):
+    es = get_es()
   
     if (params["filter"] == "general"):
-            transcript_result = handleType(params)
-            metadata_results = metadata(transcript_result)
-            
-            joined_results = [
-                {
-                    "transcript": transcript,
-                    "metadata": next(
-                        (meta for meta in metadata_results if meta["show_id"] == transcript["show_id"] and meta["episode_id"] == transcript["episode_id"]),
-                        {}
-                    )
-                }
-                for transcript in transcript_result
-            ]
-            
-            return joined_results  
+            transcript_result = handleType(params, es)
+            return joinMetadata(transcript_result, es)
     
     else:
-        metadata_results = search_episodes(params['q'], params['filter'])
+        metadata_results = search_episodes(params['q'], params['filter'], es=es)
         
         joined_results = [
             {
@@ -69,26 +319,42 @@ def handleFilter(params):
         return joined_results
 
 
-def handleType(params):
+def joinMetadata(transcript_result, es):
+    metadata_results = metadata(transcript_result, es=es)
+
+    metadata_by_episode = {(meta["show_id"], meta["episode_id"]): meta for meta in metadata_results}
+    return [
+        {
+            "transcript": transcript,
+            "metadata": metadata_by_episode.get((transcript["show_id"], transcript["episode_id"]), {})
+        }
+        for transcript in transcript_result
+    ]
+
+
+def handleType(params, es):
     match params['type']:
         case "Intersection":
             results = intersection_query(
                 params["q"], 
                 params["time"], 
-                selected_episodes=params["selectedEpisodes"]
+                selected_episodes=params["selectedEpisodes"],
+                es=es
             )
             
         case "Phrase":
             results =  phrase_query(
                 phrase=params["q"], 
                 chunk_size=params['time'], 
-                selected_episodes=params["selectedEpisodes"]
+                selected_episodes=params["selectedEpisodes"],
+                es=es
             )
         case "Ranking":
             results =  bm25_query(
                 query_term=params["q"], 
                 chunk_size= params["time"], 
-                selected_episodes=params["selectedEpisodes"]
+                selected_episodes=params["selectedEpisodes"],
+                es=es
             )
         case _:
             raise ValueError(f"Unsupported query type: {params['type']}")
@@ -0,0 +1,111 @@
+"""
+ASGI variant of app.py serving /search with AsyncElasticsearch (queries/async_queries.py),
+so a worker keeps serving other requests while its ES calls are in flight.
+
+Only the plain /search (neither streamed nor paginated, see app.isPlainSearch) runs on the
+async client. Every other request, including the streamed and paginated searches, the
+batches, the stats and the CORS preflights, is handed to the Flask app of app.py through
+asgiref's WSGI adapter, so both entry points share its routes, validation and errors.
+
+Run from the backend folder with a production ASGI server, e.g.:
+    uvicorn asgi:app --host 0.0.0.0 --port 8000 --workers 4
+"""
+import asyncio
+import json
+from urllib.parse import parse_qsl
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.datastructures import Headers
+
+from config import get_es, close_async_es
+from cache import get_search_cache, get_index_generation, make_cache_key
+from queries.async_queries import search
+from app import app as flask_app, getStreamFormat, isPlainSearch, searchError
+
+wsgi_app = WsgiToAsgi(flask_app)
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+def replay_body(body, receive):
+    """
+    receive callable handing the already read request body to the WSGI app.
+    """
+    sent = False
+
+    async def replay():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+    return replay
+
+
+async def send_json(send, status, payload):
+    body = json.dumps(payload).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        # CORS header of flask_cors' defaults
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), (b"access-control-allow-origin", b"*")],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def cached_search(params):
+    # generation check and result cache shared with app.py
+    generation = await asyncio.to_thread(get_index_generation, get_es())
+    cache = get_search_cache()
+    if cache is None:
+        return await search(params)
+
+    key = make_cache_key(params, generation)
+    result = cache.get(key)
+    if result is None:
+        result = await search(params)
+        cache.set(key, result)
+    return result
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await close_async_es()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+
+    if scope["type"] == "http" and scope["path"] == "/search" and scope["method"] == "POST":
+        body = await read_body(receive)
+        try:
+            params = json.loads(body)
+        except ValueError:
+            params = None
+        args = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        headers = Headers([(name.decode("latin-1"), value.decode("latin-1")) for name, value in scope["headers"]])
+        if isPlainSearch(params, getStreamFormat(args, headers)):
+            try:
+                await send_json(send, 200, await cached_search(params))
+            except Exception as e:
+                error, status = searchError(e)
+                await send_json(send, status, error)
+            return
+        receive = replay_body(body, receive)
+
+    await wsgi_app(scope, receive, send)
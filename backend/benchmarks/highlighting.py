@@ -0,0 +1,79 @@
+"""
+Micro-benchmark of result highlighting on 300s windows.
+
+Compares the previous highlight_words implementations (one regex per query word and one
+pass over the window per word) with the cached single-alternation pattern of
+queries.highlight, for a page of hits with queries of one to five words.
+Run from the backend folder: python -m benchmarks.highlighting
+"""
+import random
+import re
+import string
+import timeit
+
+from queries.highlight import highlight_query, get_highlight_pattern
+
+WINDOW_SECONDS = 300
+WORDS_PER_CHUNK = 80
+PAGE_SIZE = 10
+QUERIES = ["morning", "climate change", "really nice morning", "climate change is real", "tricky matter to solve today"]
+REPEAT = 20
+
+
+def make_window(vocabulary):
+    # WINDOW_SECONDS of ~30s chunks joined like build_window does, ~1% of the words from the queries
+    query_words = [word for query in QUERIES for word in query.split()] + ["category", "Morning"]
+
+    def word():
+        return random.choice(query_words) if random.random() < 0.01 else random.choice(vocabulary)
+
+    chunks = [
+        " ".join(word() for _ in range(WORDS_PER_CHUNK))
+        for _ in range(WINDOW_SECONDS // 30)
+    ]
+    return " ".join(chunks)
+
+
+# previous implementations, kept here as the baseline
+
+def baseline_bm25_highlight(text, phrase):
+    for word in phrase.strip().split():
+        pattern = re.compile(rf'\b({re.escape(word)})\b', flags=re.IGNORECASE)
+        text = pattern.sub(r'<mark><strong><em>\1</em></strong></mark>', text)
+    return text
+
+
+def baseline_intersection_highlight(text, phrase):
+    for word in phrase.strip().split():
+        pattern = re.compile(rf'({re.escape(word)})', flags=re.IGNORECASE)
+        text = pattern.sub(r'<mark><strong><em>\1</em></strong></mark>', text)
+    return text
+
+
+def baseline_phrase_highlight(text, phrase):
+    pattern = re.compile(re.escape(phrase), re.IGNORECASE)
+    return pattern.sub(r"<mark><strong><em>\g<0></em></strong></mark>", text)
+
+
+def bench(label, func):
+    seconds = min(timeit.repeat(func, number=1, repeat=REPEAT))
+    print(f"  {label:<40} {seconds * 1000:8.3f} ms")
+
+
+def main():
+    random.seed(0)
+    vocabulary = ["".join(random.choice(string.ascii_lowercase) for _ in range(random.randint(2, 9))) for _ in range(3000)]
+    windows = [make_window(vocabulary) for _ in range(PAGE_SIZE)]
+    print(f"{PAGE_SIZE} windows of {WINDOW_SECONDS}s, {len(windows[0].split())} words each")
+    for query in QUERIES:
+        print(f"\n '{query}' ({len(query.split())} words)")
+        bench("words, per-word regexes (bm25 baseline)", lambda: [baseline_bm25_highlight(w, query) for w in windows])
+        bench("words, no boundaries (intersection bl.)", lambda: [baseline_intersection_highlight(w, query) for w in windows])
+        get_highlight_pattern.cache_clear()
+        bench("words, cached alternation", lambda: [highlight_query(w, query) for w in windows])
+        bench("phrase (baseline)", lambda: [baseline_phrase_highlight(w, query) for w in windows])
+        bench("phrase, cached pattern", lambda: [highlight_query(w, query, phrase=True) for w in windows])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Micro-benchmark of the intersection chunk selection on long episodes.
+
+Compares the previous get_intersection_chunk_indices (every chunk lowercased and scanned
+with `term in sentence` once per query term, substring matches included) with the
+token set matching of queries.intersection, without and with the chunk texts and token sets
+cached by a previous query. The first pass over an episode doesn't tokenize its chunks and
+costs about as much as the baseline; the chunks that can match are tokenized on the next pass
+over it, after which a query only checks their token sets. format_hits only needs the first
+matching chunk, which is measured separately.
+Run from the backend folder: python -m benchmarks.intersection_matching
+"""
+import random
+import timeit
+
+from benchmarks.window_building import make_episode
+from queries.intersection import get_intersection_chunk_indices, iter_intersection_chunk_indices, clear_chunk_text_cache
+
+EPISODE_HOURS = [1, 3, 6]
+QUERIES = ["climate change", "really nice morning people"]
+REPEAT = 20
+
+
+# previous implementation, kept here as the baseline
+
+def baseline_get_intersection_chunk_indices(hit, query_term):
+    source = hit['_source']
+    chunk_indices = []
+    if 'chunks' in source:
+        for i, chunk in enumerate(source['chunks']):
+            if all(term in chunk['sentence'].lower() for term in query_term.lower().split()):
+                chunk_indices.append(i)
+    return chunk_indices
+
+
+def cold(func):
+    def run():
+        clear_chunk_text_cache()
+        return func()
+    return run
+
+
+def bench(label, func):
+    seconds = min(timeit.repeat(func, number=1, repeat=REPEAT))
+    print(f"  {label:<40} {seconds * 1000:8.3f} ms")
+
+
+def main():
+    random.seed(0)
+    for hours in EPISODE_HOURS:
+        hit = {"_source": {"show_id": "show", "episode_id": f"episode-{hours}h", "chunks": make_episode(hours)}}
+        print(f"\n{hours}h episode, {len(hit['_source']['chunks'])} chunks")
+        for query in QUERIES:
+            first = lambda: next(iter_intersection_chunk_indices(hit, query), None)
+            print(f" '{query}'")
+            bench("all indices (baseline)", lambda: baseline_get_intersection_chunk_indices(hit, query))
+            bench("all indices", cold(lambda: get_intersection_chunk_indices(hit, query)))
+            bench("all indices, cached token sets", lambda: get_intersection_chunk_indices(hit, query))
+            bench("first index", cold(first))
+            bench("first index, cached token sets", first)
+
+
+if __name__ == "__main__":
+    main()
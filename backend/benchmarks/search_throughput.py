@@ -0,0 +1,111 @@
+"""
+Throughput benchmark of /search: requests/sec each server sustains while its p99 latency
+stays under a target.
+
+Start the servers to compare with the result cache off, e.g. from the backend folder:
+    SEARCH_CACHE_TTL=0 python app.py                                  # sync, port 5000
+    SEARCH_CACHE_TTL=0 uvicorn asgi:app --port 8000 --workers 1       # async
+then run:
+    python -m benchmarks.search_throughput --url sync=http://127.0.0.1:5000/search \
+        --url async=http://127.0.0.1:8000/search --p99 1000
+
+Every concurrency level runs a closed loop (each client sends its next request when the
+previous one returns) over the misspelled queries of old_query_scripts/performance-testing.py.
+"""
+import argparse
+import itertools
+import threading
+import time
+
+import requests
+
+QUERIES = ["really nice mornng", "new scary moovie", "climate chnge is real", "blue skyy is nice", "tricky mater to solve"]
+TYPES = ["Phrase", "Intersection", "Ranking"]
+TIMES = [30, 60, 120]
+CONCURRENCY = [1, 2, 4, 8, 16, 32, 64]
+
+
+def make_payloads():
+    return [
+        {"q": q, "type": query_type, "time": time_chunk, "filter": "general", "selectedEpisodes": []}
+        for q, query_type, time_chunk in itertools.product(QUERIES, TYPES, TIMES)
+    ]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def run_level(url, concurrency, duration, payloads):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(offset):
+        session = requests.Session()
+        for payload in itertools.islice(itertools.cycle(payloads), offset, None):
+            if time.perf_counter() >= deadline:
+                return
+            start = time.perf_counter()
+            try:
+                ok = session.post(url, json=payload, timeout=60).status_code == 200
+            except requests.RequestException:
+                ok = False
+            latency = time.perf_counter() - start
+            with lock:
+                latencies.append(latency)
+                errors[0] += not ok
+
+    threads = [threading.Thread(target=client, args=(i * 7,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors[0],
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000 if latencies else 0.0,
+        "p99_ms": percentile(latencies, 99) * 1000 if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", action="append", required=True, help="label=url of a /search endpoint, repeatable")
+    parser.add_argument("--p99", type=float, default=1000, help="p99 latency target in ms")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=CONCURRENCY)
+    args = parser.parse_args()
+
+    payloads = make_payloads()
+    summary = []
+    for target in args.url:
+        label, _, url = target.rpartition("=")
+        label = label or url
+        print(f"\n{label} ({url})")
+        print(f"  {'clients':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6}")
+        best = None
+        for concurrency in args.concurrency:
+            result = run_level(url, concurrency, args.duration, payloads)
+            print(f"  {concurrency:>7} {result['rps']:>8.1f} {result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f} {result['errors']:>6}")
+            if result["p99_ms"] <= args.p99 and not result["errors"] and (best is None or result["rps"] > best["rps"]):
+                best = result
+        summary.append((label, best))
+
+    print(f"\nrequests/sec with p99 <= {args.p99:.0f} ms")
+    for label, best in summary:
+        if best is None:
+            print(f"  {label:<10} target not met at any concurrency")
+        else:
+            print(f"  {label:<10} {best['rps']:8.1f} req/s ({best['concurrency']} clients, p99 {best['p99_ms']:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
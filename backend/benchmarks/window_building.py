@@ -0,0 +1,113 @@
+"""
+Micro-benchmark of the window builders on long episodes.
+
+Compares the previous implementations (linear sentence lookup in add_chunks_together,
+repeated list.index() calls in the phrase extension loop) with the index-based ones.
+Run from the backend folder: python -m benchmarks.window_building
+"""
+import copy
+import random
+import timeit
+
+from queries.bm25 import add_chunks_together
+from queries.intersection import get_n_30s_chunks
+from queries.phrase import find_first_chunk
+
+EPISODE_HOURS = [1, 3, 6]
+CHUNK_SIZES = [60, 300]
+REPEAT = 20
+
+
+def make_episode(hours, phrase="climate change"):
+    # ~30s chunks of ~80 words, the phrase only appears near the end of the episode
+    chunks = []
+    start = 0.0
+    words = ["podcast", "episode", "morning", "really", "nice", "think", "people", "world"]
+    while start < hours * 3600:
+        duration = random.uniform(28, 32)
+        chunks.append({
+            "sentence": " ".join(random.choice(words) for _ in range(80)),
+            "start_time": start,
+            "end_time": start + duration
+        })
+        start += duration
+    chunks[-20]["sentence"] += " " + phrase
+    return chunks
+
+
+# previous implementations, kept here as the baseline
+
+def baseline_add_chunks_together(chunks, matched_chunk, chunk_size=30):
+    chunks_to_merge = chunk_size // 30
+    matched_idx = next((i for i, chunk in enumerate(chunks)
+                        if chunk.get("sentence") == matched_chunk), None)
+    if matched_idx is None:
+        return {}
+    left_idx, right_idx = matched_idx - 1, matched_idx + 1
+    count = 1
+    selected_indices = [matched_idx]
+    while count < chunks_to_merge:
+        if left_idx >= 0:
+            selected_indices.insert(0, left_idx)
+            left_idx -= 1
+            count += 1
+        if count < chunks_to_merge and right_idx < len(chunks):
+            selected_indices.append(right_idx)
+            right_idx += 1
+            count += 1
+        if left_idx < 0 and right_idx >= len(chunks):
+            break
+    selected_chunks = [chunks[i] for i in selected_indices]
+    return {
+        'start_time': selected_chunks[0].get('start_time'),
+        'end_time': selected_chunks[-1].get('end_time'),
+        'chunk': ' '.join(chunk.get('sentence', '') for chunk in selected_chunks)
+    }
+
+
+def baseline_find_first_chunk(chunks, phrase, chunk_size=30):
+    best_chunk = None
+    for chunk in chunks:
+        if phrase.lower() in chunk["sentence"].lower():
+            best_chunk = chunk
+            if len(chunks) == chunks.index(chunk) + 1:
+                break
+            next_chunk = chunks[chunks.index(chunk) + 1]
+            end_time = next_chunk["end_time"]
+            start_time = best_chunk["start_time"]
+            while end_time - start_time < chunk_size + 15:
+                if chunks.index(next_chunk) == len(chunks) - 1:
+                    break
+                best_chunk["sentence"] += " " + next_chunk["sentence"]
+                best_chunk["end_time"] = next_chunk["end_time"]
+                next_chunk = chunks[chunks.index(next_chunk) + 1]
+                end_time = next_chunk["end_time"]
+            break
+    return best_chunk
+
+
+def bench(label, func):
+    seconds = min(timeit.repeat(func, number=1, repeat=REPEAT))
+    print(f"  {label:<40} {seconds * 1000:8.3f} ms")
+
+
+def main():
+    random.seed(0)
+    for hours in EPISODE_HOURS:
+        chunks = make_episode(hours)
+        matched_idx = len(chunks) - 20
+        matched_sentence = chunks[matched_idx]["sentence"]
+        print(f"\n{hours}h episode, {len(chunks)} chunks")
+        for chunk_size in CHUNK_SIZES:
+            print(f" {chunk_size}s windows")
+            bench("add_chunks_together (baseline)", lambda: baseline_add_chunks_together(chunks, matched_sentence, chunk_size))
+            bench("add_chunks_together", lambda: add_chunks_together(chunks, matched_idx, chunk_size))
+            bench("get_n_30s_chunks", lambda: get_n_30s_chunks(chunks, matched_idx, chunk_size // 30))
+            # the baseline mutates the chunks, so it gets a fresh copy (copy time excluded)
+            copies = iter([copy.deepcopy(chunks) for _ in range(REPEAT)])
+            bench("find_first_chunk (baseline)", lambda: baseline_find_first_chunk(next(copies), "climate change", chunk_size))
+            bench("find_first_chunk", lambda: find_first_chunk(chunks, "show", "episode", "climate change", chunk_size))
+
+
+if __name__ == "__main__":
+    main()
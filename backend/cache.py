@@ -0,0 +1,222 @@
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+import time
+
+from config import (
+    TRANSCRIPT_LAYOUT,
+    SEARCH_CACHE_TTL,
+    SEARCH_CACHE_MAX_BYTES,
+    SEARCH_CACHE_URL,
+    SEARCH_CACHE_GENERATION_CHECK,
+)
+from queries.chunks import CHUNK_INDEX_NAME, WINDOW_INDEX_NAME
+from queries.nested import NESTED_INDEX_NAME
+from queries.suggestions import clear_term_cache
+from queries.metadata import clear_metadata_cache
+from queries.intersection import clear_chunk_text_cache
+
+# Indices whose content a /search result depends on. A change of any of them
+# (new index, or new writes) starts a new cache generation.
+if TRANSCRIPT_LAYOUT == "window":
+    CACHED_INDICES = ["episodes", CHUNK_INDEX_NAME, WINDOW_INDEX_NAME]
+elif TRANSCRIPT_LAYOUT == "chunk":
+    CACHED_INDICES = ["episodes", CHUNK_INDEX_NAME]
+elif TRANSCRIPT_LAYOUT == "nested":
+    CACHED_INDICES = ["episodes", NESTED_INDEX_NAME]
+else:
+    CACHED_INDICES = ["episodes", "podcast_transcripts"]
+
+
+class ResultCache:
+    """
+    In-process LRU cache with a time to live, bounded by the size of the stored JSON.
+    Values are stored serialized, so callers can't modify a cached result.
+    """
+
+    def __init__(self, max_bytes=SEARCH_CACHE_MAX_BYTES, ttl=SEARCH_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, payload)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            expires_at, payload = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self._counters["expired"] += 1
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+        return json.loads(payload)
+
+    def set(self, key, value):
+        payload = json.dumps(value).encode()
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, payload)
+            self._bytes += len(payload)
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._counters["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        _, payload = self._entries.pop(key)
+        self._bytes -= len(payload)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                **self._counters,
+                "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+            }
+
+
+class RedisResultCache:
+    """
+    Cache shared by every worker, stored in Redis. Entries expire after `ttl` seconds,
+    the memory limit and LRU eviction are Redis' own (maxmemory, allkeys-lru).
+    Hit and miss counters are those of this process.
+    """
+
+    def __init__(self, url=SEARCH_CACHE_URL, ttl=SEARCH_CACHE_TTL, max_bytes=SEARCH_CACHE_MAX_BYTES, prefix="search:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("SEARCH_CACHE_URL needs the redis package: pip install redis") from e
+
+        self._redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self._counters = {"hits": 0, "misses": 0}
+
+    def get(self, key):
+        payload = self._redis.get(self.prefix + key)
+        if payload is None:
+            self._counters["misses"] += 1
+            return None
+        self._counters["hits"] += 1
+        return json.loads(payload)
+
+    def set(self, key, value):
+        payload = json.dumps(value).encode()
+        if len(payload) <= self.max_bytes:
+            self._redis.set(self.prefix + key, payload, ex=max(int(self.ttl), 1))
+
+    def clear(self):
+        # keys hold the index generation, entries of older generations expire on their own
+        pass
+
+    def stats(self):
+        lookups = self._counters["hits"] + self._counters["misses"]
+        return {
+            "backend": "redis",
+            "ttl": self.ttl,
+            "max_bytes": self.max_bytes,
+            **self._counters,
+            "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+_generation = {"value": None, "checked_at": float("-inf")}
+_generation_lock = threading.Lock()
+
+
+def get_search_cache():
+    """
+    Returns the /search result cache of this process: Redis backed when SEARCH_CACHE_URL
+    is set, in memory otherwise. None when SEARCH_CACHE_TTL is 0 (cache disabled).
+    """
+    global _cache
+    if SEARCH_CACHE_TTL <= 0:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = RedisResultCache() if SEARCH_CACHE_URL else ResultCache()
+    return _cache
+
+
+def get_index_generation(es, index_names=CACHED_INDICES):
+    """
+    Returns a string identifying the current content of the indices: their uuid (a new one
+    after the index is recreated) and the highest sequence number of their shards (which
+    grows with every write). Checked at most every SEARCH_CACHE_GENERATION_CHECK seconds.
+    """
+    now = time.monotonic()
+    if now - _generation["checked_at"] < SEARCH_CACHE_GENERATION_CHECK:
+        return _generation["value"]
+
+    with _generation_lock:
+        if now - _generation["checked_at"] < SEARCH_CACHE_GENERATION_CHECK:
+            return _generation["value"]
+
+        # stats of every index (an index that doesn't exist yet would fail a request naming it),
+        # trimmed to the few fields used here
+        stats = es.indices.stats(
+            metric="docs", level="shards",
+            filter_path="indices.*.uuid,indices.*.shards.*.seq_no.max_seq_no,indices.*.shards.*.routing.primary"
+        )
+        parts = []
+        for name, index_stats in sorted(stats.get("indices", {}).items()):
+            if name not in index_names:
+                continue
+            max_seq_no = sum(
+                shard.get("seq_no", {}).get("max_seq_no", 0)
+                for shards in index_stats.get("shards", {}).values()
+                for shard in shards
+                if shard.get("routing", {}).get("primary", True)
+            )
+            parts.append(f"{name}:{index_stats.get('uuid', '')}:{max_seq_no}")
+        generation = hashlib.sha1("|".join(parts).encode()).hexdigest()[:12]
+
+        if generation != _generation["value"]:
+            if _cache is not None:
+                _cache.clear()
+            clear_term_cache()
+            clear_metadata_cache()
+            clear_chunk_text_cache()
+        _generation.update(value=generation, checked_at=now)
+    return generation
+
+
+def make_cache_key(params, generation):
+    """
+    Cache key of /search parameters. The query text is normalised (case and whitespace)
+    so that equivalent requests share an entry.
+    """
+    normalised = {
+        "q": " ".join(str(params.get("q", "")).lower().split()),
+        "type": params.get("type"),
+        "time": params.get("time"),
+        "filter": params.get("filter"),
+        "selectedEpisodes": params.get("selectedEpisodes") or [],
+        "generation": generation,
+    }
+    return hashlib.sha1(json.dumps(normalised, sort_keys=True).encode()).hexdigest()
@@ -1,12 +1,141 @@
 from elasticsearch import Elasticsearch
 from dotenv import load_dotenv
 import os
+import threading
 
-def get_es():
-    load_dotenv()
-    return Elasticsearch(
-        hosts=["https://localhost:9200"],
-        http_auth=(os.getenv("ELASTIC_USERNAME"), os.getenv("ELASTIC_PASSWORD")),  
+load_dotenv()
+
+ES_HOSTS = [os.getenv("ELASTICSEARCH_URL", "https://localhost:9200")]
+ES_CONNECTIONS_PER_NODE = int(os.getenv("ES_CONNECTIONS_PER_NODE", "10"))
+ES_REQUEST_TIMEOUT = float(os.getenv("ES_REQUEST_TIMEOUT", "10"))
+# "episode": one document per episode with a chunks array (podcast_transcripts)
+# "chunk": one document per ~30s chunk (podcast_chunks)
+# "window": the chunk documents plus precomputed 60-300s windows (podcast_windows)
+# "nested": one document per episode with the chunks as nested documents (podcast_nested_transcripts)
+TRANSCRIPT_LAYOUT = os.getenv("TRANSCRIPT_LAYOUT", "episode")
+# Send the term suggest together with the first search of every query, so that
+# misspelled queries skip the suggest round trip (costs a suggest on every query).
+SPECULATIVE_SUGGEST = os.getenv("SPECULATIVE_SUGGEST", "false").lower() in ("1", "true", "yes")
+# /search result cache: entries live SEARCH_CACHE_TTL seconds (0 disables the cache)
+# within SEARCH_CACHE_MAX_BYTES of JSON per process. With SEARCH_CACHE_URL (redis://...)
+# the workers share one cache. Indices are checked for changes every
+# SEARCH_CACHE_GENERATION_CHECK seconds.
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "300"))
+SEARCH_CACHE_MAX_BYTES = int(os.getenv("SEARCH_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+SEARCH_CACHE_URL = os.getenv("SEARCH_CACHE_URL")
+SEARCH_CACHE_GENERATION_CHECK = float(os.getenv("SEARCH_CACHE_GENERATION_CHECK", "5"))
+# Episode metadata cache (number of episodes), optionally preloaded at startup
+# from a file listing the episode_id of the hot episodes, one per line.
+METADATA_CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", "20000"))
+METADATA_PRELOAD = os.getenv("METADATA_PRELOAD")
+# Paginated /search: point in time kept open between two pages of a cursor
+SEARCH_PIT_KEEP_ALIVE = os.getenv("SEARCH_PIT_KEEP_ALIVE", "5m")
+
+# One client per (process, name). Keying on the pid means every forked worker
+# builds its own pool instead of sharing sockets with its parent.
+_clients = {}
+_clients_lock = threading.Lock()
+_lookups = {"hits": 0, "misses": 0}
+_async_clients = {}
+
+
+def _es_options():
+    return dict(
+        hosts=ES_HOSTS,
+        http_auth=(os.getenv("ELASTIC_USERNAME"), os.getenv("ELASTIC_PASSWORD")),
         verify_certs=False,
         ca_certs="http_ca.crt",
-    )
\ No newline at end of file
+        connections_per_node=ES_CONNECTIONS_PER_NODE,
+        request_timeout=ES_REQUEST_TIMEOUT,
+        http_compress=True,
+    )
+
+
+def _create_es():
+    return Elasticsearch(**_es_options())
+
+
+def get_es(name="default"):
+    """
+    Returns the shared Elasticsearch client of this process, creating it on first use.
+    The client keeps a pool of `ES_CONNECTIONS_PER_NODE` keep-alive connections per node,
+    so repeated calls reuse open TLS connections instead of doing a new handshake.
+    """
+    key = (os.getpid(), name)
+    client = _clients.get(key)
+    if client is not None:
+        _lookups["hits"] += 1
+        return client
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _create_es()
+            _clients[key] = client
+            _lookups["misses"] += 1
+        else:
+            _lookups["hits"] += 1
+    return client
+
+
+def close_es():
+    """
+    Closes every client created by this process. Used on worker shutdown.
+    """
+    pid = os.getpid()
+    with _clients_lock:
+        for key in [key for key in _clients if key[0] == pid]:
+            _clients.pop(key).close()
+
+
+def get_async_es():
+    """
+    Returns the AsyncElasticsearch client of this process (needs aiohttp), with the same
+    settings as get_es(). Must be called from the event loop that uses it.
+    """
+    key = (os.getpid(), "async")
+    client = _async_clients.get(key)
+    if client is None:
+        from elasticsearch import AsyncElasticsearch
+        client = AsyncElasticsearch(**_es_options())
+        _async_clients[key] = client
+    return client
+
+
+async def close_async_es():
+    pid = os.getpid()
+    for key in [key for key in _async_clients if key[0] == pid]:
+        await _async_clients.pop(key).close()
+
+
+def pool_stats():
+    """
+    Returns client registry and HTTP connection pool counters for this process.
+    `connection_reuse_rate` is the share of requests served by an already open connection.
+    """
+    pid = os.getpid()
+    clients = []
+    for (client_pid, name), client in list(_clients.items()):
+        if client_pid != pid:
+            continue
+        nodes = []
+        for node in client.transport.node_pool.all():
+            pool = getattr(node, "pool", None)
+            num_connections = getattr(pool, "num_connections", 0)
+            num_requests = getattr(pool, "num_requests", 0)
+            nodes.append({
+                "node": node.base_url,
+                "connections_opened": num_connections,
+                "requests": num_requests,
+                "connection_reuse_rate": round(1 - num_connections / num_requests, 4) if num_requests else 0.0,
+                "max_connections": ES_CONNECTIONS_PER_NODE,
+            })
+        clients.append({"name": name, "nodes": nodes})
+
+    lookups = _lookups["hits"] + _lookups["misses"]
+    return {
+        "pid": pid,
+        "client_lookups": lookups,
+        "client_reuse_rate": round(_lookups["hits"] / lookups, 4) if lookups else 0.0,
+        "clients": clients,
+    }
@@ -0,0 +1 @@
+# makes pytest put the backend folder on sys.path, tests import the modules like app.py does
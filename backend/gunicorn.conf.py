@@ -0,0 +1,32 @@
+# Gunicorn settings of the production server (see wsgi.py).
+# Environment: WEB_BIND, WEB_CONCURRENCY (workers), WEB_THREADS, WEB_TIMEOUT, WEB_GRACEFUL_TIMEOUT.
+import multiprocessing
+import os
+
+bind = os.getenv("WEB_BIND", "127.0.0.1:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+# /search mostly waits on Elasticsearch, so each worker serves several requests with threads
+threads = int(os.getenv("WEB_THREADS", "8"))
+worker_class = "gthread"
+timeout = int(os.getenv("WEB_TIMEOUT", "60"))
+# on SIGTERM workers finish their in-flight requests for up to this many seconds
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+# import the app (config, .env, metadata preload) once in the master, then fork
+preload_app = True
+
+
+def post_fork(server, worker):
+    # each worker opens its own Elasticsearch pool (clients are per pid) and reads the index state
+    from config import get_es
+    from cache import get_index_generation
+    try:
+        get_index_generation(get_es())
+    except Exception as e:
+        server.log.warning(f"Worker {worker.pid} could not reach Elasticsearch: {e}")
+
+
+def worker_exit(server, worker):
+    from config import close_es
+    close_es()
@@ -1,20 +1,132 @@
 from dotenv import load_dotenv
 from elasticsearch import Elasticsearch
+from elasticsearch.helpers import parallel_bulk
+from concurrent.futures import ProcessPoolExecutor
+import argparse
 import os
 import json
+import time
 from glob import glob
 from json.decoder import JSONDecodeError
 import re
 from tqdm import tqdm
 import urllib3
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# window lengths in seconds, shared with the query side
+from queries.chunks import WINDOW_SIZES
 
 INDEX_NAME = "podcast_transcripts"
+CHUNK_INDEX_NAME = "podcast_chunks"
+WINDOW_INDEX_NAME = "podcast_windows"
+NESTED_INDEX_NAME = "podcast_nested_transcripts"
+# "episode": one document per episode with a chunks array, "chunk": one document per ~30s chunk,
+# "window": the chunk documents plus precomputed windows of WINDOW_SIZES seconds,
+# "nested": one document per episode with the chunks mapped as nested documents
+INDEX_LAYOUT = os.getenv("TRANSCRIPT_LAYOUT", "episode")
 PARENT_FOLDER = "../../podcasts-no-audio-13GB/transcripts/spotify-podcasts-2020"
 ONLY_USE_N_JSON = None
 
+# bulk ingestion defaults, can be overridden from the command line
+BULK_PARSE_WORKERS = os.cpu_count() or 1
+BULK_THREADS = 4
+BULK_CHUNK_SIZE = 500
+BULK_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 # to disable warnings: "HTTPS without verifying the server's SSL certificate"
 
+CHUNK_INDEX_BODY = {
+    "mappings": {
+        "properties": {
+            "episode_id": {"type": "keyword"},
+            "show_id": {"type": "keyword"},
+            "chunk_index": {"type": "integer"},
+            "start_time": {"type": "float"},
+            "end_time": {"type": "float"},
+            "sentence": {"type": "text"}
+        }
+    }
+}
+
+WINDOW_INDEX_BODY = {
+    "mappings": {
+        "properties": {
+            "episode_id": {"type": "keyword"},
+            "show_id": {"type": "keyword"},
+            "window_size": {"type": "integer"},
+            "chunk_index": {"type": "integer"},
+            "start_time": {"type": "float"},
+            "end_time": {"type": "float"},
+            "sentence": {"type": "text"}
+        }
+    }
+}
+
+# Versioned index template for the episode layout. Bump TRANSCRIPT_TEMPLATE_VERSION when
+# changing it; indexes created before the change keep their mapping until they are re-created.
+TRANSCRIPT_TEMPLATE_NAME = "podcast_transcripts_template"
+TRANSCRIPT_TEMPLATE_VERSION = 3
+TRANSCRIPT_INDEX_TEMPLATE = {
+    "index_patterns": [f"{INDEX_NAME}*"],
+    "version": TRANSCRIPT_TEMPLATE_VERSION,
+    "template": {
+        "settings": {
+            "number_of_shards": 1,
+            "number_of_replicas": 0,
+            "refresh_interval": "30s"
+        },
+        "mappings": {
+            "dynamic": False,
+            # chunk durations are only needed for range filters, not in responses
+            "_source": {"excludes": ["chunks.duration"]},
+            "properties": {
+                "episode_id": {"type": "keyword"},
+                "show_id": {"type": "keyword"},
+                "num_words": {"type": "integer"},
+                "ranking_score": {"type": "float"},
+                "chunks": {
+                    "properties": {
+                        "sentence": {"type": "text", "index_options": "offsets"},
+                        "start_time": {"type": "float"},
+                        "end_time": {"type": "float"},
+                        "duration": {"type": "float"}
+                    }
+                }
+            }
+        }
+    }
+}
+
+# Nested layout: the episode documents with chunks mapped as nested documents holding their
+# chunk_index, so that a query can return the offset of the matching chunk as an inner hit.
+# Not under the template's index pattern, it is created with the same settings.
+NESTED_INDEX_BODY = {
+    "settings": TRANSCRIPT_INDEX_TEMPLATE["template"]["settings"],
+    "mappings": {
+        "dynamic": False,
+        "_source": {"excludes": ["chunks.duration"]},
+        "properties": {
+            "episode_id": {"type": "keyword"},
+            "show_id": {"type": "keyword"},
+            "num_words": {"type": "integer"},
+            "ranking_score": {"type": "float"},
+            "chunks": {
+                "type": "nested",
+                "properties": {
+                    "chunk_index": {"type": "integer"},
+                    "sentence": {"type": "text"},
+                    "start_time": {"type": "float"},
+                    "end_time": {"type": "float"},
+                    "duration": {"type": "float"}
+                }
+            }
+        }
+    }
+}
+
 # Functions
 
 def get_n_json_files_from_nested_folders(parent_folder, n=5):
@@ -25,16 +137,60 @@ def get_n_json_files_from_nested_folders(parent_folder, n=5):
     print(f"✅ {len(selected_files)}  JSON fill / {len(all_json_files)}")
     return selected_files
 
-def create_index(index_name: str):
+def create_index(index_name: str, body: dict = None):
     if not es.indices.exists(index=index_name):
-        es.indices.create(index=index_name)
+        es.indices.create(index=index_name, body=body)
         print(f"✅ Index '{index_name}' created.")
     else:
         print(f"ℹ️ Index '{index_name}' already exists.")
 
 
+def put_transcript_template():
+    # install the template only when it is missing or older than this script's version
+    installed_version = None
+    if es.indices.exists_index_template(name=TRANSCRIPT_TEMPLATE_NAME):
+        templates = es.indices.get_index_template(name=TRANSCRIPT_TEMPLATE_NAME)["index_templates"]
+        installed_version = templates[0]["index_template"].get("version")
+
+    if installed_version is None or installed_version < TRANSCRIPT_TEMPLATE_VERSION:
+        es.indices.put_index_template(name=TRANSCRIPT_TEMPLATE_NAME, **TRANSCRIPT_INDEX_TEMPLATE)
+        print(f"✅ Index template '{TRANSCRIPT_TEMPLATE_NAME}' v{TRANSCRIPT_TEMPLATE_VERSION} installed.")
+    else:
+        print(f"ℹ️ Index template '{TRANSCRIPT_TEMPLATE_NAME}' v{installed_version} already installed.")
+
+
+def report_index(index_name: str, compare_index: str = None, queries=("climate change", "nice morning", "politics"), runs=5):
+    # print index size and the mean search latency of a few highlighted queries
+    field = "chunks.sentence" if INDEX_LAYOUT in ("episode", "nested") else "sentence"
+    for name in [index_name, compare_index]:
+        if name is None:
+            continue
+        stats = es.indices.stats(index=name, metric=["docs", "store"])["_all"]["primaries"]
+        took = []
+        for _ in range(runs):
+            for query in queries:
+                body = {
+                    "size": 10,
+                    "query": {"match": {field: {"query": query, "operator": "and"}}},
+                    "highlight": {"fields": {field: {"number_of_fragments": 1}}}
+                }
+                if INDEX_LAYOUT == "nested":
+                    # nested chunks are highlighted in the inner hit of their episode
+                    highlight = body.pop("highlight")
+                    body["query"] = {"nested": {"path": "chunks", "query": body["query"], "inner_hits": {"size": 1, "_source": False, "highlight": highlight}}}
+                response = es.search(index=name, body=body, request_cache=False)
+                took.append(response["took"])
+        print(f"📊 {name}: {stats['docs']['count']} docs, {stats['store']['size_in_bytes'] / 1024 / 1024:.1f} MB, "
+              f"mean search latency {sum(took) / len(took):.1f} ms over {len(took)} queries")
+
+
+def time_to_seconds(time_str):
+    # transcripts store times as "12.3s", parsed once here so everything downstream uses float seconds
+    return float(time_str.rstrip('s'))
+
+
 def find_sentence_chunks(data: list):
-    # get sentence chunks from word list, with appropriate startTime and endTime
+    # get sentence chunks from word list, with start_time and end_time in seconds
     if data is None or len(data) == 0:
         return []
     
@@ -46,17 +202,17 @@ def find_sentence_chunks(data: list):
         word = item['word']
         
         if not current_chunk:
-            chunk_start_time = item['startTime']
+            chunk_start_time = time_to_seconds(item['startTime'])
         
         current_chunk.append(word)
         
         if (re.search(r'[.!?;:,]$', word) or index == len(data) - 1):
             chunk_text = ' '.join(current_chunk)
-            chunk_end_time = item['endTime']
+            chunk_end_time = time_to_seconds(item['endTime'])
             
             chunks.append({
-                'startTime': chunk_start_time,
-                'endTime': chunk_end_time,
+                'start_time': chunk_start_time,
+                'end_time': chunk_end_time,
                 'sentence': chunk_text
             })
             current_chunk = []
@@ -66,68 +222,63 @@ def find_sentence_chunks(data: list):
 
 def get_30s_chunks(chunks: list):
     # Get 30s segments from sentence chunks
-    def time_to_seconds(time_str):
-        return float(time_str.rstrip('s'))
-    
     merged_chunks = []
     current_chunk = {
-        'startTime': None,
-        'endTime': None,
+        'start_time': None,
+        'end_time': None,
         'sentence': '',
         'duration': 0
     }
     
     for chunk in chunks:
-        start_seconds = time_to_seconds(chunk['startTime'])
-        end_seconds = time_to_seconds(chunk['endTime'])
-        chunk_duration = end_seconds - start_seconds
+        chunk_duration = chunk['end_time'] - chunk['start_time']
 
-        if current_chunk['startTime'] is None:
-            current_chunk['startTime'] = chunk['startTime']
+        if current_chunk['start_time'] is None:
+            current_chunk['start_time'] = chunk['start_time']
             current_chunk['sentence'] = chunk['sentence']
             current_chunk['duration'] = chunk_duration
-            current_chunk['endTime'] = chunk['endTime']
+            current_chunk['end_time'] = chunk['end_time']
         else:
             tduration = current_chunk['duration'] + chunk_duration
             if tduration >= 28: 
                 if abs(30 - tduration) < abs(30 - current_chunk['duration']):
                     current_chunk['sentence'] += ' ' + chunk['sentence']
-                    current_chunk['endTime'] = chunk['endTime']
+                    current_chunk['end_time'] = chunk['end_time']
                     current_chunk['duration'] = tduration
 
                     merged_chunks.append({
-                        'startTime': current_chunk['startTime'],
-                        'endTime': current_chunk['endTime'],
+                        'start_time': current_chunk['start_time'],
+                        'end_time': current_chunk['end_time'],
                         'sentence': current_chunk['sentence'],
                         'duration': current_chunk['duration']
                     })
 
                     current_chunk = {
-                        'startTime': None,
-                        'endTime': None,
+                        'start_time': None,
+                        'end_time': None,
                         'sentence': '',
                         'duration': 0
                     }
 
                 if abs(30 - tduration) >= abs(30 - current_chunk['duration']):
                     merged_chunks.append({
-                        'startTime': current_chunk['startTime'],
-                        'endTime': current_chunk['endTime'],
+                        'start_time': current_chunk['start_time'],
+                        'end_time': current_chunk['end_time'],
                         'sentence': current_chunk['sentence'],
                         'duration': current_chunk['duration']
                     })
                     current_chunk = {
-                        'startTime': chunk['startTime'],
-                        'endTime': chunk['endTime'],
+                        'start_time': chunk['start_time'],
+                        'end_time': chunk['end_time'],
                         'sentence': chunk['sentence'],
                         'duration': chunk_duration
                     }
             else:
                 current_chunk['sentence'] += ' ' + chunk['sentence']
-                current_chunk['endTime'] = chunk['endTime']
+                current_chunk['end_time'] = chunk['end_time']
                 current_chunk['duration'] = tduration
     
-    if current_chunk['startTime'] is not None:
+    if current_chunk['start_time'] is not None:
         merged_chunks.append(current_chunk)
     
     return merged_chunks
@@ -173,20 +324,296 @@ def format_json(input_file):
 
     return output
 
-def main():
+def format_chunk_docs(episode_doc: dict):
+    # split an episode document into one document per ~30s chunk
+    return [
+        {
+            'episode_id': episode_doc['episode_id'],
+            'show_id': episode_doc['show_id'],
+            'chunk_index': chunk_index,
+            'start_time': chunk['start_time'],
+            'end_time': chunk['end_time'],
+            'sentence': chunk['sentence']
+        }
+        for chunk_index, chunk in enumerate(episode_doc['chunks'])
+    ]
+
+
+def format_nested_doc(episode_doc: dict):
+    # episode document with the position of every chunk, returned by nested queries as chunk_index
+    return {
+        **episode_doc,
+        'chunks': [{**chunk, 'chunk_index': chunk_index} for chunk_index, chunk in enumerate(episode_doc['chunks'])]
+    }
+
+
+def get_window_starts(num_chunks: int, chunks_per_window: int):
+    # first chunk of every window, sliding by half a window, the last window ends on the last chunk
+    if num_chunks <= chunks_per_window:
+        return [0] if num_chunks else []
+    stride = max(chunks_per_window // 2, 1)
+    starts = list(range(0, num_chunks - chunks_per_window + 1, stride))
+    if starts[-1] != num_chunks - chunks_per_window:
+        starts.append(num_chunks - chunks_per_window)
+    return starts
+
+
+def format_window_docs(chunk_docs: list):
+    # precomputed windows of every size in WINDOW_SIZES, chunk_index is the first chunk of the window
+    windows = []
+    for window_size in WINDOW_SIZES:
+        chunks_per_window = window_size // 30
+        for start in get_window_starts(len(chunk_docs), chunks_per_window):
+            selected_chunks = chunk_docs[start:start + chunks_per_window]
+            windows.append({
+                'episode_id': selected_chunks[0]['episode_id'],
+                'show_id': selected_chunks[0]['show_id'],
+                'window_size': window_size,
+                'chunk_index': start,
+                'start_time': selected_chunks[0]['start_time'],
+                'end_time': selected_chunks[-1]['end_time'],
+                'sentence': ' '.join(chunk['sentence'] for chunk in selected_chunks)
+            })
+    return windows
+
+
+def get_doc_id(doc: dict):
+    # deterministic ids so that re-indexing a transcript overwrites its documents
+    if 'window_size' in doc:
+        return f"{doc['episode_id']}_{doc['window_size']}_{doc['chunk_index']}"
+    if 'chunk_index' in doc:
+        return f"{doc['episode_id']}_{doc['chunk_index']}"
+    return doc['episode_id']
+
+
+def get_manifest_path(index_name: str):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), f"{index_name}_manifest.json")
+
+
+def load_manifest(path: str, index_name: str):
+    # manifest: source file -> size, mtime and number of documents of the last successful indexing
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('index') == index_name:
+            return manifest
+        print(f"ℹ️ Manifest {path} belongs to index '{manifest.get('index')}', ignoring it.")
+    return {'index': index_name, 'files': {}}
+
+
+def save_manifest(path: str, manifest: dict):
+    # write to a temporary file first so that a crash never leaves a truncated manifest
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def get_file_signature(file: str):
+    stat = os.stat(file)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def get_changed_files(json_files, manifest: dict):
+    # new transcripts and transcripts whose size or mtime changed since they were indexed
+    changed = []
+    for file in json_files:
+        entry = manifest['files'].get(file)
+        signature = get_file_signature(file)
+        if entry is None or entry['size'] != signature['size'] or entry['mtime'] != signature['mtime']:
+            changed.append(file)
+    print(f"ℹ️ {len(changed)} new or changed files / {len(json_files)}")
+    return changed
+
+
+def get_file_actions(file, formatted_doc, index_name, manifest):
+    # index actions for one transcript, plus deletes for chunks and windows that no longer exist
+    if formatted_doc == {}:
+        return []
+    if INDEX_LAYOUT == "episode":
+        docs = [formatted_doc]
+    elif INDEX_LAYOUT == "nested":
+        docs = [format_nested_doc(formatted_doc)]
+    else:
+        docs = format_chunk_docs(formatted_doc)
+    actions = [{"_index": index_name, "_id": get_doc_id(doc), "_source": doc} for doc in docs]
+
+    episode_id = formatted_doc['episode_id']
+    previous_docs = manifest['files'].get(file, {}).get('docs', 0)
+    if INDEX_LAYOUT not in ("episode", "nested"):
+        actions += [
+            {"_op_type": "delete", "_index": index_name, "_id": f"{episode_id}_{chunk_index}"}
+            for chunk_index in range(len(docs), previous_docs)
+        ]
+
+    if INDEX_LAYOUT == "window":
+        windows = format_window_docs(docs)
+        actions += [{"_index": WINDOW_INDEX_NAME, "_id": get_doc_id(window), "_source": window} for window in windows]
+        window_ids = {action["_id"] for action in actions if action["_index"] == WINDOW_INDEX_NAME}
+        previous_window_ids = {
+            f"{episode_id}_{window_size}_{start}"
+            for window_size in WINDOW_SIZES
+            for start in get_window_starts(previous_docs, window_size // 30)
+        }
+        actions += [
+            {"_op_type": "delete", "_index": WINDOW_INDEX_NAME, "_id": window_id}
+            for window_id in sorted(previous_window_ids - window_ids)
+        ]
+    return actions
+
+
+def count_docs(actions, index_name):
+    # number of documents of the main index, recorded in the manifest
+    return sum(1 for action in actions if "_source" in action and action["_index"] == index_name)
+
+
+def commit_files(files, docs_per_file, failed_files, manifest, manifest_path):
+    for file in files:
+        if file not in failed_files:
+            manifest['files'][file] = {**get_file_signature(file), 'docs': docs_per_file.get(file, 0)}
+    save_manifest(manifest_path, manifest)
+
+
+def get_index_actions(batch, pool, index_name, manifest, stats, docs_per_file, file_of_id, failed_files):
+    # parse one batch of transcripts in the process pool and yield its bulk actions
+    for file, formatted_doc in zip(batch, pool.map(format_json, batch, chunksize=4)):
+        stats['files'] += 1
+        stats['bytes'] += os.path.getsize(file)
+        if formatted_doc == {}:
+            # transcripts that could not be parsed stay out of the manifest, the next run retries them
+            failed_files.add(file)
+        actions = get_file_actions(file, formatted_doc, index_name, manifest)
+        docs_per_file[file] = count_docs(actions, index_name)
+        for action in actions:
+            file_of_id[action["_id"]] = file
+            yield action
+
+
+def set_bulk_load_settings(index_name: str, enabled: bool, previous: dict = None):
+    # disable refresh and replicas while loading, put the previous values back afterwards
+    if enabled:
+        current = es.indices.get_settings(index=index_name)[index_name]["settings"]["index"]
+        es.indices.put_settings(index=index_name, settings={"index": {"refresh_interval": "-1", "number_of_replicas": 0}})
+        return {
+            "refresh_interval": current.get("refresh_interval", "1s"),
+            "number_of_replicas": current.get("number_of_replicas", "1")
+        }
+
+    es.indices.put_settings(index=index_name, settings={"index": previous})
+    es.indices.refresh(index=index_name)
+    return previous
+
+
+def bulk_index(json_files, index_name, manifest, manifest_path, workers=BULK_PARSE_WORKERS, threads=BULK_THREADS,
+               chunk_size=BULK_CHUNK_SIZE, max_chunk_bytes=BULK_MAX_CHUNK_BYTES):
+    # Files are submitted in batches so parsed documents don't pile up in memory when
+    # Elasticsearch is slower than the parsers. The manifest is saved after every batch,
+    # so a crashed run resumes from the last committed batch.
+    stats = {'files': 0, 'bytes': 0}
+    indexed, failed = 0, 0
+    batch_size = workers * 16
+
+    target_indexes = [index_name] + ([WINDOW_INDEX_NAME] if INDEX_LAYOUT == "window" else [])
+    previous_settings = {name: set_bulk_load_settings(name, True) for name in target_indexes}
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool, tqdm(total=len(json_files), desc="Indexing files") as progress:
+            for batch_start in range(0, len(json_files), batch_size):
+                batch = json_files[batch_start:batch_start + batch_size]
+                docs_per_file, file_of_id, failed_files = {}, {}, set()
+
+                actions = get_index_actions(batch, pool, index_name, manifest, stats, docs_per_file, file_of_id, failed_files)
+                for ok, info in parallel_bulk(es, actions, thread_count=threads, chunk_size=chunk_size,
+                                              max_chunk_bytes=max_chunk_bytes, raise_on_error=False,
+                                              raise_on_exception=False):
+                    op, result = next(iter(info.items()))
+                    if ok:
+                        if op != "delete":
+                            indexed += 1
+                    elif op == "delete" and result.get("status") == 404:
+                        continue
+                    else:
+                        failed += 1
+                        failed_files.add(file_of_id.get(result.get("_id")))
+                        print(f"❌ Failed to index document: {info}")
+
+                commit_files(batch, docs_per_file, failed_files, manifest, manifest_path)
+                progress.update(len(batch))
+    finally:
+        for name in target_indexes:
+            set_bulk_load_settings(name, False, previous_settings[name])
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ {indexed} documents indexed ({failed} failed) from {stats['files']} files in {elapsed:.1f}s")
+    if elapsed > 0:
+        print(f"   {indexed / elapsed:.1f} docs/s, {stats['bytes'] / elapsed / 1024 / 1024:.2f} MB/s of transcripts")
+
+
+def main(bulk=False, full=False, report=False, compare_index=None, **bulk_options):
     json_files = get_n_json_files_from_nested_folders(PARENT_FOLDER, n=ONLY_USE_N_JSON)
 
-    create_index(INDEX_NAME)
-    for file in tqdm(json_files, desc="Indexing files"):
+    if INDEX_LAYOUT == "episode":
+        index_name = INDEX_NAME
+        put_transcript_template()
+        create_index(index_name)
+    elif INDEX_LAYOUT == "nested":
+        index_name = NESTED_INDEX_NAME
+        create_index(index_name, NESTED_INDEX_BODY)
+    else:
+        index_name = CHUNK_INDEX_NAME
+        create_index(index_name, CHUNK_INDEX_BODY)
+    if INDEX_LAYOUT == "window":
+        create_index(WINDOW_INDEX_NAME, WINDOW_INDEX_BODY)
+
+    # the window layout writes both indexes, so it keeps its own manifest
+    manifest_name = WINDOW_INDEX_NAME if INDEX_LAYOUT == "window" else index_name
+    manifest_path = get_manifest_path(manifest_name)
+    manifest = {'index': manifest_name, 'files': {}} if full else load_manifest(manifest_path, manifest_name)
+    json_files = get_changed_files(json_files, manifest)
+
+    if bulk:
+        bulk_index(json_files, index_name, manifest, manifest_path, **bulk_options)
+    else:
+        index_one_by_one(json_files, index_name, manifest, manifest_path)
+
+    if report:
+        report_index(index_name, compare_index)
+
+
+def index_one_by_one(json_files, index_name, manifest, manifest_path):
+    docs_per_file, failed_files = {}, set()
+    for n, file in enumerate(tqdm(json_files, desc="Indexing files"), start=1):
         formatted_doc = format_json(file)
         if formatted_doc == {}:
-            continue
-        es.index(index=INDEX_NAME, document=formatted_doc)
+            # transcripts that could not be parsed stay out of the manifest, the next run retries them
+            failed_files.add(file)
+        actions = get_file_actions(file, formatted_doc, index_name, manifest)
+        for action in actions:
+            if action.get("_op_type") == "delete":
+                es.options(ignore_status=404).delete(index=action["_index"], id=action["_id"])
+            else:
+                es.index(index=action["_index"], id=action["_id"], document=action["_source"])
+        docs_per_file[file] = count_docs(actions, index_name)
 
-    print(f"✅ All documents indexed into Elasticsearch in {INDEX_NAME}.")
+        if n % 100 == 0 or n == len(json_files):
+            commit_files(list(docs_per_file), docs_per_file, failed_files, manifest, manifest_path)
+            docs_per_file = {}
+
+    print(f"✅ All documents indexed into Elasticsearch in {index_name}.")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index the podcast transcripts into Elasticsearch.")
+    parser.add_argument("--bulk", action="store_true", help="parse in a process pool and index with parallel_bulk")
+    parser.add_argument("--workers", type=int, default=BULK_PARSE_WORKERS, help="processes parsing the transcripts")
+    parser.add_argument("--threads", type=int, default=BULK_THREADS, help="threads sending bulk requests")
+    parser.add_argument("--chunk-size", type=int, default=BULK_CHUNK_SIZE, help="documents per bulk request")
+    parser.add_argument("--max-chunk-bytes", type=int, default=BULK_MAX_CHUNK_BYTES, help="maximum size of a bulk request")
+    parser.add_argument("--full", action="store_true", help="ignore the manifest and re-index every transcript")
+    parser.add_argument("--report", action="store_true", help="print index size and search latency at the end")
+    parser.add_argument("--compare-index", help="other transcript index to compare size and latency with, e.g. an index created before the template")
+    args = parser.parse_args()
+
     load_dotenv()
     es = Elasticsearch(
         os.getenv("ELASTICSEARCH_URL"),
@@ -198,4 +625,5 @@ if __name__ == "__main__":
         print("✅ Elasticsearch is up and running.")
     else:
         print("❌ Can't connect to Elasticsearch.")
-    main()
+    main(bulk=args.bulk, full=args.full, report=args.report, compare_index=args.compare_index, workers=args.workers, threads=args.threads,
+         chunk_size=args.chunk_size, max_chunk_bytes=args.max_chunk_bytes)
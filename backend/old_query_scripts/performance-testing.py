@@ -1,10 +1,12 @@
 # filepath: /home/lpa/master/search_engines/SE_podcast_search/backend/performance_test.py
+import os
 import requests
 import time
 from itertools import product
 import pandas as pd
 
-API_URL = "http://127.0.0.1:5000/search"
+# dev server (python app.py) and production server (python wsgi.py) both listen on port 5000 by default
+API_URL = os.getenv("API_URL", "http://127.0.0.1:5000/search")
 
 # No misspellings
 #q = ["morning", "terror", "change", "tomorrwow", "politics"]
@@ -26,6 +28,20 @@ parameter_combinations = list(product(q, types, times, filters, selected_episode
 
 results = []
 
+# BATCH=1 sends every combination in one request to /search/batch instead
+if os.getenv("BATCH") == "1":
+    payloads = [
+        {"q": query, "type": query_type, "time": time_chunk, "filter": filter_type, "selectedEpisodes": episodes}
+        for query, query_type, time_chunk, filter_type, episodes in parameter_combinations
+    ]
+    start_time = time.time()
+    response = requests.post(API_URL.rstrip("/") + "/batch", json=payloads)
+    latency = (time.time() - start_time) * 1000
+    items = response.json() if response.status_code == 200 else []
+    errors = sum("error" in item for item in items)
+    print(f"{len(payloads)} queries in {latency:.0f} ms ({latency / len(payloads):.1f} ms per query), {errors} errors")
+    raise SystemExit
+
 # Run each combination
 for combination in parameter_combinations:
     query, query_type, time_chunk, filter_type, episodes = combination
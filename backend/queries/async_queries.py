@@ -0,0 +1,220 @@
+"""
+asyncio versions of the /search pipeline, on AsyncElasticsearch, used by asgi.py.
+
+They reuse the body builders, caches and formatters of the sync query modules and only
+change how the requests are sent: in speculative mode (SPECULATIVE_SUGGEST) the first search
+and the term suggest go out concurrently, and the metadata of the first hits is fetched while
+the suggestion fallback runs. The chunk and nested layouts keep their sync implementation,
+run in a worker thread so that they don't block the event loop.
+"""
+import asyncio
+
+from elasticsearch import NotFoundError
+
+from config import get_es, get_async_es, SPECULATIVE_SUGGEST
+from queries import bm25, phrase, intersection, filter as episode_filter
+from queries.chunks import use_chunk_layout
+from queries.nested import use_nested_layout
+from queries.metadata import EPISODE_INDEX, lookup_metadata, build_metadata_mget, cache_metadata_docs
+from queries.suggestions import (
+    MAX_SUGGESTIONS,
+    build_term_suggest,
+    lookup_term_options,
+    get_options_per_term,
+    cache_terms,
+    rank_suggestions,
+    build_suggestion_searches,
+    merge_suggestion_hits,
+)
+
+
+async def get_suggested_queries(text, es, index_name, field="chunks.sentence", limit=MAX_SUGGESTIONS, **term_options):
+    """
+    Async get_suggested_queries: words already in the term cache are not suggested again.
+    """
+    cache_key, options_per_word, missing_text = lookup_term_options(text, index_name, field, **term_options)
+    try:
+        if missing_text:
+            suggest_query = {"suggest": build_term_suggest(missing_text, field, **term_options)}
+            response = await es.search(index=index_name, body=suggest_query, size=0)
+            options_per_word.update(cache_terms(cache_key, missing_text, response))
+    except (KeyError, IndexError) as e:
+        print(f"Error in suggestion query for: {text}")
+        print(e)
+        return []
+
+    return rank_suggestions(text, get_options_per_term(text, options_per_word), limit)
+
+
+async def search_suggestions(suggestions, build_body, hits, top_k, es, index_name):
+    """
+    Async search_suggestions: one _msearch for every suggestion, merged into `hits`.
+    """
+    if not suggestions or len(hits) >= top_k:
+        return hits
+
+    searches, searched = build_suggestion_searches(suggestions, build_body, index_name)
+    if not searches:
+        return hits
+    responses = (await es.msearch(searches=searches))["responses"]
+    return merge_suggestion_hits(searched, responses, hits, top_k)
+
+
+async def run_search(query_term, build_body, top_k, es, index_name, field="chunks.sentence", prefetch=None, speculative=None, **term_options):
+    """
+    Async search_with_suggestions and suggestion fallback: runs the first search, then, when
+    there are fewer than top_k hits, the term suggest of `query_term` and the searches of its
+    suggestions. In speculative mode the term suggest goes out concurrently with the first search.
+    `prefetch`, called on the first hits, runs alongside the fallback.
+    Returns the hits tagged with the query that found them.
+    """
+    if speculative is None:
+        speculative = SPECULATIVE_SUGGEST
+
+    body = build_body(query_term)
+    if body is None:
+        return []
+
+    if speculative:
+        response, suggestions = await asyncio.gather(
+            es.search(index=index_name, body=body),
+            get_suggested_queries(query_term, es, index_name, field, **term_options)
+        )
+    else:
+        response, suggestions = await es.search(index=index_name, body=body), None
+    hits = response["hits"]["hits"]
+    for hit in hits:
+        hit["_source"]["query"] = query_term
+
+    async def fallback(suggestions):
+        if suggestions is None:
+            suggestions = await get_suggested_queries(query_term, es, index_name, field, **term_options)
+        await search_suggestions(suggestions, build_body, hits, top_k, es, index_name)
+
+    if len(hits) < top_k:
+        tasks = [fallback(suggestions)]
+        if prefetch is not None and hits:
+            tasks.append(prefetch([hit["_source"] for hit in hits]))
+        await asyncio.gather(*tasks)
+    return hits
+
+
+async def bm25_query(query_term, es, top_k=10, chunk_size=30, selected_episodes=None, prefetch=None):
+    if selected_episodes:
+        build_body = lambda q: bm25.build_mlt_body(q, selected_episodes, top_k)
+    else:
+        build_body = lambda q: bm25.build_bm25_body(q, top_k)
+
+    hits = await run_search(query_term, build_body, top_k, es, bm25.INDEX_NAME, prefetch=prefetch)
+    # chunks come with the hits, so format_hits doesn't need a client here
+    return bm25.format_hits(hits, query_term, chunk_size=chunk_size)
+
+
+async def phrase_query(phrase_text, es, top_k=10, chunk_size=30, selected_episodes=None, prefetch=None):
+    if selected_episodes:
+        build_body = lambda q: phrase.build_mlt_body(q, selected_episodes, top_k)
+    else:
+        build_body = lambda q: phrase.build_phrase_body(q, top_k)
+
+    hits = await run_search(phrase_text, build_body, top_k, es, phrase.INDEX_NAME, prefetch=prefetch)
+    # chunks come with the hits, so format_hits doesn't need a client here
+    return phrase.format_hits(hits, chunk_size=chunk_size)
+
+
+async def intersection_query(query_term, chunk_size, es, selected_episodes=None, prefetch=None):
+    size = 10
+    n = int(chunk_size / 30)
+    if selected_episodes:
+        build_body = lambda q: intersection.build_mlt_body(q, selected_episodes, size)
+    else:
+        build_body = lambda q: intersection.build_query_body(q, size)
+
+    hits = await run_search(query_term, build_body, size, es, intersection.INDEX_NAME, prefetch=prefetch)
+    return intersection.format_hits(hits, query_term, n, mlt=bool(selected_episodes))
+
+
+async def search_episodes(query_text, search_field, es, index_name=episode_filter.INDEX_NAME, top_k=10):
+    if search_field not in ["show_name", "publisher", "episode_name"]:
+        raise ValueError("Invalid search_field. Must be one of: 'show_name', 'publisher', or 'episode_name'")
+
+    build_body = lambda text: episode_filter.build_episode_body(text, search_field, top_k)
+    hits = await run_search(query_text, build_body, top_k, es, index_name, field=search_field, **episode_filter.EPISODE_SUGGEST_OPTIONS)
+
+    if len(hits) < top_k:
+        mlt_response = await es.search(index=index_name, body=episode_filter.build_episode_mlt_body(query_text, search_field, top_k - len(hits)))
+        hits.extend(mlt_response["hits"]["hits"])
+
+    return episode_filter.format_hits(hits, query_text)
+
+
+async def metadata(transcripts, es):
+    """
+    Async metadata(): cached episodes plus one mget for the missing ones.
+    """
+    keys, found, missing = lookup_metadata(transcripts)
+    if missing:
+        try:
+            response = await es.mget(**build_metadata_mget(missing))
+        except NotFoundError:
+            print(f"Index '{EPISODE_INDEX}' does not exist, no metadata for {len(keys)} episodes")
+            return []
+        found.update(cache_metadata_docs(response["docs"]))
+
+    return [found[key] for key in keys if key in found]
+
+
+def run_sync_query(params):
+    """
+    Sync transcript query of the chunk layouts, same dispatch as app.handleType.
+    """
+    es = get_es()
+    match params["type"]:
+        case "Intersection":
+            return intersection.intersection_query(params["q"], params["time"], selected_episodes=params["selectedEpisodes"], es=es)
+        case "Phrase":
+            return phrase.phrase_query(phrase=params["q"], chunk_size=params["time"], selected_episodes=params["selectedEpisodes"], es=es)
+        case "Ranking":
+            return bm25.bm25_query(query_term=params["q"], chunk_size=params["time"], selected_episodes=params["selectedEpisodes"], es=es)
+        case _:
+            raise ValueError(f"Unsupported query type: {params['type']}")
+
+
+async def query_transcripts(params, es, prefetch=None):
+    if use_chunk_layout() or use_nested_layout():
+        return await asyncio.to_thread(run_sync_query, params)
+
+    match params["type"]:
+        case "Intersection":
+            return await intersection_query(params["q"], params["time"], es, selected_episodes=params["selectedEpisodes"], prefetch=prefetch)
+        case "Phrase":
+            return await phrase_query(params["q"], es, chunk_size=params["time"], selected_episodes=params["selectedEpisodes"], prefetch=prefetch)
+        case "Ranking":
+            return await bm25_query(params["q"], es, chunk_size=params["time"], selected_episodes=params["selectedEpisodes"], prefetch=prefetch)
+        case _:
+            raise ValueError(f"Unsupported query type: {params['type']}")
+
+
+async def search(params, es=None):
+    """
+    Async app.handleFilter: returns the same list of {"transcript", "metadata"} results.
+    """
+    if es is None:
+        es = get_async_es()
+
+    if params["filter"] != "general":
+        metadata_results = await search_episodes(params["q"], params["filter"], es)
+        return [{"transcript": {}, "metadata": meta} for meta in metadata_results]
+
+    # warms the metadata cache with the first hits while the suggestion fallback runs
+    prefetch = lambda sources: metadata(sources, es)
+    transcript_result = await query_transcripts(params, es, prefetch=prefetch)
+    metadata_results = await metadata(transcript_result, es)
+
+    metadata_by_episode = {(meta["show_id"], meta["episode_id"]): meta for meta in metadata_results}
+    return [
+        {
+            "transcript": transcript,
+            "metadata": metadata_by_episode.get((transcript["show_id"], transcript["episode_id"]), {})
+        }
+        for transcript in transcript_result
+    ]
@@ -0,0 +1,235 @@
+"""
+Batch version of /search: runs many search payloads with one request per stage for all
+of them instead of one request per stage and payload.
+
+Stages: first searches (_msearch), term suggests of the payloads with too few hits
+(_msearch, words in the term cache are skipped), suggestion searches (_msearch),
+more_like_this fallback of the episode filters (_msearch), formatting, and one metadata
+lookup for the episodes of every payload.
+"""
+from config import get_es
+from queries import bm25, phrase, intersection, filter as episode_filter
+from queries.chunks import CHUNK_INDEX_NAME, WINDOW_INDEX_NAME, use_chunk_layout, get_window_size, get_hit_chunks
+from queries.nested import NESTED_INDEX_NAME, use_nested_layout
+from queries.metadata import metadata
+from queries.suggestions import (
+    build_term_suggest,
+    lookup_term_options,
+    get_options_per_term,
+    cache_terms,
+    rank_suggestions,
+    build_suggestion_searches,
+    merge_suggestion_hits,
+)
+
+
+def get_query_plan(params, layout=None):
+    """
+    Describes how to run one /search payload: the body builder, the indices to search and to
+    suggest from, the number of hits wanted and the formatter of the hits.
+    """
+    q = params["q"]
+    chunk_size = params.get("time", 30)
+    selected = params.get("selectedEpisodes") or []
+
+    if params["filter"] != "general":
+        search_field = params["filter"]
+        if search_field not in ["show_name", "publisher", "episode_name"]:
+            raise ValueError("Invalid search_field. Must be one of: 'show_name', 'publisher', or 'episode_name'")
+        return {
+            "general": False,
+            "build_body": lambda text: episode_filter.build_episode_body(text, search_field, 10),
+            "mlt_body": lambda size: episode_filter.build_episode_mlt_body(q, search_field, size),
+            "index_name": episode_filter.INDEX_NAME,
+            "suggest_index": episode_filter.INDEX_NAME,
+            "field": search_field,
+            "term_options": episode_filter.EPISODE_SUGGEST_OPTIONS,
+            "top_k": 10,
+            "format": lambda hits, es: episode_filter.format_hits(hits, q),
+        }
+
+    plan = {"general": True, "mlt_body": None, "term_options": {}, "top_k": 10}
+    if use_chunk_layout(layout):
+        window_size = get_window_size(chunk_size, layout)
+        plan.update(
+            index_name=WINDOW_INDEX_NAME if window_size else CHUNK_INDEX_NAME,
+            suggest_index=CHUNK_INDEX_NAME,
+            field="sentence",
+        )
+        match params["type"]:
+            case "Ranking":
+                plan["build_body"] = lambda text: bm25.build_bm25_chunk_body(text, 10, selected, window_size)
+                plan["format"] = lambda hits, es: bm25.format_chunk_hits(hits, q, chunk_size, client=es, precomputed=window_size is not None)
+            case "Phrase":
+                if chunk_size not in [30, 60, 120, 180, 300]:
+                    raise ValueError("chunk_size must be one of [30, 60, 120, 180, 300] seconds")
+                plan["build_body"] = lambda text: phrase.build_phrase_chunk_body(text, 10, selected, window_size)
+                plan["format"] = lambda hits, es: phrase.format_chunk_hits(hits, chunk_size, es=es, precomputed=window_size is not None)
+            case "Intersection":
+                n = 1 if window_size else int(chunk_size / 30)
+                plan["build_body"] = lambda text: intersection.build_chunk_query_body(text, 10, selected, window_size)
+                plan["format"] = lambda hits, es: intersection.format_chunk_hits(get_hit_chunks(hits), q, n, client=es)
+            case _:
+                raise ValueError(f"Unsupported query type: {params['type']}")
+        return plan
+
+    if use_nested_layout(layout):
+        plan.update(index_name=NESTED_INDEX_NAME, suggest_index=NESTED_INDEX_NAME, field="chunks.sentence")
+        match params["type"]:
+            case "Ranking":
+                plan["build_body"] = lambda text: bm25.build_bm25_nested_body(text, 10, selected)
+                plan["format"] = lambda hits, es: bm25.format_nested_hits(hits, q, chunk_size, client=es)
+            case "Phrase":
+                if chunk_size not in [30, 60, 120, 180, 300]:
+                    raise ValueError("chunk_size must be one of [30, 60, 120, 180, 300] seconds")
+                plan["build_body"] = lambda text: phrase.build_phrase_nested_body(text, 10, selected)
+                plan["format"] = lambda hits, es: phrase.format_nested_hits(hits, chunk_size, es=es)
+            case "Intersection":
+                n = max(int(chunk_size / 30), 1)
+                plan["build_body"] = lambda text: intersection.build_nested_query_body(text, 10, selected)
+                plan["format"] = lambda hits, es: intersection.format_nested_hits(hits, q, n, client=es)
+            case _:
+                raise ValueError(f"Unsupported query type: {params['type']}")
+        return plan
+
+    plan.update(index_name=bm25.INDEX_NAME, suggest_index=bm25.INDEX_NAME, field="chunks.sentence")
+    match params["type"]:
+        case "Ranking":
+            plan["build_body"] = (lambda text: bm25.build_mlt_body(text, selected, 10)) if selected else (lambda text: bm25.build_bm25_body(text, 10))
+            plan["format"] = lambda hits, es: bm25.format_hits(hits, q, chunk_size=chunk_size, client=es)
+        case "Phrase":
+            if chunk_size not in [30, 60, 120, 180, 300]:
+                raise ValueError("chunk_size must be one of [30, 60, 120, 180, 300] seconds")
+            plan["build_body"] = (lambda text: phrase.build_mlt_body(text, selected, 10)) if selected else (lambda text: phrase.build_phrase_body(text, 10))
+            plan["format"] = lambda hits, es: phrase.format_hits(hits, chunk_size=chunk_size, es=es)
+        case "Intersection":
+            n = int(chunk_size / 30)
+            plan["build_body"] = (lambda text: intersection.build_mlt_body(text, selected, 10)) if selected else (lambda text: intersection.build_query_body(text, 10))
+            plan["format"] = lambda hits, es: intersection.format_hits(hits, q, n, mlt=bool(selected))
+        case _:
+            raise ValueError(f"Unsupported query type: {params['type']}")
+    return plan
+
+
+def run_msearch(es, searches):
+    """
+    Sends the (header, body) pairs of several items in one _msearch.
+    Returns the responses, in the order of the searches.
+    """
+    if not searches:
+        return []
+    lines = [line for header, body in searches for line in (header, body)]
+    return es.msearch(searches=lines)["responses"]
+
+
+def run_batch(payloads, es=None, layout=None):
+    """
+    Runs a list of /search payloads. Returns, in the same order, {"results": [...]} with the
+    results /search would return, or {"error": "..."} for the payloads that failed.
+    """
+    if es is None:
+        es = get_es()
+
+    items = []
+    for params in payloads:
+        item = {"params": params, "hits": [], "error": None}
+        try:
+            item["plan"] = get_query_plan(params, layout)
+            item["body"] = item["plan"]["build_body"](params["q"])
+        except (KeyError, TypeError, ValueError) as e:
+            item["error"] = f"Invalid search payload: {e!r}"
+        items.append(item)
+
+    def active(condition=lambda item: True):
+        return [item for item in items if item["error"] is None and condition(item)]
+
+    # Stage 1: first search of every payload
+    first = active(lambda item: item["body"] is not None)
+    responses = run_msearch(es, [({"index": item["plan"]["index_name"]}, item["body"]) for item in first])
+    for item, response in zip(first, responses):
+        if "error" in response:
+            item["error"] = str(response["error"])
+            continue
+        item["hits"] = response["hits"]["hits"]
+        for hit in item["hits"]:
+            hit["_source"]["query"] = item["params"]["q"]
+
+    # Stage 2: term suggest of the words not in the term cache, for payloads with too few hits
+    short = active(lambda item: item["body"] is not None and len(item["hits"]) < item["plan"]["top_k"])
+    to_suggest = []
+    for item in short:
+        plan = item["plan"]
+        item["cache_key"], item["options_per_word"], item["missing_text"] = lookup_term_options(
+            item["params"]["q"], plan["suggest_index"], plan["field"], **plan["term_options"]
+        )
+        if item["missing_text"]:
+            to_suggest.append(item)
+    # payloads with the same words (e.g. one query in several types) share one suggest
+    unique = list({(item["cache_key"], item["missing_text"]): item for item in to_suggest}.values())
+    responses = run_msearch(es, [
+        ({"index": item["plan"]["suggest_index"]},
+         {"size": 0, "suggest": build_term_suggest(item["missing_text"], item["plan"]["field"], **item["plan"]["term_options"])})
+        for item in unique
+    ])
+    suggested = {}
+    for item, response in zip(unique, responses):
+        try:
+            suggested[(item["cache_key"], item["missing_text"])] = cache_terms(item["cache_key"], item["missing_text"], response)
+        except (KeyError, IndexError) as e:
+            print(f"Error in suggestion query for: {item['params']['q']}")
+            print(e)
+    for item in to_suggest:
+        item["options_per_word"].update(suggested.get((item["cache_key"], item["missing_text"]), {}))
+
+    # Stage 3: searches of the suggestions of every short payload
+    searches = []
+    for item in short:
+        words = item["params"]["q"].split()
+        if not all(word in item["options_per_word"] for word in words):
+            continue
+        suggestions = rank_suggestions(item["params"]["q"], get_options_per_term(item["params"]["q"], item["options_per_word"]))
+        lines, item["searched"] = build_suggestion_searches(suggestions, item["plan"]["build_body"], item["plan"]["index_name"])
+        searches += [(lines[i], lines[i + 1]) for i in range(0, len(lines), 2)]
+    responses = iter(run_msearch(es, searches))
+    for item in short:
+        item_responses = [next(responses) for _ in item.get("searched", [])]
+        merge_suggestion_hits(item.get("searched", []), item_responses, item["hits"], item["plan"]["top_k"])
+
+    # Stage 4: more_like_this fallback of the episode filters
+    mlt = active(lambda item: item["plan"]["mlt_body"] is not None and len(item["hits"]) < item["plan"]["top_k"])
+    responses = run_msearch(es, [
+        ({"index": item["plan"]["index_name"]}, item["plan"]["mlt_body"](item["plan"]["top_k"] - len(item["hits"])))
+        for item in mlt
+    ])
+    for item, response in zip(mlt, responses):
+        if "error" not in response:
+            item["hits"].extend(response["hits"]["hits"])
+
+    # Stage 5: formatting (window fetches of the chunk layouts happen here)
+    for item in active():
+        try:
+            item["results"] = item["plan"]["format"](item["hits"], es)
+        except Exception as e:
+            item["error"] = str(e)
+
+    # Stage 6: metadata of the episodes of every general payload in one lookup
+    general = active(lambda item: item["plan"]["general"])
+    transcripts = [transcript for item in general for transcript in item["results"]]
+    metadata_results = metadata(transcripts, es=es) if transcripts else []
+    metadata_by_episode = {(meta["show_id"], meta["episode_id"]): meta for meta in metadata_results}
+
+    output = []
+    for item in items:
+        if item["error"] is not None:
+            output.append({"error": item["error"]})
+        elif item["plan"]["general"]:
+            output.append({"results": [
+                {
+                    "transcript": transcript,
+                    "metadata": metadata_by_episode.get((transcript["show_id"], transcript["episode_id"]), {})
+                }
+                for transcript in item["results"]
+            ]})
+        else:
+            output.append({"results": [{"transcript": {}, "metadata": meta} for meta in item["results"]]})
+    return output
@@ -1,6 +1,9 @@
 from config import get_es
+from queries.suggestions import get_suggested_queries, search_suggestions, search_with_suggestions
+from queries.highlight import highlight_query
+from queries.chunks import CHUNK_INDEX_NAME, CHUNK_SOURCE, WINDOW_INDEX_NAME, use_chunk_layout, get_window_size, filter_window_size, collapse_by_episode, get_hit_chunk, get_chunk_ranges, get_window_range, get_window_slice, build_window, format_window
+from queries.nested import NESTED_INDEX_NAME, NESTED_SOURCE, use_nested_layout, nested_chunks_query, get_nested_hit_chunks, get_nested_chunk_ranges
 import re
-import itertools
 
 INDEX_NAME = "podcast_transcripts"
 
@@ -8,112 +11,54 @@ def strip_highlight_tags(text):
     return re.sub(r"</?em>", "", text or "")
 
 def highlight_words(text, phrase):
-    words = phrase.strip().split()
+    return highlight_query(text, phrase)
 
-    for word in words:
-        pattern = re.compile(rf'\b({re.escape(word)})\b', flags=re.IGNORECASE)
-        text = pattern.sub(r'<mark><strong><em>\1</em></strong></mark>', text)
-    return text
 
+def get_chunks_by_episodes(episode_ids, index_name, es=None, debug=True):
+    """
+    Fetches the chunks of several episodes with a single terms query.
+    Returns a dict episode_id -> list of chunks.
+    """
+    if es is None:
+        es = get_es()
+
+    episode_ids = list(dict.fromkeys(episode_ids))
+    if not episode_ids:
+        return {}
 
-def get_chunks_by_episode(episode_id, index_name, es=None, debug=True):
     query = {
         "query": {
-            "term": {
-                "episode_id.keyword": episode_id
+            "terms": {
+                "episode_id": episode_ids
             }
         },
         "_source": ["show_id", "episode_id", "chunks"]
     }
 
-    response = es.search(index=index_name, body=query, size=1)
+    response = es.search(index=index_name, body=query, size=len(episode_ids))
 
-    hits = response.get("hits", {}).get("hits", [])
-    if not hits:
-        if debug:
-            print(f"No document found for episode_id: {episode_id}")
-        return []
-
-    source = hits[0]["_source"]
-    chunks = source.get("chunks", [])
-
-    results = []
-    for chunk in chunks:
-        results.append({
-            "sentence": chunk.get("sentence"),
-            "startTime": chunk.get("startTime"),
-            "endTime": chunk.get("endTime")
-        })
-
-    return results
-
-
-def get_suggested_query(query_term, client, index_name):
-    """
-    Runs a suggest query and returns the corrected phrase, if different.
-    """
-    suggest_query = {
-        "suggest": {
-            "suggestion": {
-                "text": query_term,
-                "term": {
-                    "field": "chunks.sentence",
-                    "suggest_mode": "always",
-                    "min_word_length": 2,
-                    "max_edits": 2,
-                    "prefix_length": 1
-                }
+    chunks_by_episode = {}
+    for hit in response.get("hits", {}).get("hits", []):
+        source = hit["_source"]
+        chunks_by_episode[source["episode_id"]] = [
+            {
+                "sentence": chunk.get("sentence"),
+                "start_time": chunk.get("start_time"),
+                "end_time": chunk.get("end_time")
             }
-        }
-    }
-
-    try:
-        suggest_response = client.search(index=index_name, body=suggest_query)
-        suggestions = suggest_response["suggest"]["suggestion"]
-        sugested_words = []
-        sugested_scores = []
-        words = []
-        scores = []
-        for entry in suggestions: 
-            if len(entry["options"]) > 0:
-                for word in entry["options"]:
-                    words.append(word["text"])
-                    scores.append(word["score"])
-            else:
-                words.append(entry["text"])
-                scores.append(1)
-            sugested_words.append(words)
-            sugested_scores.append(scores)
-            words = []
-            scores = []
-
-        combinations = [' '.join(combo) for combo in itertools.product(*sugested_words)]
-        scores = [sum(combo) for combo in itertools.product(*sugested_scores)]
-
-
-        dict_combinations = {}
-        for i in range(len(combinations)):
-            dict_combinations[combinations[i]] = scores[i]
-        
-        dict_combinations = dict(sorted(dict_combinations.items(), key=lambda item: item[1], reverse=True))
-        print(dict_combinations)
-        
+            for chunk in source.get("chunks", [])
+        ]
 
-        return list(dict_combinations.keys())
+    if debug:
+        for episode_id in episode_ids:
+            if episode_id not in chunks_by_episode:
+                print(f"No document found for episode_id: {episode_id}")
 
-    except (KeyError, IndexError) as e:
-        print(f"Error in suggestion query for: {query_term}")
-        print(e)
+    return chunks_by_episode
 
-        return []
-
-
-def bm25_search(query_term, index_name, top_k=1, es=None):
-    
-    if es is None:
-        es = get_es()
 
-    query_body = {
+def build_bm25_body(query_term, top_k=1):
+    return {
         "size": top_k,
         "query": {
             "function_score": {
@@ -149,19 +94,17 @@ def bm25_search(query_term, index_name, top_k=1, es=None):
         }
     }
 
-    response = es.search(index=index_name, body=query_body)
-    return response
-
 
-def mlt_search(query_term, selected_chunks, client, index_name, size=10):
+def build_mlt_body(query_term, selected_chunks, size=10):
     """
-    Runs a 'more_like_this' query using chunks marked as relevant, combined with a boosted match query to reinforce the original search intent.
+    Body of a 'more_like_this' query using chunks marked as relevant, combined with a boosted match query to reinforce the original search intent.
+    Returns None when no chunk has text.
     """
     like_text = [chunk["transcript"]["chunk"] for chunk in selected_chunks if "transcript" in chunk and "chunk" in chunk["transcript"]]
     if not like_text:
-        return []
+        return None
 
-    query_body = {
+    return {
         "size": size,
         "query": {
             "bool": {
@@ -185,47 +128,21 @@ def mlt_search(query_term, selected_chunks, client, index_name, size=10):
             }
         }
     }
-    response = client.search(index=index_name, body=query_body)
-    hits = response.get("hits", {}).get("hits", [])
-    for hit in hits:
-        hit["_source"]["query"] = query_term
-    return hits
 
 
-def add_chunks_together(chunks, matched_chunk, chunk_size=30):
-   
-    chunks_to_merge = chunk_size // 30
-    matched_idx = next((i for i, chunk in enumerate(chunks) 
-                        if chunk.get("sentence") == matched_chunk), None)
-    
-    if matched_idx is None:
+def add_chunks_together(chunks, matched_idx, chunk_size=30):
+    """
+    Joins the chunk at position `matched_idx` with its neighbours into a ~chunk_size window.
+    """
+    if matched_idx is None or not 0 <= matched_idx < len(chunks):
         return {}
-    
-    left_idx = matched_idx - 1
-    right_idx = matched_idx + 1
-    count = 1 
-    selected_indices = [matched_idx]
 
-    while count < chunks_to_merge:
-        
-        if left_idx >= 0:
-            selected_indices.insert(0, left_idx)
-            left_idx -= 1
-            count += 1
-        
-        if count < chunks_to_merge and right_idx < len(chunks):
-            selected_indices.append(right_idx)
-            right_idx += 1
-            count += 1
-
-        if left_idx < 0 and right_idx >= len(chunks):
-            break
-    
-    selected_chunks = [chunks[i] for i in selected_indices]
+    start, stop = get_window_slice(len(chunks), matched_idx, max(chunk_size // 30, 1))
+    selected_chunks = chunks[start:stop]
     
     combined_sentence = ' '.join([chunk.get('sentence', '') for chunk in selected_chunks])
-    start_time = selected_chunks[0].get('startTime', None)
-    end_time = selected_chunks[-1].get('endTime', None)
+    start_time = selected_chunks[0].get('start_time', None)
+    end_time = selected_chunks[-1].get('end_time', None)
 
     return {
         'start_time': start_time,
@@ -234,22 +151,36 @@ def add_chunks_together(chunks, matched_chunk, chunk_size=30):
     }
 
 
+def get_best_chunk_index(chunks, highlight_clean):
+    """
+    Position of the first chunk containing the highlighted fragment, 0 when there is none.
+    """
+    if highlight_clean:
+        highlight_lower = highlight_clean.lower()
+        for i, chunk in enumerate(chunks):
+            if highlight_lower in chunk["sentence"].lower():
+                return i
+    return 0 if chunks else None
+
+
 def format_hits(hits, query_term, chunk_size=3, client=None, index_name=INDEX_NAME):
+    """
+    Builds the n-second window of every hit from the chunks already returned in its _source.
+    Hits that came back without chunks are completed with one batched lookup.
+    """
+    missing = [hit["_source"]["episode_id"] for hit in hits if "chunks" not in hit["_source"]]
+    fetched_chunks = get_chunks_by_episodes(missing, index_name, es=client) if missing else {}
+
     results = []
     
     for hit in hits:
         source = hit["_source"]
+        all_chunks_result = source.get("chunks") or fetched_chunks.get(source["episode_id"], [])
         highlight_raw = hit.get("highlight", {}).get("chunks.sentence", [None])[0]
         highlight_clean = strip_highlight_tags(highlight_raw)
 
-        best_chunk = next(
-            (chunk for chunk in source.get("chunks", []) 
-             if highlight_clean and highlight_clean.lower() in chunk["sentence"].lower()),
-            source.get("chunks", [{}])[0]
-        )
-        
-        all_chunks_result = get_chunks_by_episode(source["episode_id"], index_name, es=client, debug=True)
-        n_chunks_result = add_chunks_together(all_chunks_result, best_chunk.get("sentence"), chunk_size = chunk_size)
+        best_idx = get_best_chunk_index(all_chunks_result, highlight_clean)
+        n_chunks_result = add_chunks_together(all_chunks_result, best_idx, chunk_size = chunk_size)
 
         results.append({
             "show_id": source["show_id"],
@@ -257,7 +188,7 @@ def format_hits(hits, query_term, chunk_size=3, client=None, index_name=INDEX_NA
             "score": hit["_score"],
             "start_time" : n_chunks_result.get("start_time"),
             "end_time" : n_chunks_result.get("end_time"),
-            "chunk": highlight_words(n_chunks_result.get("chunk"),query_term), 
+            "chunk": highlight_words(n_chunks_result.get("chunk", ""), source.get("query", query_term)), 
             "query": hit["_source"].get("query", query_term)            
         })
         
@@ -265,44 +196,245 @@ def format_hits(hits, query_term, chunk_size=3, client=None, index_name=INDEX_NA
 
 
 
-def bm25_query(query_term, index_name=INDEX_NAME, top_k = 10, es = None, chunk_size = 30, debug = True, selected_episodes = None):
+def build_bm25_chunk_body(query_term, top_k=1, selected_chunks=None, window_size=None):
+    """
+    Body of a BM25 (or more_like_this when `selected_chunks` is given) query over the chunk layout,
+    collapsed to the best chunk (or window of `window_size` seconds) of each episode.
+    Returns None when no selected chunk has text.
+    """
+    match = {
+        "match": {
+            "sentence": {
+                "query": query_term,
+                "operator": "and"
+            }
+        }
+    }
+
+    if selected_chunks:
+        like_text = [chunk["transcript"]["chunk"] for chunk in selected_chunks if "transcript" in chunk and "chunk" in chunk["transcript"]]
+        if not like_text:
+            return None
+        match["match"]["sentence"]["boost"] = 2.0
+        query = {
+            "bool": {
+                "should": [
+                    {"more_like_this": {"fields": ["sentence"], "like": like_text}},
+                    match
+                ]
+            }
+        }
+    else:
+        query = {
+            "function_score": {
+                "query": match,
+                "functions": [{
+                    "field_value_factor": {
+                        "field": "ranking_score",
+                        "factor": 1.2,
+                        "modifier": "sqrt",
+                        "missing": 1.0
+                    }
+                }],
+                "boost_mode": "multiply"
+            }
+        }
+
+    return {
+        "size": top_k,
+        "_source": CHUNK_SOURCE,
+        "query": filter_window_size(query, window_size),
+        "collapse": collapse_by_episode()
+    }
+
+
+def format_chunk_hits(hits, query_term, chunk_size=30, client=None, index_name=CHUNK_INDEX_NAME, precomputed=False):
+    """
+    Chunk layout version of format_hits: the matching chunk comes straight from ES and
+    its neighbours for every hit are fetched together in one query.
+    Precomputed windows are used as they are.
+    """
+    n = 1 if precomputed else max(chunk_size // 30, 1)
+    matched = [get_hit_chunk(hit) for hit in hits]
+    chunks_by_episode = get_chunk_ranges(
+        [(chunk["episode_id"], *get_window_range(chunk["chunk_index"], n)) for chunk in matched],
+        index_name, es=client
+    ) if n > 1 else {}
+
+    results = []
+    for hit, chunk in zip(hits, matched):
+        if n > 1:
+            window = build_window(chunks_by_episode.get(chunk["episode_id"], {}), chunk["chunk_index"], n)
+        else:
+            window = format_window(chunk)
+        results.append({
+            "show_id": chunk["show_id"],
+            "episode_id": chunk["episode_id"],
+            "score": hit["_score"],
+            "start_time": window.get("start_time"),
+            "end_time": window.get("end_time"),
+            "chunk": highlight_words(window.get("chunk", ""), hit["_source"].get("query", query_term)),
+            "query": hit["_source"].get("query", query_term)
+        })
+
+    return results
+
+
+def bm25_chunk_query(query_term, index_name=CHUNK_INDEX_NAME, top_k = 10, es = None, chunk_size = 30, debug = True, selected_episodes = None, layout = None, speculative = None):
+    client = es or get_es()
+    window_size = get_window_size(chunk_size, layout)
+    search_index = WINDOW_INDEX_NAME if window_size else index_name
+    build_body = lambda q: build_bm25_chunk_body(q, top_k, selected_episodes, window_size)
+
+    response, correcteds = search_with_suggestions(
+        build_body(query_term), query_term, client, search_index,
+        suggest_index=index_name, field="sentence", speculative=speculative
+    )
+    hits = response.get("hits", {}).get("hits", [])
+    for hit in hits:
+        hit["_source"]["query"] = query_term
+
+    if len(hits) < top_k:
+        if debug:
+            print(f"Not enough results for query: {query_term}. Attempting suggestions...")
+        if correcteds is None:
+            correcteds = get_suggested_queries(query_term, client, index_name, field="sentence")
+        if debug and correcteds:
+            print(f"Using suggested queries: {correcteds}")
+        search_suggestions(correcteds, build_body, hits, top_k, es=client, index_name=search_index)
+
+    return format_chunk_hits(hits, query_term, chunk_size=chunk_size, client=client, index_name=index_name, precomputed=window_size is not None)
+
+
+def build_bm25_nested_body(query_term, top_k=1, selected_chunks=None):
+    """
+    Body of a BM25 (or more_like_this when `selected_chunks` is given) query over the nested layout.
+    The best scoring chunk of each episode comes back as an inner hit, instead of the highlight
+    and the whole chunk array of the episode layout.
+    Returns None when no selected chunk has text.
+    """
+    match = {
+        "match": {
+            "chunks.sentence": {
+                "query": query_term,
+                "operator": "and"
+            }
+        }
+    }
+
+    if selected_chunks:
+        like_text = [chunk["transcript"]["chunk"] for chunk in selected_chunks if "transcript" in chunk and "chunk" in chunk["transcript"]]
+        if not like_text:
+            return None
+        match["match"]["chunks.sentence"]["boost"] = 2.0
+        query = nested_chunks_query({
+            "bool": {
+                "should": [
+                    {"more_like_this": {"fields": ["chunks.sentence"], "like": like_text}},
+                    match
+                ]
+            }
+        })
+    else:
+        query = {
+            "function_score": {
+                "query": nested_chunks_query(match),
+                "functions": [{
+                    "field_value_factor": {
+                        "field": "ranking_score",
+                        "factor": 1.2,
+                        "modifier": "sqrt",
+                        "missing": 1.0
+                    }
+                }],
+                "boost_mode": "multiply"
+            }
+        }
+
+    return {
+        "size": top_k,
+        "_source": NESTED_SOURCE,
+        "query": query
+    }
+
+
+def format_nested_hits(hits, query_term, chunk_size=30, client=None, index_name=NESTED_INDEX_NAME):
+    """
+    Nested layout version of format_hits: the matching chunk offset comes from the inner hit and
+    only the chunks of every window are fetched, together in one _msearch.
+    """
+    n = max(chunk_size // 30, 1)
+    matched = get_nested_hit_chunks(hits)
+    chunks_by_episode = get_nested_chunk_ranges(
+        [(chunk["episode_id"], *get_window_range(chunk["chunk_index"], n)) for chunk in matched],
+        index_name, es=client
+    )
+
+    results = []
+    for chunk in matched:
+        window = build_window(chunks_by_episode.get(chunk["episode_id"], {}), chunk["chunk_index"], n)
+        results.append({
+            "show_id": chunk["show_id"],
+            "episode_id": chunk["episode_id"],
+            "score": chunk["score"],
+            "start_time": window.get("start_time"),
+            "end_time": window.get("end_time"),
+            "chunk": highlight_words(window.get("chunk", ""), chunk["query"]),
+            "query": chunk["query"]
+        })
+
+    return results
+
+
+def bm25_nested_query(query_term, index_name=NESTED_INDEX_NAME, top_k = 10, es = None, chunk_size = 30, debug = True, selected_episodes = None, speculative = None):
+    client = es or get_es()
+    build_body = lambda q: build_bm25_nested_body(q, top_k, selected_episodes)
+
+    response, correcteds = search_with_suggestions(build_body(query_term), query_term, client, index_name, speculative=speculative)
+    hits = response.get("hits", {}).get("hits", [])
+    for hit in hits:
+        hit["_source"]["query"] = query_term
+
+    if len(hits) < top_k:
+        if debug:
+            print(f"Not enough results for query: {query_term}. Attempting suggestions...")
+        if correcteds is None:
+            correcteds = get_suggested_queries(query_term, client, index_name)
+        if debug and correcteds:
+            print(f"Using suggested queries: {correcteds}")
+        search_suggestions(correcteds, build_body, hits, top_k, es=client, index_name=index_name)
+
+    return format_nested_hits(hits, query_term, chunk_size=chunk_size, client=client, index_name=index_name)
+
+
+def bm25_query(query_term, index_name=INDEX_NAME, top_k = 10, es = None, chunk_size = 30, debug = True, selected_episodes = None, layout = None, speculative = None):
     client = es or get_es()
+
+    if use_chunk_layout(layout):
+        return bm25_chunk_query(query_term, top_k=top_k, es=client, chunk_size=chunk_size, debug=debug, selected_episodes=selected_episodes, layout=layout, speculative=speculative)
+    if use_nested_layout(layout):
+        return bm25_nested_query(query_term, top_k=top_k, es=client, chunk_size=chunk_size, debug=debug, selected_episodes=selected_episodes, speculative=speculative)
     
     if selected_episodes:
-        hits = mlt_search(query_term, selected_episodes, client, index_name, top_k)
-        
-        if len(hits) < top_k:
-            if debug:
-                print(f"Not enough results for query: {query_term}. Attempting suggestions...")
-            correcteds = get_suggested_query(query_term, client, index_name)
-            print(correcteds)
-            for corrected in correcteds:
-                if corrected and corrected.lower() != query_term.lower():
-                    if debug:
-                        print(f"Using suggested query: {corrected}")
-                    hits = mlt_search(corrected, selected_episodes, client, index_name, top_k)
-                    query_term = corrected
-                if len(hits) >= top_k:
-                    break
-        
+        build_body = lambda corrected: build_mlt_body(corrected, selected_episodes, top_k)
     else:
-    
-        response = bm25_search(query_term, index_name, top_k = 10, es = client)
-        hits = response.get("hits", {}).get("hits", [])
-        
-        if len(hits) < top_k:
-            if debug:
-                print(f"Not enough results for query: {query_term}. Attempting suggestions...")
-            correcteds = get_suggested_query(query_term, client, index_name)
-            for corrected in correcteds:
-                if corrected and corrected.lower() != query_term.lower():
-                    if debug:
-                        print(f"Using suggested query: {corrected}")
-                    response = bm25_search(corrected, index_name, top_k=top_k, es=client)
-                    hits = response.get("hits", {}).get("hits", [])
-                    query_term = corrected
-                if len(hits) >= top_k:
-                    break
+        build_body = lambda corrected: build_bm25_body(corrected, top_k)
+
+    # in speculative mode the suggestions come back with this first search
+    response, correcteds = search_with_suggestions(build_body(query_term), query_term, client, index_name, speculative=speculative)
+    hits = response.get("hits", {}).get("hits", [])
+    for hit in hits:
+        hit["_source"]["query"] = query_term
+
+    if len(hits) < top_k:
+        if debug:
+            print(f"Not enough results for query: {query_term}. Attempting suggestions...")
+        if correcteds is None:
+            correcteds = get_suggested_queries(query_term, client, index_name)
+        if debug and correcteds:
+            print(f"Using suggested queries: {correcteds}")
+        # all the corrected searches go out in one _msearch round trip
+        search_suggestions(correcteds, build_body, hits, top_k, es=client, index_name=index_name)
 
     return format_hits(hits, query_term, chunk_size=chunk_size, client=client)
 
@@ -0,0 +1,189 @@
+from config import get_es, TRANSCRIPT_LAYOUT
+
+# Alternative transcript layout: one document per ~30s chunk instead of one
+# document per episode holding every chunk. Each chunk document has
+# episode_id, show_id, chunk_index, start_time, end_time (seconds) and sentence.
+CHUNK_INDEX_NAME = "podcast_chunks"
+CHUNK_SOURCE = ["show_id", "episode_id", "chunk_index", "start_time", "end_time", "sentence"]
+
+# "window" layout: the chunk documents plus precomputed windows of several chunks
+# (sliding, 50% overlap), where chunk_index is the first chunk of the window.
+# WINDOW_SIZES are the lengths offered by the frontend above 30s, each window is built
+# from size // 30 consecutive chunks; the indexer builds the windows of these sizes.
+WINDOW_INDEX_NAME = "podcast_windows"
+WINDOW_SIZES = [60, 120, 180, 300]
+
+
+def use_chunk_layout(layout=None):
+    return (layout or TRANSCRIPT_LAYOUT) in ("chunk", "window")
+
+
+def get_window_size(chunk_size, layout=None):
+    """
+    Returns chunk_size when precomputed windows of that size can answer the query, None otherwise.
+    """
+    if (layout or TRANSCRIPT_LAYOUT) == "window" and chunk_size in WINDOW_SIZES:
+        return chunk_size
+    return None
+
+
+def filter_window_size(query, window_size=None):
+    """
+    Restricts a query to the windows of one size. Returns the query unchanged without window_size.
+    """
+    if window_size is None:
+        return query
+    return {
+        "bool": {
+            "must": [query],
+            "filter": [{"term": {"window_size": window_size}}]
+        }
+    }
+
+
+def format_window(chunk):
+    """
+    Window dict of a chunk or precomputed window document, as returned by build_window.
+    """
+    return {
+        "start_time": chunk["start_time"],
+        "end_time": chunk["end_time"],
+        "chunk": chunk["sentence"]
+    }
+
+
+def collapse_by_episode(first_chunk=False):
+    """
+    Collapse clause returning one chunk per episode. By default the best scoring chunk is kept,
+    with `first_chunk` the earliest matching chunk of the episode is returned instead.
+    """
+    collapse = {"field": "episode_id"}
+    if first_chunk:
+        collapse["inner_hits"] = {
+            "name": "first_chunk",
+            "size": 1,
+            "sort": [{"chunk_index": "asc"}],
+            "_source": CHUNK_SOURCE
+        }
+    return collapse
+
+
+def get_hit_chunk(hit):
+    """
+    Returns the chunk document of a collapsed hit, taking the inner hit when there is one.
+    """
+    inner_hits = hit.get("inner_hits", {}).get("first_chunk", {}).get("hits", {}).get("hits", [])
+    if inner_hits:
+        return inner_hits[0]["_source"]
+    return hit["_source"]
+
+
+def get_hit_chunks(hits):
+    """
+    Chunk documents of collapsed hits, each tagged with the query that found it.
+    """
+    chunks = []
+    for hit in hits:
+        chunk = get_hit_chunk(hit)
+        chunk["query"] = hit["_source"]["query"]
+        chunks.append(chunk)
+    return chunks
+
+
+def get_chunk_ranges(ranges, index_name=CHUNK_INDEX_NAME, es=None):
+    """
+    Fetches chunk ranges of several episodes in a single query.
+
+    Parameters:
+        ranges (list[tuple]): (episode_id, first_chunk_index, last_chunk_index) tuples, bounds included.
+
+    Returns:
+        dict: episode_id -> {chunk_index: chunk}
+    """
+    if es is None:
+        es = get_es()
+
+    if not ranges:
+        return {}
+
+    query = {
+        "size": sum(last - first + 1 for _, first, last in ranges),
+        "_source": CHUNK_SOURCE,
+        "query": {
+            "bool": {
+                "should": [
+                    {
+                        "bool": {
+                            "filter": [
+                                {"term": {"episode_id": episode_id}},
+                                {"range": {"chunk_index": {"gte": first, "lte": last}}}
+                            ]
+                        }
+                    }
+                    for episode_id, first, last in ranges
+                ]
+            }
+        }
+    }
+
+    response = es.search(index=index_name, body=query)
+
+    chunks_by_episode = {}
+    for hit in response["hits"]["hits"]:
+        source = hit["_source"]
+        chunks_by_episode.setdefault(source["episode_id"], {})[source["chunk_index"]] = source
+    return chunks_by_episode
+
+
+def get_window_slice(num_chunks, idx, n):
+    """
+    Returns the (start, stop) slice of an n-chunk window around chunk `idx` of an episode with
+    `num_chunks` chunks. Same window as adding one chunk on the left then one on the right
+    until n chunks are selected, computed without walking the chunks.
+    """
+    take_left = min((n - 1) - (n - 1) // 2, idx)
+    take_right = min((n - 1) // 2, num_chunks - 1 - idx)
+    missing = n - 1 - take_left - take_right
+    extra_left = min(missing, idx - take_left)
+    take_left += extra_left
+    take_right += min(missing - extra_left, num_chunks - 1 - idx - take_right)
+    return idx - take_left, idx + take_right + 1
+
+
+def get_window_range(idx, n):
+    """
+    Returns the chunk index range to fetch so that an n-chunk window around `idx` can be built
+    whatever the position of the chunk in the episode.
+    """
+    return max(idx - n + 1, 0), idx + n - 1
+
+
+def build_window(chunks_by_index, idx, n):
+    """
+    Joins n chunks around `idx`, adding one chunk on the left then one on the right
+    like add_chunks_together, and stopping at the edges of the episode.
+    """
+    if idx not in chunks_by_index:
+        return {}
+
+    selected_indices = [idx]
+    left_idx, right_idx = idx - 1, idx + 1
+    while len(selected_indices) < n:
+        grew = False
+        if left_idx in chunks_by_index:
+            selected_indices.insert(0, left_idx)
+            left_idx -= 1
+            grew = True
+        if len(selected_indices) < n and right_idx in chunks_by_index:
+            selected_indices.append(right_idx)
+            right_idx += 1
+            grew = True
+        if not grew:
+            break
+
+    selected_chunks = [chunks_by_index[i] for i in selected_indices]
+    return {
+        "start_time": selected_chunks[0]["start_time"],
+        "end_time": selected_chunks[-1]["end_time"],
+        "chunk": " ".join(chunk["sentence"] for chunk in selected_chunks)
+    }
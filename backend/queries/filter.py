@@ -1,5 +1,5 @@
 from config import get_es
-import itertools 
+from queries.suggestions import get_suggested_queries, search_suggestions, search_with_suggestions
 INDEX_NAME = "episodes"
 
 
@@ -26,63 +26,6 @@ def mlt_search(query_text, selected_chunks, client, index_name, size=10):
     return response.get("hits", {}).get("hits", [])
 
 
-def get_suggested_query(query_text, search_field, index_name, es):
-    """
-    Runs a suggest query and returns the corrected phrase, if different.
-    """
-    suggest_query = {
-        "suggest": {
-            "suggestion": {
-                "text": query_text,
-                "term": {
-                    "field": search_field,
-                    "suggest_mode": "always",
-                    "min_word_length": 3
-                }
-            }
-        }
-    }
-
-    try:
-        suggest_response = es.search(index=index_name, body=suggest_query)
-        suggestions = suggest_response["suggest"]["suggestion"]
-        sugested_words = []
-        sugested_scores = []
-        words = []
-        scores = []
-        for entry in suggestions: 
-            if len(entry["options"]) > 0:
-                for word in entry["options"]:
-                    words.append(word["text"])
-                    scores.append(word["score"])
-            else:
-                words.append(entry["text"])
-                scores.append(1)
-            sugested_words.append(words)
-            sugested_scores.append(scores)
-            words = []
-            scores = []
-
-        #sugested_words = [[word["text"] if len(entry["options"])>0 else entry["text"] for word in entry["options"]] for entry in suggestions if entry["options"]] 
-        #sugested_score = [[word["score"] for word in entry["options"]] for entry in suggestions if entry["options"]] 
-        combinations = [' '.join(combo) for combo in itertools.product(*sugested_words)]
-        scores = [sum(combo) for combo in itertools.product(*sugested_scores)]
-
-
-        dict_combinations = {}
-        for i in range(len(combinations)):
-            dict_combinations[combinations[i]] = scores[i]
-        
-        dict_combinations = dict(sorted(dict_combinations.items(), key=lambda item: item[1], reverse=True))
-        print(dict_combinations)
-        
-
-        return list(dict_combinations.keys())
-
-    except (KeyError, IndexError):
-        return []
-
-
 def format_hits(hits, query_text):
     """
     Formats Elasticsearch hits into a structured list of dictionaries.
@@ -103,7 +46,7 @@ def format_hits(hits, query_text):
                 "description": hit["_source"].get("episode_description", ""),
                 "rss_link": hit["_source"].get("rss_link", ""),
                 "language": hit["_source"].get("language", ""),
-                "query": query_text,
+                "query": hit["_source"].get("query", query_text),
                 "audio": hit["_source"].get("audio_url", ""),
                 "episode_image": hit["_source"].get("image_episode", ""),
                 "show_image": hit["_source"].get("image_show", "")
@@ -112,7 +55,36 @@ def format_hits(hits, query_text):
     return results
 
 
-def search_episodes(query_text, search_field="show_name", index_name=INDEX_NAME, top_k=10, es=None):
+EPISODE_SUGGEST_OPTIONS = {"suggest_mode": "always", "min_word_length": 3}
+
+
+def build_episode_body(text, search_field="show_name", top_k=10):
+    return {
+        "size": top_k,
+        "query": {
+            "match": {
+                search_field: text
+            }
+        }
+    }
+
+
+def build_episode_mlt_body(query_text, search_field="show_name", size=10):
+    return {
+        "size": size,
+        "_source": ["show_id", "episode_id", "show_name", "episode_name", "publisher", "episode_description", "rss_link", "language"],
+        "query": {
+            "more_like_this": {
+                "fields": [search_field],
+                "like": query_text,
+                "min_term_freq": 1,
+                "max_query_terms": 12
+            }
+        }
+    }
+
+
+def search_episodes(query_text, search_field="show_name", index_name=INDEX_NAME, top_k=10, es=None, speculative=None):
     """
     Search episodes in the Elasticsearch index by a specified field, with suggestion and MLT fallback.
 
@@ -122,6 +94,7 @@ def search_episodes(query_text, search_field="show_name", index_name=INDEX_NAME,
         index_name (str): Elasticsearch index name. Defaults to "episodes".
         top_k (int): Number of top results to return. Defaults to 5.
         es (Elasticsearch, optional): Existing Elasticsearch client. If None, a new one is fetched from get_es().
+        speculative (bool, optional): Send the term suggest with the first search. Defaults to SPECULATIVE_SUGGEST from config.
 
     Returns:
         List[dict]: List of episode documents with relevant fields.
@@ -132,55 +105,32 @@ def search_episodes(query_text, search_field="show_name", index_name=INDEX_NAME,
     if search_field not in ["show_name", "publisher", "episode_name"]:
         raise ValueError("Invalid search_field. Must be one of: 'show_name', 'publisher', or 'episode_name'")
 
-    def run_query(text):
-        query = {
-            "size": top_k,
-            "query": {
-                "match": {
-                    search_field: text
-                }
-            }
-        }
-        return es.search(index=index_name, body=query)
+    build_body = lambda text: build_episode_body(text, search_field, top_k)
 
     # Step 1: Initial search
-    response = run_query(query_text)
+    suggest_options = EPISODE_SUGGEST_OPTIONS
+    response, suggested_querys = search_with_suggestions(
+        build_body(query_text), query_text, es, index_name,
+        field=search_field, speculative=speculative, **suggest_options
+    )
     hits = response["hits"]["hits"]
     for hit in hits:
         hit["_source"]["query"] = query_text  # Add the query text to each hit
     print(hits)
 
-    # Step 2: Suggestion fallback if results are insufficient
-    corrected_query = query_text  # Default to the original query
+    # Step 2: Suggestion fallback if results are insufficient, all suggestions in one _msearch
     if len(hits) < top_k:
-        suggested_querys = get_suggested_query(query_text, search_field, index_name, es)
-        for suggested_query in suggested_querys:
-            if suggested_query.lower() != query_text.lower():
-                corrected_query = suggested_query
-                suggest_response = run_query(corrected_query)
-                hits.extend(suggest_response["hits"]["hits"])
-            if len(hits) >= top_k:
-                break
+        if suggested_querys is None:
+            suggested_querys = get_suggested_queries(query_text, es, index_name, field=search_field, **suggest_options)
+        search_suggestions(suggested_querys, build_body, hits, top_k, es=es, index_name=index_name)
 
     # Step 3: More Like This (MLT) fallback if results are still insufficient
     if len(hits) < top_k:
-        mlt_query = {
-            "size": top_k - len(hits),
-            "_source": ["show_id", "episode_id", "show_name", "episode_name", "publisher", "episode_description", "rss_link", "language"],
-            "query": {
-                "more_like_this": {
-                    "fields": [search_field],
-                    "like": query_text,
-                    "min_term_freq": 1,
-                    "max_query_terms": 12
-                }
-            }
-        }
-        mlt_response = es.search(index=index_name, body=mlt_query)
+        mlt_response = es.search(index=index_name, body=build_episode_mlt_body(query_text, search_field, top_k - len(hits)))
         hits.extend(mlt_response["hits"]["hits"])
 
-    # Format the hits with the final query (corrected or original)
-    return format_hits(hits, corrected_query)
+    # Format the hits, each with the query (corrected or original) that found it
+    return format_hits(hits, query_text)
 
 
 def debug_print(results):
@@ -0,0 +1,43 @@
+from functools import lru_cache
+import re
+
+# Compiled patterns kept per (query, phrase): a page of hits, and every page of the
+# same query, reuses the pattern instead of compiling one per word and hit.
+HIGHLIGHT_CACHE_SIZE = 1024
+HIGHLIGHT_TAG = r"<mark><strong><em>\g<0></em></strong></mark>"
+
+
+@lru_cache(maxsize=HIGHLIGHT_CACHE_SIZE)
+def get_highlight_pattern(query, phrase=False):
+    """
+    Case-insensitive pattern matching the words of `query` as whole words, or the whole phrase
+    with any separator between its words, as the analyzer splits them. All the words are one
+    alternation, longest first, so a text is scanned once whatever the number of words.
+    None for an empty query.
+    """
+    words = query.split()
+    if not words:
+        return None
+    if not phrase:
+        words = list(dict.fromkeys(word.lower() for word in words))
+
+    if phrase or len(words) == 1:
+        # starting with a literal lets re jump from one occurrence of the first word to the
+        # next; the word boundary before it is checked once the word has matched
+        first = re.escape(words[0])
+        body = rf"{first}(?<!\w{first})" + "".join(rf"\W+{re.escape(word)}" for word in words[1:])
+        return re.compile(rf"{body}(?!\w)", re.IGNORECASE)
+
+    # lookarounds instead of \b, so that words starting or ending with punctuation still match
+    alternatives = [re.escape(word) for word in sorted(words, key=len, reverse=True)]
+    return re.compile(rf"(?<!\w)(?:{'|'.join(alternatives)})(?!\w)", re.IGNORECASE)
+
+
+def highlight_query(text, query, phrase=False):
+    """
+    Wraps the query words (or the phrase) found in `text` in the highlight tags, in one pass.
+    """
+    pattern = get_highlight_pattern(query, phrase)
+    if pattern is None or not text:
+        return text
+    return pattern.sub(HIGHLIGHT_TAG, text)
@@ -1,28 +1,36 @@
+from collections import OrderedDict
 import re
+import threading
 from tqdm import tqdm
 from config import get_es
-import itertools
+from queries.suggestions import get_suggested_queries, search_suggestions, search_with_suggestions
+from queries.highlight import highlight_query
+from queries.chunks import CHUNK_INDEX_NAME, CHUNK_SOURCE, WINDOW_INDEX_NAME, use_chunk_layout, get_window_size, filter_window_size, collapse_by_episode, get_hit_chunks, get_chunk_ranges, get_window_range, get_window_slice, build_window, format_window
+from queries.nested import NESTED_INDEX_NAME, NESTED_SOURCE, use_nested_layout, nested_chunks_query, get_nested_hit_chunks, get_nested_chunk_ranges
 
 
 INDEX_NAME = "podcast_transcripts"
 
+# Words as the standard analyzer splits them (apostrophes kept inside a word)
+TOKEN_PATTERN = re.compile(r"\w+(?:'\w+)*")
+
+# Lowercased chunk texts and token sets of recently returned episodes, so that another query
+# hitting the same episode doesn't lowercase or tokenize its transcript again.
+CHUNK_TEXT_CACHE_SIZE = 256
+_chunk_text_cache = OrderedDict()
+_chunk_text_cache_lock = threading.Lock()
+_chunk_text_lookups = {"hits": 0, "misses": 0}
+
 def highlight_words(text, phrase):
     """
-    Highlights all words from the given phrase in the text (case-insensitive),
+    Highlights all words from the given phrase in the text (case-insensitive, whole words only).
     """
-    words = phrase.strip().split()
-    for word in words:
-        pattern = re.compile(rf'({re.escape(word)})', flags=re.IGNORECASE)
-        text = pattern.sub(r'<mark><strong><em>\1</em></strong></mark>', text)
-    return text
+    return highlight_query(text, phrase)
 
 
 # Query Functions
-def run_query(query_term, client, index_name, size=10):
-    """
-    Executes a match query with 'AND' operator over 'chunks.sentence' to retrieve documents that contain all query terms.
-    """
-    query_body = {
+def build_query_body(query_term, size=10):
+    return {
         "size": size,
         "query": {
             "bool": {
@@ -39,121 +47,18 @@ def run_query(query_term, client, index_name, size=10):
             }
         }
     }
-    response = client.search(index=index_name, body=query_body)
-    hits = response.get("hits", {}).get("hits", [])
-    for hit in hits:
-        hit["_source"]["query"] = query_term
-    return hits
-
-
-def handle_suggestions(query_term, client, index_name, hits, seen, size=10):
-    """
-    If not enough results were found, runs a suggest query on 'chunks.sentence'. Re-executes the search with the corrected phrase and appends new results.
-    """
-    suggest_query = {
-        "suggest": {
-            "suggestion": {
-                "text": query_term,
-                "term": {
-                    "field": "chunks.sentence",
-                    "suggest_mode": "always",
-                    "min_word_length": 2,
-                    "max_edits": 2,
-                    "prefix_length": 1
-                }
-            }
-        }
-    }
-
-    try:
-        response = client.search(index=index_name, body=suggest_query)
-        suggestions = response["suggest"]["suggestion"]
-        corrected_words = [
-            entry["options"][0]["text"] if entry["options"] else entry["text"]
-            for entry in suggestions
-        ]
-        suggested_phrase = " ".join(corrected_words)
-
-        if suggested_phrase and suggested_phrase.lower() != query_term.lower():
-            new_hits = run_query(suggested_phrase, client, index_name, size)
-            for hit in new_hits:
-                doc_id = (hit["_source"]["show_id"], hit["_source"]["episode_id"])
-                if doc_id not in seen:
-                    hit["_source"]["query"] = suggested_phrase
-                    hits.append(hit)
-                    seen.add(doc_id)
-                if len(hits) >= size:
-                    break
-
-    except Exception:
-        pass
-    
     
-def get_suggested_query(phrase, es, index_name):
-    suggest_query = {
-        "suggest": {
-            "word_suggest": {
-                "text": phrase,
-                "term": {
-                    "field": "chunks.sentence",
-                    "suggest_mode": "always",
-                    "min_word_length": 2,
-                    "max_edits": 2,
-                    "prefix_length": 1
-                }
-            }
-        }
-    }
-
-    try:
-        suggest_response = es.search(index=index_name, body=suggest_query)
-        suggestions = suggest_response["suggest"]["word_suggest"]
-        sugested_words = []
-        sugested_scores = []
-        words = []
-        scores = []
-        for entry in suggestions: 
-            if len(entry["options"]) > 0:
-                for word in entry["options"]:
-                    words.append(word["text"])
-                    scores.append(word["score"])
-            else:
-                words.append(entry["text"])
-                scores.append(1)
-            sugested_words.append(words)
-            sugested_scores.append(scores)
-            words = []
-            scores = []
-
-        #sugested_words = [[word["text"] if len(entry["options"])>0 else entry["text"] for word in entry["options"]] for entry in suggestions if entry["options"]] 
-        #sugested_score = [[word["score"] for word in entry["options"]] for entry in suggestions if entry["options"]] 
-        combinations = [' '.join(combo) for combo in itertools.product(*sugested_words)]
-        scores = [sum(combo) for combo in itertools.product(*sugested_scores)]
-
-
-        dict_combinations = {}
-        for i in range(len(combinations)):
-            dict_combinations[combinations[i]] = scores[i]
-        
-        dict_combinations = dict(sorted(dict_combinations.items(), key=lambda item: item[1], reverse=True))
-        print(dict_combinations)
-
-        return list(dict_combinations.keys())
-
-    except (KeyError, IndexError):
-        return []
-
-
     
-def mlt_search(query_term, selected_chunks, client, index_name, size=10):
+def build_mlt_body(query_term, selected_chunks, size=10):
     """
-    Runs a 'more_like_this' query using chunks marked as relevant, combined with a boosted match query to reinforce the original search intent.
+    Body of a 'more_like_this' query using chunks marked as relevant, combined with a boosted match query to reinforce the original search intent.
+    Returns None when no chunk has text.
     """
     like_text = [chunk["transcript"]["chunk"] for chunk in selected_chunks if "transcript" in chunk and "chunk" in chunk["transcript"]]
     if not like_text:
-        return []
+        return None
 
-    query_body = {
+    return {
         "size": size,
         "query": {
             "bool": {
@@ -177,50 +82,125 @@ def mlt_search(query_term, selected_chunks, client, index_name, size=10):
             }
         }
     }
-    response = client.search(index=index_name, body=query_body)
-    hits = response.get("hits", {}).get("hits", [])
-    for hit in hits:
-        hit["_source"]["query"] = query_term
-    return hits
     
 
+def get_chunk_texts(source):
+    """
+    Returns the lowercased sentences of the chunks of an episode and, next to them, their token
+    sets, from the chunk text cache, plus whether the episode was already cached. A token set is
+    None until iter_intersection_chunk_indices needs it, and is then kept in the cache entry.
+    """
+    key = (source.get("show_id"), source.get("episode_id"), len(source["chunks"]))
+    with _chunk_text_cache_lock:
+        entry = _chunk_text_cache.get(key)
+        if entry is not None:
+            _chunk_text_cache.move_to_end(key)
+            _chunk_text_lookups["hits"] += 1
+            return (*entry, True)
+        _chunk_text_lookups["misses"] += 1
+
+    texts = [chunk["sentence"].lower() for chunk in source["chunks"]]
+    entry = (texts, [None] * len(texts))
+    with _chunk_text_cache_lock:
+        _chunk_text_cache[key] = entry
+        while len(_chunk_text_cache) > CHUNK_TEXT_CACHE_SIZE:
+            _chunk_text_cache.popitem(last=False)
+    return (*entry, False)
+
+
+def clear_chunk_text_cache():
+    with _chunk_text_cache_lock:
+        _chunk_text_cache.clear()
+
+
+def chunk_text_cache_stats():
+    lookups = _chunk_text_lookups["hits"] + _chunk_text_lookups["misses"]
+    return {
+        "entries": len(_chunk_text_cache),
+        "max_entries": CHUNK_TEXT_CACHE_SIZE,
+        **_chunk_text_lookups,
+        "hit_rate": round(_chunk_text_lookups["hits"] / lookups, 4) if lookups else 0.0,
+    }
+
+
+def is_word_char(char):
+    return char.isalnum() or char == "_"
+
+
+def has_token(text, token):
+    """
+    Whether `token` is one of the words TOKEN_PATTERN splits `text` into, found with str.find:
+    an occurrence counts when neither a word character nor an apostrophe inside a word joins
+    it to the text around it.
+    """
+    start = text.find(token)
+    while start != -1:
+        end = start + len(token)
+        joined_before = start > 0 and (
+            is_word_char(text[start - 1]) or (text[start - 1] == "'" and start > 1 and is_word_char(text[start - 2]))
+        )
+        joined_after = end < len(text) and (
+            is_word_char(text[end]) or (text[end] == "'" and end + 1 < len(text) and is_word_char(text[end + 1]))
+        )
+        if not joined_before and not joined_after:
+            return True
+        start = text.find(token, start + 1)
+    return False
+
+
+def has_tokens(text, tokens, spaced_tokens):
+    """
+    Whether every token is a word of `text`, without tokenizing it: a token found between
+    spaces is a word, the others (next to punctuation or the ends of the text) go to has_token.
+    """
+    spaced_text = f" {text} "
+    return all(spaced in spaced_text or has_token(text, token) for token, spaced in zip(tokens, spaced_tokens))
+
+
+def iter_intersection_chunk_indices(hit, query_term):
+    """
+    Yields, in order, the indices of the chunks holding every token of query_term as a whole
+    word. The first time an episode is seen its chunks are not tokenized: the ones passing a
+    substring test are checked with has_tokens, which costs about as much as the substring test.
+    Once the episode is in the chunk text cache, the chunks passing the substring test are
+    tokenized once and their token sets kept, so the next queries on it only get a set check.
+    """
+    source = hit['_source']
+    if not source.get('chunks'):
+        return
+    tokens = frozenset(TOKEN_PATTERN.findall(query_term.lower()))
+    texts, token_sets, cached = get_chunk_texts(source)
+    spaced_tokens = [f" {token} " for token in tokens]
+    for i, text in enumerate(texts):
+        chunk_tokens = token_sets[i]
+        if chunk_tokens is None:
+            if not all(token in text for token in tokens):
+                continue
+            if not cached:
+                if has_tokens(text, tokens, spaced_tokens):
+                    yield i
+                continue
+            chunk_tokens = token_sets[i] = frozenset(TOKEN_PATTERN.findall(text))
+        if tokens <= chunk_tokens:
+            yield i
+
+
 def get_intersection_chunk_indices(hit, query_term) -> list[int]:
     """
     Returns indices of chunks that contain all query terms.
     """
-    source = hit['_source']
-    chunk_indices = []
-    if 'chunks' in source:
-        for i, chunk in enumerate(source['chunks']):
-            if all(term in chunk['sentence'].lower() for term in query_term.lower().split()):
-                chunk_indices.append(i)
-    return chunk_indices
+    return list(iter_intersection_chunk_indices(hit, query_term))
 
 
 def get_n_30s_chunks(chunks, idx, n=3):
     """
     Given a chunk index, expands to n ~30s chunks by adding neighbors before/after to form a longer contiguous segment.
     """
-    left_idx, right_idx = idx - 1, idx + 1
-    count = 1
-    selected_indices = [idx]
-
-    while count < n:
-        if left_idx >= 0:
-            selected_indices.insert(0, left_idx)
-            left_idx -= 1
-            count += 1
-        if count < n and right_idx < len(chunks):
-            selected_indices.append(right_idx)
-            right_idx += 1
-            count += 1
-        if left_idx < 0 and right_idx >= len(chunks):
-            break
-        
-    selected_chunks = [chunks[i] for i in selected_indices]
+    start, stop = get_window_slice(len(chunks), idx, n)
+    selected_chunks = chunks[start:stop]
     return {
-        'start_time': float(selected_chunks[0]['startTime'][:-1]),
-        'end_time': float(selected_chunks[-1]['endTime'][:-1]),
+        'start_time': selected_chunks[0]['start_time'],
+        'end_time': selected_chunks[-1]['end_time'],
         'chunk': ' '.join(chunk['sentence'] for chunk in selected_chunks)
     }
 
@@ -234,9 +214,10 @@ def format_hits(hits, query_term, n=3, mlt=True):
     results = []
     for hit in tqdm(hits, disable=False):
         q_term = hit["_source"].get("query", query_term)
-        chunk_indices = get_intersection_chunk_indices(hit, q_term)
-        
-        idx = 0 if mlt and hit["_source"].get("chunks") else (chunk_indices[0] if chunk_indices else None)
+        if mlt and hit["_source"].get("chunks"):
+            idx = 0
+        else:
+            idx = next(iter_intersection_chunk_indices(hit, q_term), None)
         if idx is None:
             continue
 
@@ -253,41 +234,220 @@ def format_hits(hits, query_term, n=3, mlt=True):
 
 
 
+def build_chunk_query_body(query_term, size=10, selected_chunks=None, window_size=None):
+    """
+    Body of the intersection query over the chunk layout, collapsed to the first chunk holding
+    all query terms in each episode (the best chunk when `selected_chunks` triggers more_like_this).
+    Returns None when no selected chunk has text.
+    """
+    match = {
+        "match": {
+            "sentence": {
+                "query": query_term,
+                "operator": "and"
+            }
+        }
+    }
+
+    if selected_chunks:
+        like_text = [chunk["transcript"]["chunk"] for chunk in selected_chunks if "transcript" in chunk and "chunk" in chunk["transcript"]]
+        if not like_text:
+            return None
+        match["match"]["sentence"]["boost"] = 2.0
+        query = {
+            "bool": {
+                "should": [
+                    {"more_like_this": {"fields": ["sentence"], "like": like_text}},
+                    match
+                ]
+            }
+        }
+    else:
+        query = match
+
+    return {
+        "size": size,
+        "_source": CHUNK_SOURCE,
+        "query": filter_window_size(query, window_size),
+        "collapse": collapse_by_episode(first_chunk=not selected_chunks)
+    }
+
+
+def format_chunk_hits(chunks, query_term, n=3, client=None, index_name=CHUNK_INDEX_NAME):
+    """
+    Chunk layout version of format_hits: expands every matched chunk to n chunks,
+    fetching the neighbours of all of them in one query. With n=1 (a 30s chunk or a
+    precomputed window) the matched document is used as it is.
+    """
+    chunks_by_episode = get_chunk_ranges(
+        [(chunk["episode_id"], *get_window_range(chunk["chunk_index"], n)) for chunk in chunks],
+        index_name, es=client
+    ) if n > 1 else {}
+
+    results = []
+    for chunk in chunks:
+        if n > 1:
+            chunk_data = build_window(chunks_by_episode.get(chunk["episode_id"], {}), chunk["chunk_index"], n)
+        else:
+            chunk_data = format_window(chunk)
+        if not chunk_data:
+            continue
+        q_term = chunk.get("query", query_term)
+        chunk_data.update({
+            "episode_id": chunk["episode_id"],
+            "show_id": chunk["show_id"],
+            "query": q_term,
+            "chunk": highlight_words(chunk_data["chunk"], q_term)
+        })
+        results.append(chunk_data)
+    return results
+
+
+def intersection_chunk_query(query_term, chunk_size, selected_episodes=None, es=None, layout=None, speculative=None):
+    """
+    intersection_query over the chunk layout, or over the precomputed windows in the window layout.
+    """
+    client = es or get_es()
+    size = 10
+    window_size = get_window_size(chunk_size, layout)
+    search_index = WINDOW_INDEX_NAME if window_size else CHUNK_INDEX_NAME
+    n = 1 if window_size else int(chunk_size / 30)
+
+    build_body = lambda q: build_chunk_query_body(q, size, selected_episodes, window_size)
+    response, correcteds = search_with_suggestions(
+        build_body(query_term), query_term, client, search_index,
+        suggest_index=CHUNK_INDEX_NAME, field="sentence", speculative=speculative
+    )
+    hits = response.get("hits", {}).get("hits", [])
+    for hit in hits:
+        hit["_source"]["query"] = query_term
+
+    if len(hits) < size:
+        if correcteds is None:
+            correcteds = get_suggested_queries(query_term, client, CHUNK_INDEX_NAME, field="sentence")
+        search_suggestions(correcteds, build_body, hits, size, es=client, index_name=search_index)
+    chunks = get_hit_chunks(hits)
+
+    return format_chunk_hits(chunks[:size], query_term, n, client=client)
+
+
+def build_nested_query_body(query_term, size=10, selected_chunks=None):
+    """
+    Body of the intersection query over the nested layout: all the query terms must be in one chunk,
+    and the first such chunk of each episode (the best one when `selected_chunks` triggers
+    more_like_this) comes back as an inner hit, so no chunk is scanned in Python.
+    Returns None when no selected chunk has text.
+    """
+    match = {
+        "match": {
+            "chunks.sentence": {
+                "query": query_term,
+                "operator": "and"
+            }
+        }
+    }
+
+    if selected_chunks:
+        like_text = [chunk["transcript"]["chunk"] for chunk in selected_chunks if "transcript" in chunk and "chunk" in chunk["transcript"]]
+        if not like_text:
+            return None
+        match["match"]["chunks.sentence"]["boost"] = 2.0
+        query = {
+            "bool": {
+                "should": [
+                    {"more_like_this": {"fields": ["chunks.sentence"], "like": like_text}},
+                    match
+                ]
+            }
+        }
+    else:
+        query = match
+
+    return {
+        "size": size,
+        "_source": NESTED_SOURCE,
+        "query": nested_chunks_query(query, first_chunk=not selected_chunks)
+    }
+
+
+def format_nested_hits(hits, query_term, n=3, client=None, index_name=NESTED_INDEX_NAME):
+    """
+    Nested layout version of format_hits: expands the matched chunk of every hit to n chunks,
+    fetching only those chunks, for all the hits in one _msearch.
+    """
+    chunks = get_nested_hit_chunks(hits)
+    chunks_by_episode = get_nested_chunk_ranges(
+        [(chunk["episode_id"], *get_window_range(chunk["chunk_index"], n)) for chunk in chunks],
+        index_name, es=client
+    )
+
+    results = []
+    for chunk in chunks:
+        chunk_data = build_window(chunks_by_episode.get(chunk["episode_id"], {}), chunk["chunk_index"], n)
+        if not chunk_data:
+            continue
+        chunk_data.update({
+            "episode_id": chunk["episode_id"],
+            "show_id": chunk["show_id"],
+            "query": chunk["query"],
+            "chunk": highlight_words(chunk_data["chunk"], chunk["query"])
+        })
+        results.append(chunk_data)
+    return results
+
+
+def intersection_nested_query(query_term, chunk_size, selected_episodes=None, es=None, speculative=None):
+    """
+    intersection_query over the nested layout.
+    """
+    client = es or get_es()
+    size = 10
+    n = max(int(chunk_size / 30), 1)
+
+    build_body = lambda q: build_nested_query_body(q, size, selected_episodes)
+    response, correcteds = search_with_suggestions(build_body(query_term), query_term, client, NESTED_INDEX_NAME, speculative=speculative)
+    hits = response.get("hits", {}).get("hits", [])
+    for hit in hits:
+        hit["_source"]["query"] = query_term
+
+    if len(hits) < size:
+        if correcteds is None:
+            correcteds = get_suggested_queries(query_term, client, NESTED_INDEX_NAME)
+        search_suggestions(correcteds, build_body, hits, size, es=client, index_name=NESTED_INDEX_NAME)
+
+    return format_nested_hits(hits[:size], query_term, n, client=client)
+
+
 # Main Query Function
-def intersection_query(query_term, chunk_size, selected_episodes=None):
+def intersection_query(query_term, chunk_size, selected_episodes=None, es=None, layout=None, speculative=None):
     """
     Main fuction. Runs either standard or MLT-based intersection search, applies suggestions if needed, and returns formatted results.
     """
-    client = get_es()
+    if use_chunk_layout(layout):
+        return intersection_chunk_query(query_term, chunk_size, selected_episodes=selected_episodes, es=es, layout=layout, speculative=speculative)
+    if use_nested_layout(layout):
+        return intersection_nested_query(query_term, chunk_size, selected_episodes=selected_episodes, es=es, speculative=speculative)
+
+    client = es or get_es()
     size = 10
     n = int(chunk_size / 30)
 
     if selected_episodes:
-        hits = mlt_search(query_term, selected_episodes, client, INDEX_NAME, size)
-       
-        if len(hits) < size:
-            correcteds = get_suggested_query(query_term, client, INDEX_NAME)
-            for corrected in correcteds:
-                if corrected and corrected.lower() != query_term.lower():
-                    hits += mlt_search(corrected, selected_episodes, client, INDEX_NAME, size)
-                    query_term = corrected
-                if len(hits) >= size:
-                    break
-        
-        result =  format_hits(hits, query_term, n, mlt=True)
+        build_body = lambda corrected: build_mlt_body(corrected, selected_episodes, size)
     else:
-        hits = run_query(query_term, client, INDEX_NAME, size)
-        if len(hits) < size:
-
-            correcteds = get_suggested_query(query_term, client, INDEX_NAME)
-            for corrected in correcteds:
-                if corrected and corrected.lower() != query_term.lower():
-                    hits += run_query(corrected, client, INDEX_NAME, size)
-                    query_term = corrected
-                if len(hits) >= size:
-                    break
-                
-        result =  format_hits(hits, query_term, n, mlt=False)
+        build_body = lambda corrected: build_query_body(corrected, size)
+
+    response, correcteds = search_with_suggestions(build_body(query_term), query_term, client, INDEX_NAME, speculative=speculative)
+    hits = response.get("hits", {}).get("hits", [])
+    for hit in hits:
+        hit["_source"]["query"] = query_term
+
+    if len(hits) < size:
+        if correcteds is None:
+            correcteds = get_suggested_queries(query_term, client, INDEX_NAME)
+        search_suggestions(correcteds, build_body, hits, size, es=client, index_name=INDEX_NAME)
+
+    result = format_hits(hits, query_term, n, mlt=bool(selected_episodes))
     
     return result
 
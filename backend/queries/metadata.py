@@ -1,60 +1,156 @@
-from flask import jsonify
-from config import get_es
+from collections import OrderedDict
+import threading
+from elasticsearch import NotFoundError
+from config import get_es, METADATA_CACHE_SIZE, METADATA_PRELOAD
 
 EPISODE_INDEX = "episodes"
-NUM_RESPONSES = 10
-es = get_es()
-
-def metadata(transcripts): 
-    # Map keys to match expected structure
-    transcripts = [
-        {"show_id": item["show_id"], "episode_id": item["episode_id"]}
-        for item in transcripts
-    ]
-    
-    if not es.indices.exists(index=EPISODE_INDEX):  # Correct index name
-        return jsonify({"error": f"Index '{EPISODE_INDEX}' does not exist"}), 404
-
-    metadata_query = {
-        "size": NUM_RESPONSES,
-        "query": {
-            "bool": {
-                "should": [
-                    {
-                        "bool": {
-                            "must": [
-                                { "term": { "episode_id": item["episode_id"] } },
-                                { "term": { "show_id": item["show_id"] } }
-                            ]
-                        }
-                    }
-                    for item in transcripts
-                ]
-            }
-        }
+METADATA_SOURCE = [
+    "show_id", "episode_id", "episode_name", "episode_description", "show_name", "duration",
+    "language", "publisher", "rss_link", "image_episode", "image_show", "audio_url"
+]
+
+# (show_id, episode_id) -> formatted metadata. Episode metadata only changes when
+# the episodes index is reloaded, which flushes the cache (see cache.get_index_generation).
+_metadata_cache = OrderedDict()
+_metadata_cache_lock = threading.Lock()
+_metadata_lookups = {"hits": 0, "misses": 0}
+
+
+def format_metadata(source):
+    return {
+        "show_id": source["show_id"],
+        "episode_id": source["episode_id"],
+        "title": source.get("episode_name", ""),
+        "description": source.get("episode_description", ""),
+        "show": source.get("show_name", ""),
+        "duration": source.get("duration", ""),  
+        "language": source.get("language", ""), 
+        "publisher": source.get("publisher", ""),  
+        "rss_link": source.get("rss_link", ""),
+        "episode_image": source.get("image_episode", ""),
+        "show_image": source.get("image_show", ""),
+        "audio": source.get("audio_url", "")
     }
-    
-    metadata_response = es.search(index=EPISODE_INDEX, body=metadata_query)
-    
-    # Process hits to extract relevant fields
-    hits = [
-        {
-            "show_id": hit["_source"]["show_id"],
-            "episode_id": hit["_source"]["episode_id"],
-            "title": hit["_source"].get("episode_name", ""),
-            "description": hit["_source"].get("episode_description", ""),
-            "show": hit["_source"].get("show_name", ""),
-            "duration": hit["_source"].get("duration", ""),  
-            "language": hit["_source"].get("language", ""), 
-            "publisher": hit["_source"].get("publisher", ""),  
-            "rss_link": hit["_source"].get("rss_link", ""),
-            "episode_image": hit["_source"].get("image_episode", ""),
-            "show_image": hit["_source"].get("image_show", ""),
-            "audio": hit["_source"].get("audio_url", "")
-
-        }
-        for hit in metadata_response["hits"]["hits"]
-    ]
-
-    return hits  # Return processed list
 
+
+def fetch_metadata(episode_ids, es=None):
+    """
+    Fetches the metadata of several episodes in one multi-get (episode_id is the _id of the
+    episodes index) and adds it to the cache. Returns (show_id, episode_id) -> metadata.
+    """
+    if es is None:
+        es = get_es()
+
+    if not episode_ids:
+        return {}
+
+    response = es.mget(**build_metadata_mget(episode_ids))
+    return cache_metadata_docs(response["docs"])
+
+
+def build_metadata_mget(episode_ids):
+    """
+    Arguments of the multi-get of the metadata of several episodes.
+    """
+    return {"index": EPISODE_INDEX, "ids": list(dict.fromkeys(episode_ids)), "source": METADATA_SOURCE}
+
+
+def cache_metadata_docs(docs):
+    """
+    Formats the episodes of a multi-get response and adds them to the cache.
+    Returns (show_id, episode_id) -> metadata.
+    """
+    fetched = {}
+    for doc in docs:
+        if doc.get("found"):
+            meta = format_metadata(doc["_source"])
+            fetched[(meta["show_id"], meta["episode_id"])] = meta
+
+    with _metadata_cache_lock:
+        for key, meta in fetched.items():
+            _metadata_cache[key] = meta
+            _metadata_cache.move_to_end(key)
+        while len(_metadata_cache) > METADATA_CACHE_SIZE:
+            _metadata_cache.popitem(last=False)
+    return fetched
+
+
+def get_cached_metadata(keys):
+    """
+    Returns (show_id, episode_id) -> metadata for the keys found in the cache.
+    """
+    found = {}
+    with _metadata_cache_lock:
+        for key in keys:
+            meta = _metadata_cache.get(key)
+            if meta is not None:
+                _metadata_cache.move_to_end(key)
+                found[key] = meta
+        _metadata_lookups["hits"] += len(found)
+        _metadata_lookups["misses"] += len(keys) - len(found)
+    return found
+
+
+def lookup_metadata(transcripts):
+    """
+    Looks the episodes of `transcripts` up in the metadata cache.
+
+    Returns:
+        tuple: (keys, found, missing). keys are the (show_id, episode_id) of the episodes, once
+        each and in order, found the cached metadata of those keys and missing the episode_ids
+        to fetch.
+    """
+    keys = list(dict.fromkeys((item["show_id"], item["episode_id"]) for item in transcripts))
+    found = get_cached_metadata(keys)
+    missing = [episode_id for show_id, episode_id in keys if (show_id, episode_id) not in found]
+    return keys, found, missing
+
+
+def preload_metadata(path=METADATA_PRELOAD, es=None, batch_size=1000):
+    """
+    Loads the metadata of the hot episodes listed in `path` (one episode_id per line) into the cache.
+    """
+    if not path:
+        return 0
+    with open(path) as f:
+        episode_ids = [line.strip() for line in f if line.strip()][:METADATA_CACHE_SIZE]
+    loaded = 0
+    for i in range(0, len(episode_ids), batch_size):
+        loaded += len(fetch_metadata(episode_ids[i:i + batch_size], es=es))
+    print(f"Preloaded metadata of {loaded} episodes")
+    return loaded
+
+
+def clear_metadata_cache():
+    with _metadata_cache_lock:
+        _metadata_cache.clear()
+
+
+def metadata_cache_stats():
+    lookups = _metadata_lookups["hits"] + _metadata_lookups["misses"]
+    return {
+        "entries": len(_metadata_cache),
+        "max_entries": METADATA_CACHE_SIZE,
+        **_metadata_lookups,
+        "hit_rate": round(_metadata_lookups["hits"] / lookups, 4) if lookups else 0.0,
+    }
+
+
+def metadata(transcripts, es=None): 
+    """
+    Returns the metadata of the episodes of `transcripts`, from the cache when possible.
+    Episodes missing from the cache are fetched together with one multi-get.
+    Returns an empty list when the episodes index does not exist.
+    """
+    if es is None:
+        es = get_es()
+
+    keys, found, missing = lookup_metadata(transcripts)
+    if missing:
+        try:
+            found.update(fetch_metadata(missing, es=es))
+        except NotFoundError:
+            print(f"Index '{EPISODE_INDEX}' does not exist, no metadata for {len(keys)} episodes")
+            return []
+
+    return [found[key] for key in keys if key in found]  # Return processed list
@@ -0,0 +1,121 @@
+from config import get_es, TRANSCRIPT_LAYOUT
+
+# "nested" layout: one document per episode like the episode layout, with the chunks
+# mapped as nested documents holding their chunk_index. Queries match inside one chunk
+# and ES returns the offset of the matching chunk as an inner hit, so neither the
+# chunk array nor a Python scan of it is needed to find the chunk.
+NESTED_INDEX_NAME = "podcast_nested_transcripts"
+NESTED_SOURCE = ["show_id", "episode_id"]
+# inner hits are read from doc values, the chunk _source is never loaded for them
+NESTED_CHUNK_FIELDS = ["chunks.start_time", "chunks.end_time"]
+
+
+def use_nested_layout(layout=None):
+    return (layout or TRANSCRIPT_LAYOUT) == "nested"
+
+
+def nested_chunks_query(query, first_chunk=False):
+    """
+    Wraps a query on the chunks.* fields in a nested query. The best matching chunk of every
+    episode (the earliest one with `first_chunk`) comes back as the "matched_chunk" inner hit,
+    with its offset, score and times but without _source.
+    """
+    inner_hits = {
+        "name": "matched_chunk",
+        "size": 1,
+        "_source": False,
+        "docvalue_fields": NESTED_CHUNK_FIELDS
+    }
+    if first_chunk:
+        inner_hits["sort"] = [{"chunks.chunk_index": "asc"}]
+    return {
+        "nested": {
+            "path": "chunks",
+            "query": query,
+            "score_mode": "max",
+            "inner_hits": inner_hits
+        }
+    }
+
+
+def get_nested_hit_chunks(hits):
+    """
+    Matched chunk of every hit of a nested_chunks_query, as a chunk dict without its sentence,
+    tagged with the query and the score of the hit. Hits without inner hit are skipped.
+    """
+    chunks = []
+    for hit in hits:
+        inner_hits = hit.get("inner_hits", {}).get("matched_chunk", {}).get("hits", {}).get("hits", [])
+        if not inner_hits:
+            continue
+        inner_hit = inner_hits[0]
+        fields = inner_hit.get("fields", {})
+        chunks.append({
+            "show_id": hit["_source"]["show_id"],
+            "episode_id": hit["_source"]["episode_id"],
+            "chunk_index": inner_hit["_nested"]["offset"],
+            "start_time": fields.get("chunks.start_time", [None])[0],
+            "end_time": fields.get("chunks.end_time", [None])[0],
+            "chunk_score": inner_hit.get("_score"),
+            "score": hit["_score"],
+            "query": hit["_source"]["query"]
+        })
+    return chunks
+
+
+def get_nested_chunk_ranges(ranges, index_name=NESTED_INDEX_NAME, es=None):
+    """
+    Nested layout version of chunks.get_chunk_ranges: fetches chunk ranges of several episodes
+    in a single _msearch, one search per episode returning only the chunks of its range.
+
+    Parameters:
+        ranges (list[tuple]): (episode_id, first_chunk_index, last_chunk_index) tuples, bounds included.
+
+    Returns:
+        dict: episode_id -> {chunk_index: chunk}
+    """
+    if es is None:
+        es = get_es()
+
+    if not ranges:
+        return {}
+
+    searches = []
+    for episode_id, first, last in ranges:
+        searches.append({"index": index_name})
+        searches.append({
+            "size": 1,
+            "_source": False,
+            "query": {
+                "bool": {
+                    "filter": [
+                        {"term": {"episode_id": episode_id}},
+                        {
+                            "nested": {
+                                "path": "chunks",
+                                "query": {"range": {"chunks.chunk_index": {"gte": first, "lte": last}}},
+                                "inner_hits": {
+                                    "name": "window",
+                                    "size": last - first + 1,
+                                    "sort": [{"chunks.chunk_index": "asc"}]
+                                }
+                            }
+                        }
+                    ]
+                }
+            }
+        })
+
+    responses = es.msearch(searches=searches)["responses"]
+
+    chunks_by_episode = {}
+    for (episode_id, _, _), response in zip(ranges, responses):
+        if "error" in response:
+            print(f"Error fetching the chunks of episode {episode_id}: {response['error']}")
+            continue
+        for hit in response["hits"]["hits"]:
+            window = hit["inner_hits"]["window"]["hits"]["hits"]
+            chunks = chunks_by_episode.setdefault(episode_id, {})
+            for inner_hit in window:
+                chunks[inner_hit["_nested"]["offset"]] = inner_hit["_source"]
+    return chunks_by_episode
@@ -0,0 +1,205 @@
+"""
+Cursor pagination of /search with a point in time (PIT) and search_after.
+
+The first page is a plain /search, served from the result cache and streamed like any other
+search; its cursor only holds the search parameters and the episodes it returned. The next
+pages read the hits of the search as a sequence of stages: the query itself, then, when it has
+fewer hits than a page (like the plain search, which then falls back on them), its spelling
+suggestions and the more_like_this fallback of the episode filters. A page continues the
+current stage after the sort values of the last hit it returned, so a deep page costs one
+search like the first one instead of a growing from/size window. Episodes already returned
+are left out with a post_filter, so every episode is returned once.
+
+The cursor is an opaque token holding the search parameters, the episodes returned so far,
+the PIT id, the remaining stages and the search_after values of the current one.
+"""
+import base64
+import binascii
+import json
+
+from elasticsearch import NotFoundError
+
+from config import get_es, SEARCH_PIT_KEEP_ALIVE
+from queries.batch import get_query_plan
+from queries.chunks import use_chunk_layout
+from queries.suggestions import get_suggested_queries
+
+CURSOR_VERSION = 3
+PAGE_PARAMS = ["q", "type", "time", "filter", "selectedEpisodes"]
+# _shard_doc is the PIT tiebreaker, unique for every document of the point in time
+PAGE_SORT = [{"_score": "desc"}, {"_shard_doc": "asc"}]
+
+
+class CursorError(ValueError):
+    """Cursor that can't be decoded, or whose point in time has expired."""
+
+
+def encode_cursor(state):
+    data = json.dumps(state, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        state = json.loads(data)
+    except (TypeError, ValueError, binascii.Error) as e:
+        raise CursorError("Invalid cursor") from e
+    if not isinstance(state, dict) or state.get("v") != CURSOR_VERSION:
+        raise CursorError("Invalid cursor")
+    return state
+
+
+def build_stage_body(plan, stage, size):
+    """
+    Search body of a ("query", text) or ("mlt", text) stage returning `size` hits, None when the
+    stage has nothing to search.
+    """
+    kind, text = stage
+    if kind == "mlt":
+        return plan["mlt_body"](size)
+    body = plan["build_body"](text)
+    return None if body is None else {**body, "size": size}
+
+
+def build_page_body(body, pit_id, search_after=None, seen=None):
+    """
+    Adds the point in time, the sort and the search_after of a page to a search body, and
+    leaves out the `seen` episodes.
+    """
+    body = {
+        **body,
+        "pit": {"id": pit_id, "keep_alive": SEARCH_PIT_KEEP_ALIVE},
+        "sort": PAGE_SORT,
+        "track_total_hits": False,
+    }
+    if search_after:
+        body["search_after"] = search_after
+    if seen:
+        body["post_filter"] = {"bool": {"must_not": [{"terms": {"episode_id": list(seen)}}]}}
+    return body
+
+
+def search_pit(es, state, body):
+    """
+    Runs a search on the point in time of the cursor `state`, keeping its PIT id up to date.
+    """
+    try:
+        response = es.search(body=body)
+    except NotFoundError as e:
+        raise CursorError("Cursor expired, run the search again") from e
+    state["pit"] = response.get("pit_id", state["pit"])
+    return response
+
+
+def uses_fallback(es, state, body, top_k):
+    """
+    Whether the plain search fell back on the suggestions: when the query itself has fewer
+    than top_k hits, counted (up to top_k) on the point in time.
+    """
+    if body is None:
+        return True
+    response = search_pit(es, state, {
+        "size": 0,
+        "query": body["query"],
+        "pit": {"id": state["pit"], "keep_alive": SEARCH_PIT_KEEP_ALIVE},
+        "track_total_hits": top_k,
+    })
+    return response["hits"]["total"]["value"] < top_k
+
+
+def supports_cursors(layout=None):
+    # chunk hits are collapsed by episode, which search_after only supports when sorting on episode_id
+    return not use_chunk_layout(layout)
+
+
+def first_page_cursor(params, results, layout=None):
+    """
+    Cursor of the page following a first page, the {transcript, metadata} `results` of a plain
+    /search. None when the layout has no cursors or the first page is empty.
+    """
+    if not supports_cursors(layout) or not results:
+        return None
+    episode_ids = [(result["transcript"] or result["metadata"])["episode_id"] for result in results]
+    return encode_cursor({
+        "v": CURSOR_VERSION,
+        "params": {key: params.get(key) for key in PAGE_PARAMS},
+        "seen": list(dict.fromkeys(episode_ids)),
+    })
+
+
+def fetch_page(cursor, es=None, layout=None):
+    """
+    Runs the searches of the page of `cursor`. The first cursor opens the point in time.
+
+    Returns:
+        tuple: (plan, hits, cursor). plan is the get_query_plan of the search, hits the hits of
+        the page, tagged with their query, and cursor the token of the next page, None after the last one.
+    """
+    if es is None:
+        es = get_es()
+    if not supports_cursors(layout):
+        raise CursorError("Pagination needs the episode or nested transcript layout")
+
+    state = decode_cursor(cursor)
+    plan = get_query_plan(state["params"], layout)
+    q = state["params"]["q"]
+    if "pit" not in state:
+        state.update(
+            pit=es.open_point_in_time(index=plan["index_name"], keep_alive=SEARCH_PIT_KEEP_ALIVE)["id"],
+            stages=[["query", q]],
+            after=None,
+        )
+
+    top_k = plan["top_k"]
+    hits = []
+    while state["stages"] and len(hits) < top_k:
+        stage = state["stages"][0]
+        size = top_k - len(hits)
+        body = build_stage_body(plan, stage, size)
+        page = []
+        if body is not None:
+            response = search_pit(es, state, build_page_body(body, state["pit"], state["after"], state["seen"]))
+            page = response["hits"]["hits"]
+            for hit in page:
+                hit["_source"]["query"] = stage[1]
+            hits.extend(page)
+            state["seen"] += [hit["_source"]["episode_id"] for hit in page]
+
+        if len(page) == size:
+            state["after"] = page[-1]["sort"]
+            continue
+
+        # stage exhausted, the next page goes on with the next one
+        state["stages"].pop(0)
+        state["after"] = None
+        # suggestions never repeat the query, so this is the query stage
+        if stage == ["query", q] and uses_fallback(es, state, build_stage_body(plan, stage, 0), top_k):
+            suggestions = get_suggested_queries(q, es, plan["suggest_index"], plan["field"], **plan["term_options"])
+            state["stages"] += [["query", suggestion] for suggestion in suggestions]
+            if plan["mlt_body"] is not None:
+                state["stages"].append(["mlt", q])
+
+    cursor = None
+    if state["stages"]:
+        cursor = encode_cursor(state)
+    else:
+        try:
+            es.close_point_in_time(id=state["pit"])
+        except NotFoundError:
+            pass
+
+    return plan, hits, cursor
+
+
+def search_page(cursor, es=None, layout=None):
+    """
+    fetch_page with the hits formatted like the results of /search.
+
+    Returns:
+        tuple: (plan, results, cursor)
+    """
+    if es is None:
+        es = get_es()
+    plan, hits, cursor = fetch_page(cursor, es, layout)
+    return plan, plan["format"](hits, es), cursor
@@ -1,6 +1,8 @@
 from config import get_es
-import re
-import itertools
+from queries.suggestions import get_suggested_queries, search_suggestions, search_with_suggestions
+from queries.highlight import highlight_query
+from queries.chunks import CHUNK_INDEX_NAME, CHUNK_SOURCE, WINDOW_INDEX_NAME, use_chunk_layout, get_window_size, filter_window_size, collapse_by_episode, get_hit_chunks, get_chunk_ranges, format_window
+from queries.nested import NESTED_INDEX_NAME, NESTED_SOURCE, use_nested_layout, nested_chunks_query, get_nested_hit_chunks, get_nested_chunk_ranges
 
 INDEX_NAME = "podcast_transcripts"
 
@@ -9,195 +11,85 @@ def highlight_words(text, phrase):
     """
     Highlights the full phrase (not individual words) in the text (case-insensitive).
     """
-    pattern = re.compile(re.escape(phrase), re.IGNORECASE)
-    return pattern.sub(r"<mark><strong><em>\g<0></em></strong></mark>", text)
-
-
-def get_suggested_phrase(phrase, es, index_name):
-    suggest_query = {
-        "suggest": {
-            "word_suggest": {
-                "text": phrase,
-                "term": {
-                    "field": "chunks.sentence",
-                    "suggest_mode": "always",
-                    "min_word_length": 2,
-                    "max_edits": 2,
-                    "prefix_length": 1
-                }
+    return highlight_query(text, phrase, phrase=True)
+
+
+def build_phrase_body(phrase, top_k=10):
+    return {
+        "size": top_k,
+        "_source": ["show_id", "episode_id", "chunks"],
+        "query": {
+            "match_phrase": {
+                "chunks.sentence": phrase
             }
         }
     }
 
-    try:
-        suggest_response = es.search(index=index_name, body=suggest_query)
-        suggestions = suggest_response["suggest"]["word_suggest"]
-        sugested_words = []
-        sugested_scores = []
-        words = []
-        scores = []
-        for entry in suggestions: 
-            if len(entry["options"]) > 0:
-                for word in entry["options"]:
-                    words.append(word["text"])
-                    scores.append(word["score"])
-            else:
-                words.append(entry["text"])
-                scores.append(1)
-            sugested_words.append(words)
-            sugested_scores.append(scores)
-            words = []
-            scores = []
-
-        #sugested_words = [[word["text"] if len(entry["options"])>0 else entry["text"] for word in entry["options"]] for entry in suggestions if entry["options"]] 
-        #sugested_score = [[word["score"] for word in entry["options"]] for entry in suggestions if entry["options"]] 
-        combinations = [' '.join(combo) for combo in itertools.product(*sugested_words)]
-        scores = [sum(combo) for combo in itertools.product(*sugested_scores)]
-
-
-        dict_combinations = {}
-        for i in range(len(combinations)):
-            dict_combinations[combinations[i]] = scores[i]
-        
-        dict_combinations = dict(sorted(dict_combinations.items(), key=lambda item: item[1], reverse=True))
-        print(dict_combinations)
-        
-
-        return list(dict_combinations.keys())
 
-    except (KeyError, IndexError):
-        return []
-    
-    
-def phrase_search(phrase, index_name=INDEX_NAME, top_k=10, es=None):
+def get_chunks_by_ids(doc_ids, index_name=INDEX_NAME, es=None):
+    """
+    Fetches the chunks of several transcript documents in a single multi-get.
+    Returns a dict _id -> list of chunks.
+    """
     if es is None:
         es = get_es()
 
-    def do_query(q):
-        query = {
-            "size": top_k,
-            "_source": ["show_id", "episode_id", "chunks"],
-            "query": {
-                "match_phrase": {
-                    "chunks.sentence": q
-                }
-            }
-        }
-        return es.search(index=index_name, body=query)
-
-    response = do_query(phrase)
-    results = []
-    seen = set()
+    doc_ids = list(dict.fromkeys(doc_ids))
+    if not doc_ids:
+        return {}
 
-    for hit in response["hits"]["hits"]:
-        source = hit["_source"]
-        doc_id = (source["show_id"], source["episode_id"])
-        seen.add(doc_id)
-        results.append({
-            "show_id": source["show_id"],
-            "episode_id": source["episode_id"],
-            "query": phrase
-        })
-
-    if len(results) < top_k:
-        suggested_phrases = get_suggested_phrase(phrase, es, index_name)
-        for suggested_phrase in suggested_phrases:
-            if suggested_phrase and suggested_phrase.lower() != phrase.lower() and len(results) < top_k:
-                new_response = do_query(suggested_phrase)
-
-                for hit in new_response["hits"]["hits"]:
-                    source = hit["_source"]
-                    doc_id = (source["show_id"], source["episode_id"])
-                    if doc_id not in seen:
-                        results.append({
-                            "show_id": source["show_id"],
-                            "episode_id": source["episode_id"],
-                            "query": suggested_phrase
-                        })
-                        seen.add(doc_id)
-                    if len(results) >= top_k:
-                        break
-            if len(results) >= top_k:
-                break
-
-    return results
+    response = es.mget(index=index_name, ids=doc_ids, source=["chunks"])
+    return {
+        doc["_id"]: doc["_source"].get("chunks", [])
+        for doc in response["docs"] if doc.get("found")
+    }
 
 
-def get_first_chunk(show_id, episode_id, phrase, index_name=INDEX_NAME, es=None, chunk_size = 30):
-    
-    if es is None:
-        es = get_es()
-    
+def find_first_chunk(chunks, show_id, episode_id, phrase, chunk_size = 30):
+    """
+    Returns the first chunk of `chunks` containing the phrase, extended with the
+    following chunks until it covers `chunk_size` seconds.
+    """
     if chunk_size not in [30, 60, 120, 180, 300]:
         raise ValueError("chunk_size must be one of [30, 60, 120, 180, 300] seconds")
-    
-    #retrieve entry that match show_id and episode_id
-    query = {
-        "size": 1,
-        "query": {
-            "bool": {
-                "must": [
-                    {"match": {"show_id": show_id}},
-                    {"match": {"episode_id": episode_id}}
-                ]
-            }
-        }
-    }
 
-    response = es.search(index=index_name, body=query)
-    if not response["hits"]["hits"]:
-        return None
-
-    doc = response["hits"]["hits"][0]["_source"]
-    best_chunk = None
+    phrase_lower = phrase.lower()
     #search for the first chunk that matches the phrase
-    for chunk in doc["chunks"]:
-        score = phrase.lower() in chunk["sentence"].lower()
-        if score:
-            best_chunk = chunk
-            if len(doc["chunks"]) == doc["chunks"].index(chunk) + 1 :
-                break
-            next_chunk = doc["chunks"][doc["chunks"].index(chunk) + 1]
-            
-            endTime = get_time_from_string(next_chunk["endTime"])
-            startTime = get_time_from_string(best_chunk["startTime"])
-            tolerance  =  15 #10% of chunk_size
-            while endTime - startTime < chunk_size + tolerance:
-                #if next_chunk is the last chunk, break
-                if doc["chunks"].index(next_chunk) == len(doc["chunks"]) - 1:
-                    break
-                #add next chunk to best_chunk
-                best_chunk["sentence"] += " " + next_chunk["sentence"]
-                best_chunk["endTime"] = next_chunk["endTime"]
-
-                next_chunk = doc["chunks"][doc["chunks"].index(next_chunk) + 1]
-                endTime = get_time_from_string(next_chunk["endTime"])
-
-            break #we retrieve the first chunk that matches
-
-    if best_chunk:
-        highlighted_sentence = highlight_words(best_chunk["sentence"], phrase)
-        return {
-            "show_id": show_id,
-            "episode_id": episode_id,
-            "chunk": highlighted_sentence,
-            "start_time": best_chunk["startTime"],
-            "end_time": best_chunk["endTime"],
-            "query": phrase
-        }
-    else:
+    matched_idx = next((i for i, chunk in enumerate(chunks) if phrase_lower in chunk["sentence"].lower()), None)
+    if matched_idx is None:
         return None
-    
-def get_time_from_string(str):
-    return float(str[:-1])
 
+    #extend with the following chunks (never the last one) while the clip stays under chunk_size + tolerance
+    tolerance = 15 #10% of chunk_size
+    start_time = chunks[matched_idx]["start_time"]
+    last_idx = matched_idx
+    while last_idx + 2 < len(chunks) and chunks[last_idx + 1]["end_time"] - start_time < chunk_size + tolerance:
+        last_idx += 1
+
+    selected_chunks = chunks[matched_idx:last_idx + 1]
+    best_chunk = {
+        "sentence": " ".join(chunk["sentence"] for chunk in selected_chunks),
+        "start_time": start_time,
+        "end_time": selected_chunks[-1]["end_time"]
+    }
+
+    highlighted_sentence = highlight_words(best_chunk["sentence"], phrase)
+    return {
+        "show_id": show_id,
+        "episode_id": episode_id,
+        "chunk": highlighted_sentence,
+        "start_time": best_chunk["start_time"],
+        "end_time": best_chunk["end_time"],
+        "query": phrase
+    }
+    
 
-def mlt_search(phrase, selected_chunks, client, index_name, size):
+def build_mlt_body(phrase, selected_chunks, size):
         like_text = [chunk["transcript"]["chunk"] for chunk in selected_chunks if "transcript" in chunk and "chunk" in chunk["transcript"]]
         if not like_text:
-            return []
+            return None
 
-        query = {
+        return {
             "size": size,
             "_source": ["show_id", "episode_id", "chunks"],
             "query": {
@@ -222,14 +114,234 @@ def mlt_search(phrase, selected_chunks, client, index_name, size):
             }
         }
 
-        response = client.search(index=index_name, body=query)
-        hits = response.get("hits", {}).get("hits", [])
-        for hit in hits:
-            hit["_source"]["query"] = phrase
-        return hits
+
+def build_phrase_chunk_body(phrase, top_k=10, selected_chunks=None, window_size=None):
+    """
+    Body of a phrase query over the chunk layout, collapsed to the first chunk containing the phrase
+    in each episode (the best chunk when `selected_chunks` triggers more_like_this).
+    Returns None when no selected chunk has text.
+    """
+    if selected_chunks:
+        like_text = [chunk["transcript"]["chunk"] for chunk in selected_chunks if "transcript" in chunk and "chunk" in chunk["transcript"]]
+        if not like_text:
+            return None
+        query = {
+            "bool": {
+                "should": [
+                    {"more_like_this": {"fields": ["sentence"], "like": like_text}},
+                    {"match_phrase": {"sentence": {"query": phrase, "boost": 2.0}}}
+                ]
+            }
+        }
+    else:
+        query = {"match_phrase": {"sentence": phrase}}
+
+    return {
+        "size": top_k,
+        "_source": CHUNK_SOURCE,
+        "query": filter_window_size(query, window_size),
+        "collapse": collapse_by_episode(first_chunk=not selected_chunks)
+    }
+
+
+def extend_chunk(chunks_by_index, idx, chunk_size = 30):
+    """
+    Chunk layout version of the extension loop of find_first_chunk: appends the following
+    chunks while the clip stays under chunk_size plus the tolerance.
+    """
+    best_chunk = chunks_by_index[idx]
+    sentence = best_chunk["sentence"]
+    end_time = best_chunk["end_time"]
+    tolerance = 15 #10% of chunk_size
+
+    next_idx = idx + 1
+    while next_idx in chunks_by_index and next_idx + 1 in chunks_by_index:
+        if chunks_by_index[next_idx]["end_time"] - best_chunk["start_time"] >= chunk_size + tolerance:
+            break
+        sentence += " " + chunks_by_index[next_idx]["sentence"]
+        end_time = chunks_by_index[next_idx]["end_time"]
+        next_idx += 1
+
+    return {
+        "start_time": best_chunk["start_time"],
+        "end_time": end_time,
+        "chunk": sentence
+    }
+
+
+def phrase_chunk_query(phrase, index_name=CHUNK_INDEX_NAME, top_k = 10, es = None, chunk_size = 30, debug = False, selected_episodes = None, layout = None, speculative = None):
+    """
+    phrase_query over the chunk layout: ES returns the matching chunk of every episode and
+    the chunks following them are fetched together in one query. In the window layout the
+    matching precomputed window is returned as it is.
+    """
+    if es is None:
+        es = get_es()
+
+    if chunk_size not in [30, 60, 120, 180, 300]:
+        raise ValueError("chunk_size must be one of [30, 60, 120, 180, 300] seconds")
+
+    window_size = get_window_size(chunk_size, layout)
+    search_index = WINDOW_INDEX_NAME if window_size else index_name
+
+    build_body = lambda q: build_phrase_chunk_body(q, top_k, selected_episodes, window_size)
+    response, suggested_phrases = search_with_suggestions(
+        build_body(phrase), phrase, es, search_index,
+        suggest_index=index_name, field="sentence", speculative=speculative
+    )
+    hits = response["hits"]["hits"]
+    for hit in hits:
+        hit["_source"]["query"] = phrase
+
+    if len(hits) < top_k:
+        if suggested_phrases is None:
+            suggested_phrases = get_suggested_queries(phrase, es, index_name, field="sentence")
+        search_suggestions(suggested_phrases, build_body, hits, top_k, es=es, index_name=search_index)
+
+    return format_chunk_hits(hits, chunk_size=chunk_size, index_name=index_name, es=es, precomputed=window_size is not None, debug=debug)
+
+
+def format_chunk_hits(hits, chunk_size=30, index_name=CHUNK_INDEX_NAME, es=None, precomputed=False, debug=False):
+    """
+    Extends the matching chunk of every collapsed hit to chunk_size seconds, with the following
+    chunks of all hits fetched together in one query. Precomputed windows are used as they are.
+    """
+    matched = get_hit_chunks(hits)
+
+    # chunks are ~30s but can be shorter, so fetch twice as many as needed
+    n = chunk_size // 30
+    chunks_by_episode = get_chunk_ranges(
+        [(chunk["episode_id"], chunk["chunk_index"], chunk["chunk_index"] + 2 * n + 1) for chunk in matched],
+        index_name, es=es
+    ) if not precomputed else {}
+
+    results = []
+    for chunk in matched:
+        if not precomputed:
+            chunks_by_index = chunks_by_episode.get(chunk["episode_id"], {chunk["chunk_index"]: chunk})
+            window = extend_chunk(chunks_by_index, chunk["chunk_index"], chunk_size=chunk_size)
+        else:
+            window = format_window(chunk)
+        results.append({
+            "show_id": chunk["show_id"],
+            "episode_id": chunk["episode_id"],
+            "chunk": highlight_words(window["chunk"], chunk["query"]),
+            "start_time": window["start_time"],
+            "end_time": window["end_time"],
+            "query": chunk["query"]
+        })
+        if debug:
+            print(f"Show: {chunk['show_id']}, Episode: {chunk['episode_id']}, Time: {window['start_time']} → {window['end_time']}")
+
+    return results
+
+
+def build_phrase_nested_body(phrase, top_k=10, selected_chunks=None):
+    """
+    Body of a phrase query over the nested layout. The first chunk containing the phrase in each
+    episode (the best chunk when `selected_chunks` triggers more_like_this) comes back as an inner hit.
+    Returns None when no selected chunk has text.
+    """
+    if selected_chunks:
+        like_text = [chunk["transcript"]["chunk"] for chunk in selected_chunks if "transcript" in chunk and "chunk" in chunk["transcript"]]
+        if not like_text:
+            return None
+        query = {
+            "bool": {
+                "should": [
+                    {"more_like_this": {"fields": ["chunks.sentence"], "like": like_text}},
+                    {"match_phrase": {"chunks.sentence": {"query": phrase, "boost": 2.0}}}
+                ]
+            }
+        }
+    else:
+        query = {"match_phrase": {"chunks.sentence": phrase}}
+
+    return {
+        "size": top_k,
+        "_source": NESTED_SOURCE,
+        "query": nested_chunks_query(query, first_chunk=not selected_chunks)
+    }
 
 
-def phrase_query(phrase, index_name= INDEX_NAME, top_k = 10, es = None, chunk_size = 30, debug = False, selected_episodes = None):
+def format_nested_hits(hits, chunk_size=30, index_name=NESTED_INDEX_NAME, es=None, debug=False):
+    """
+    Nested layout version of format_chunk_hits: the matching chunk offset comes from the inner hit,
+    and it is extended with the following chunks of all hits fetched together in one _msearch.
+    """
+    matched = get_nested_hit_chunks(hits)
+
+    # chunks are ~30s but can be shorter, so fetch twice as many as needed
+    n = chunk_size // 30
+    chunks_by_episode = get_nested_chunk_ranges(
+        [(chunk["episode_id"], chunk["chunk_index"], chunk["chunk_index"] + 2 * n + 1) for chunk in matched],
+        index_name, es=es
+    )
+
+    results = []
+    for chunk in matched:
+        chunks_by_index = chunks_by_episode.get(chunk["episode_id"], {})
+        if chunk["chunk_index"] not in chunks_by_index:
+            continue
+        window = extend_chunk(chunks_by_index, chunk["chunk_index"], chunk_size=chunk_size)
+        results.append({
+            "show_id": chunk["show_id"],
+            "episode_id": chunk["episode_id"],
+            "chunk": highlight_words(window["chunk"], chunk["query"]),
+            "start_time": window["start_time"],
+            "end_time": window["end_time"],
+            "query": chunk["query"]
+        })
+        if debug:
+            print(f"Show: {chunk['show_id']}, Episode: {chunk['episode_id']}, Time: {window['start_time']} → {window['end_time']}")
+
+    return results
+
+
+def phrase_nested_query(phrase, index_name=NESTED_INDEX_NAME, top_k = 10, es = None, chunk_size = 30, debug = False, selected_episodes = None, speculative = None):
+    """
+    phrase_query over the nested layout: ES returns the offset of the matching chunk of every
+    episode, without the chunk array, and only the chunks following it are fetched.
+    """
+    if es is None:
+        es = get_es()
+
+    if chunk_size not in [30, 60, 120, 180, 300]:
+        raise ValueError("chunk_size must be one of [30, 60, 120, 180, 300] seconds")
+
+    build_body = lambda q: build_phrase_nested_body(q, top_k, selected_episodes)
+    response, suggested_phrases = search_with_suggestions(build_body(phrase), phrase, es, index_name, speculative=speculative)
+    hits = response["hits"]["hits"]
+    for hit in hits:
+        hit["_source"]["query"] = phrase
+
+    if len(hits) < top_k:
+        if suggested_phrases is None:
+            suggested_phrases = get_suggested_queries(phrase, es, index_name)
+        search_suggestions(suggested_phrases, build_body, hits, top_k, es=es, index_name=index_name)
+
+    return format_nested_hits(hits, chunk_size=chunk_size, index_name=index_name, es=es, debug=debug)
+
+
+def format_hits(hits, chunk_size=30, index_name=INDEX_NAME, es=None):
+    """
+    Returns the first chunk containing the query of every transcript hit (see find_first_chunk).
+    Hits returned without their chunks are completed with one multi-get.
+    """
+    missing = [hit["_id"] for hit in hits if "chunks" not in hit["_source"]]
+    fetched_chunks = get_chunks_by_ids(missing, index_name, es=es) if missing else {}
+
+    results = []
+    for hit in hits:
+        source = hit["_source"]
+        chunks = source.get("chunks", fetched_chunks.get(hit["_id"], []))
+        best_chunk = find_first_chunk(chunks, source["show_id"], source["episode_id"], source["query"], chunk_size=chunk_size)
+        if best_chunk:
+            results.append(best_chunk)
+    return results
+
+
+def phrase_query(phrase, index_name= INDEX_NAME, top_k = 10, es = None, chunk_size = 30, debug = False, selected_episodes = None, layout = None, speculative = None):
     """
     Search for a phrase in the transcript chunks of podcast episodes stored in Elasticsearch.
 
@@ -242,60 +354,54 @@ def phrase_query(phrase, index_name= INDEX_NAME, top_k = 10, es = None, chunk_si
         index_name (str): The name of the Elasticsearch index to search.
         top_k (int, optional): The number of top results (episodes) to retrieve. Default is 1.
         es (Elasticsearch, optional): An existing Elasticsearch client instance. If None, a new one is fetched from `get_es()`.
-        chunk_size (int, optional): Desired duration (in seconds) of the output chunk. Must be one of [30, 60, 90, 120, 180, 300]. Default is 30.
+        chunk_size (int, optional): Desired duration (in seconds) of the output chunk. Must be one of [30, 60, 120, 180, 300]. Default is 30.
         debug (bool, optional): If True, prints debug information about matched results. Default is False.
+        layout (str, optional): "episode", "chunk", "window" or "nested" transcript layout. Defaults to TRANSCRIPT_LAYOUT from config.
+        speculative (bool, optional): Send the term suggest with the first search. Defaults to SPECULATIVE_SUGGEST from config.
 
     Returns:
         List[dict]: A list of dictionaries, each containing:
             - show (str): The show ID.
             - episode (str): The episode ID.
             - chunk (str): The chunk of transcript text containing the phrase.
-            - start_time (str): Start time of the chunk (e.g., '5.43s').
-            - end_time (str): End time of the chunk (e.g., '35.29s').
+            - start_time (float): Start time of the chunk in seconds (e.g., 5.43).
+            - end_time (float): End time of the chunk in seconds (e.g., 35.29).
     """
     
     if es is None:
         es = get_es()
+
+    if use_chunk_layout(layout):
+        return phrase_chunk_query(phrase, top_k=top_k, es=es, chunk_size=chunk_size, debug=debug, selected_episodes=selected_episodes, layout=layout, speculative=speculative)
+    if use_nested_layout(layout):
+        return phrase_nested_query(phrase, top_k=top_k, es=es, chunk_size=chunk_size, debug=debug, selected_episodes=selected_episodes, speculative=speculative)
         
-    # Perform the more_like_this based on whether `selected_episodes` is provided
+    # more_like_this when `selected_episodes` is provided, plain phrase search otherwise
     if selected_episodes:
-        
-        hits = mlt_search(phrase, selected_episodes, es, index_name, top_k)
-        
-        if len(hits) < top_k:
-            corrected = get_suggested_phrase(phrase, es, index_name)
-            if corrected and corrected.lower() != phrase.lower():
-                hits = mlt_search(corrected, selected_episodes, es, index_name, top_k)
-                phrase = corrected
-        
-        response = hits
-            
-            
+        build_body = lambda corrected: build_mlt_body(corrected, selected_episodes, top_k)
     else:
-        # Perform normal phrase search
-        response = phrase_search(phrase, index_name=index_name, top_k=top_k, es=es)
-    
-    results = []
-    for doc in response:
-        
-        if debug:
-            print(f"Show ID: {doc['show_id']}, Episode ID: {doc['episode_id']}")
-            print("\n🎯 Best Chunk in Episode:")
-            
-        source = doc["_source"] if "_source" in doc else doc
-        best_chunk = get_first_chunk(source['show_id'], source['episode_id'], source['query'], index_name, es=es, chunk_size=chunk_size)
-        if best_chunk:
-            results.append(best_chunk)
-            if debug:
-                print(f"Show: {best_chunk['show_id']}")
-                print(f"Episode: {best_chunk['episode_id']}")
-                print(f"Chunk: {best_chunk['chunk']}")
-                print(f"Time: {best_chunk['start_time']} → {best_chunk['end_time']}")
-                print(f"Query: {best_chunk['query']} (original was {phrase})")
-                print(f"Time: {float(best_chunk['start_time'][:-1]) - float(best_chunk['end_time'][:-1])}")
-                print("|----------------------------------|\n\n")
-        else:
-            print("No chunk found for.")
+        build_body = lambda corrected: build_phrase_body(corrected, top_k)
+
+    response, correcteds = search_with_suggestions(build_body(phrase), phrase, es, index_name, speculative=speculative)
+    hits = response["hits"]["hits"]
+    for hit in hits:
+        hit["_source"]["query"] = phrase
+
+    if len(hits) < top_k:
+        if correcteds is None:
+            correcteds = get_suggested_queries(phrase, es, index_name)
+        search_suggestions(correcteds, build_body, hits, top_k, es=es, index_name=index_name)
+
+    results = format_hits(hits, chunk_size=chunk_size, index_name=index_name, es=es)
+    if debug:
+        for best_chunk in results:
+            print(f"Show: {best_chunk['show_id']}")
+            print(f"Episode: {best_chunk['episode_id']}")
+            print(f"Chunk: {best_chunk['chunk']}")
+            print(f"Time: {best_chunk['start_time']} → {best_chunk['end_time']}")
+            print(f"Query: {best_chunk['query']} (original was {phrase})")
+            print("|----------------------------------|\n\n")
+        print(f"{len(hits) - len(results)} hits without a chunk containing the phrase")
     return results
 
     
@@ -0,0 +1,348 @@
+from config import get_es, SPECULATIVE_SUGGEST
+from collections import OrderedDict
+import bisect
+import heapq
+import json
+import threading
+
+# Hard cap on the number of corrected queries a caller gets back, i.e. on the
+# number of follow-up searches a misspelled query can trigger.
+MAX_SUGGESTIONS = 5
+
+TERM_SUGGEST_OPTIONS = {
+    "suggest_mode": "always",
+    "min_word_length": 2,
+    "max_edits": 2,
+    "prefix_length": 1
+}
+
+
+def build_term_suggest(text, field="chunks.sentence", **term_options):
+    """
+    Suggest section of a search body running the term suggester on `text`.
+    """
+    return {
+        "suggestion": {
+            "text": text,
+            "term": {
+                "field": field,
+                **(term_options or TERM_SUGGEST_OPTIONS)
+            }
+        }
+    }
+
+
+def parse_term_options(response):
+    """
+    Returns, for every token of a suggest response, its options as (word, score) tuples
+    sorted best first. Tokens without options keep their own text with score 1.
+    """
+    return [options for _, options in parse_term_entries(response)]
+
+
+def parse_term_entries(response):
+    """
+    Same as parse_term_options, with the offset of each token in the suggested text.
+    """
+    entries = []
+    for entry in response["suggest"]["suggestion"]:
+        if entry["options"]:
+            options = [(option["text"], option["score"]) for option in entry["options"]]
+            entries.append((entry["offset"], sorted(options, key=lambda option: option[1], reverse=True)))
+        else:
+            entries.append((entry["offset"], [(entry["text"], 1)]))
+    return entries
+
+
+# Term correction cache: (index, field, suggest options, word) -> options of the
+# tokens ES makes of that word. Corrections only change with the index content,
+# so the cache is flushed when the indices change (see cache.get_index_generation).
+TERM_CACHE_SIZE = 10000
+_term_cache = OrderedDict()
+_term_cache_lock = threading.Lock()
+_term_lookups = {"hits": 0, "misses": 0}
+
+
+def get_term_cache_key(index_name, field, term_options):
+    return (index_name, field, json.dumps(term_options or TERM_SUGGEST_OPTIONS, sort_keys=True))
+
+
+def get_cached_terms(cache_key, words):
+    """
+    Returns word -> cached options for the words of `words` found in the term cache.
+    """
+    cached = {}
+    with _term_cache_lock:
+        for word in dict.fromkeys(words):
+            options = _term_cache.get((*cache_key, word.lower()))
+            if options is None:
+                _term_lookups["misses"] += 1
+                continue
+            _term_cache.move_to_end((*cache_key, word.lower()))
+            _term_lookups["hits"] += 1
+            cached[word] = options
+    return cached
+
+
+def cache_terms(cache_key, text, response):
+    """
+    Stores the suggest options of a response on `text` per whitespace separated word, and
+    returns them as word -> list of options (one per token ES made of the word, usually one).
+    Only the first occurrence of a repeated word is kept, so that the word gets the options of
+    one occurrence and not those of all of them.
+    """
+    words = text.split()
+    starts = []
+    position = 0
+    for word in words:
+        position = text.index(word, position)
+        starts.append(position)
+        position += len(word)
+
+    first_occurrence = {}
+    for i, word in enumerate(words):
+        first_occurrence.setdefault(word, i)
+
+    options_per_word = {word: [] for word in first_occurrence}
+    for offset, options in parse_term_entries(response):
+        i = max(bisect.bisect_right(starts, offset) - 1, 0)
+        if first_occurrence[words[i]] == i:
+            options_per_word[words[i]].append(options)
+
+    with _term_cache_lock:
+        for word, options in options_per_word.items():
+            _term_cache[(*cache_key, word.lower())] = options
+            _term_cache.move_to_end((*cache_key, word.lower()))
+        while len(_term_cache) > TERM_CACHE_SIZE:
+            _term_cache.popitem(last=False)
+    return options_per_word
+
+
+def clear_term_cache():
+    with _term_cache_lock:
+        _term_cache.clear()
+
+
+def term_cache_stats():
+    lookups = _term_lookups["hits"] + _term_lookups["misses"]
+    return {
+        "entries": len(_term_cache),
+        "max_entries": TERM_CACHE_SIZE,
+        **_term_lookups,
+        "hit_rate": round(_term_lookups["hits"] / lookups, 4) if lookups else 0.0,
+    }
+
+
+def lookup_term_options(text, index_name, field="chunks.sentence", **term_options):
+    """
+    Looks the words of `text` up in the term cache.
+
+    Returns:
+        tuple: (cache_key, options_per_word, missing_text). options_per_word holds the cached
+        words, missing_text the other ones, each once, for the term suggest (None when every
+        word is cached).
+    """
+    cache_key = get_term_cache_key(index_name, field, term_options)
+    options_per_word = get_cached_terms(cache_key, text.split())
+    missing = [word for word in dict.fromkeys(text.split()) if word not in options_per_word]
+    return cache_key, options_per_word, " ".join(missing) or None
+
+
+def get_options_per_term(text, options_per_word):
+    """
+    Options of every token of `text`, in order, from the options of its words.
+    """
+    return [options for word in text.split() for options in options_per_word[word]]
+
+
+def get_term_options(text, es, index_name, field="chunks.sentence", **term_options):
+    """
+    Returns the options of every token of `text` (see parse_term_options). Words already in
+    the term cache are not suggested again, the others go out in one term suggest query.
+    """
+    cache_key, options_per_word, missing_text = lookup_term_options(text, index_name, field, **term_options)
+    if missing_text:
+        suggest_query = {"suggest": build_term_suggest(missing_text, field, **term_options)}
+        response = es.search(index=index_name, body=suggest_query, size=0)
+        options_per_word.update(cache_terms(cache_key, missing_text, response))
+
+    return get_options_per_term(text, options_per_word)
+
+
+def iter_best_combinations(options_per_term):
+    """
+    Lazily yields (phrase, score) combinations of one option per term, by decreasing sum of scores.
+
+    Instead of building the whole Cartesian product, a heap holds the frontier of option
+    index vectors: popping a vector pushes its successors (one term moved to its next option).
+    Getting the first N combinations costs O(N * terms * log N).
+    """
+    if not options_per_term or not all(options_per_term):
+        return
+
+    def score(indices):
+        return sum(options[i][1] for options, i in zip(options_per_term, indices))
+
+    start = (0,) * len(options_per_term)
+    heap = [(-score(start), start)]
+    visited = {start}
+    seen_phrases = set()
+
+    while heap:
+        negative_score, indices = heapq.heappop(heap)
+        phrase = " ".join(options[i][0] for options, i in zip(options_per_term, indices))
+        if phrase not in seen_phrases:
+            seen_phrases.add(phrase)
+            yield phrase, -negative_score
+
+        for term, i in enumerate(indices):
+            if i + 1 < len(options_per_term[term]):
+                successor = indices[:term] + (i + 1,) + indices[term + 1:]
+                if successor not in visited:
+                    visited.add(successor)
+                    heapq.heappush(heap, (-score(successor), successor))
+
+
+def rank_suggestions(text, options_per_term, limit=MAX_SUGGESTIONS):
+    """
+    Returns at most `limit` phrases built from the term options, best first, leaving out the text itself.
+    """
+    suggestions = []
+    for phrase, _ in iter_best_combinations(options_per_term):
+        if phrase.lower() == text.lower():
+            continue
+        suggestions.append(phrase)
+        if len(suggestions) >= min(limit, MAX_SUGGESTIONS):
+            break
+    return suggestions
+
+
+def get_suggested_queries(text, es=None, index_name=None, field="chunks.sentence", limit=MAX_SUGGESTIONS, **term_options):
+    """
+    Returns at most `limit` corrected versions of `text`, best first, leaving out the text itself.
+    """
+    if es is None:
+        es = get_es()
+
+    try:
+        options_per_term = get_term_options(text, es, index_name, field, **term_options)
+    except (KeyError, IndexError) as e:
+        print(f"Error in suggestion query for: {text}")
+        print(e)
+        return []
+
+    return rank_suggestions(text, options_per_term, limit)
+
+
+def search_with_suggestions(body, text, es=None, index_name=None, suggest_index=None, field="chunks.sentence", speculative=None, limit=MAX_SUGGESTIONS, **term_options):
+    """
+    Runs the first search of a query. In speculative mode the term suggest of `text` goes out in
+    the same round trip: as the suggest section of the body, or through _msearch when the
+    suggestions come from another index. A short result list can then be completed without
+    waiting for a separate suggest request.
+
+    Returns:
+        tuple: (response, suggestions). suggestions is None when not speculative, the caller
+        then falls back to get_suggested_queries.
+    """
+    if es is None:
+        es = get_es()
+    if speculative is None:
+        speculative = SPECULATIVE_SUGGEST
+
+    # nothing to search (e.g. more_like_this without any selected text), nor to correct
+    if body is None:
+        return {"hits": {"hits": []}}, []
+
+    if not speculative:
+        return es.search(index=index_name, body=body), None
+
+    # every word already corrected once: the suggestions come from the term cache
+    cache_key, options_per_word, suggest_text = lookup_term_options(text, suggest_index or index_name, field, **term_options)
+    if suggest_text is None:
+        return es.search(index=index_name, body=body), rank_suggestions(text, get_options_per_term(text, options_per_word), limit)
+
+    # each word is suggested once, repeated words reuse its options
+    suggest = build_term_suggest(suggest_text, field, **term_options)
+    if suggest_index is None or suggest_index == index_name:
+        response = es.search(index=index_name, body={**body, "suggest": suggest})
+        suggest_response = response
+    else:
+        response, suggest_response = es.msearch(searches=[
+            {"index": index_name}, body,
+            {"index": suggest_index}, {"size": 0, "suggest": suggest}
+        ])["responses"]
+        if "error" in response:
+            # run it again on its own so the caller gets the usual exception
+            response = es.search(index=index_name, body=body)
+
+    try:
+        options_per_word.update(cache_terms(cache_key, suggest_text, suggest_response))
+        suggestions = rank_suggestions(text, get_options_per_term(text, options_per_word), limit)
+    except (KeyError, IndexError) as e:
+        print(f"Error in suggestion query for: {text}")
+        print(e)
+        suggestions = []
+    return response, suggestions
+
+
+def build_suggestion_searches(suggestions, build_body, index_name=None):
+    """
+    Returns the _msearch lines of the suggestions and the suggestions they are for.
+    """
+    searches = []
+    searched = []
+    for suggestion in suggestions:
+        body = build_body(suggestion)
+        if body is None:
+            continue
+        searches.append({"index": index_name})
+        searches.append(body)
+        searched.append(suggestion)
+    return searches, searched
+
+
+def merge_suggestion_hits(searched, responses, hits, top_k):
+    """
+    Appends the hits of the suggestion responses, best suggestion first, to `hits` until there
+    are `top_k` of them, skipping episodes already there and tagging hits with their query.
+    """
+    seen = {(hit["_source"].get("show_id"), hit["_source"].get("episode_id")) for hit in hits}
+    for suggestion, response in zip(searched, responses):
+        if "error" in response:
+            print(f"Error in suggested search for: {suggestion} — {response['error']}")
+            continue
+        for hit in response["hits"]["hits"]:
+            doc_id = (hit["_source"].get("show_id"), hit["_source"].get("episode_id"))
+            if doc_id in seen:
+                continue
+            seen.add(doc_id)
+            hit["_source"]["query"] = suggestion
+            hits.append(hit)
+            if len(hits) >= top_k:
+                return hits
+    return hits
+
+
+def search_suggestions(suggestions, build_body, hits, top_k, es=None, index_name=None):
+    """
+    Fallback stage: sends the search of every suggestion in a single _msearch request and
+    appends their hits, best suggestion first, to `hits` until there are `top_k` of them.
+    Hits are deduplicated by (show_id, episode_id) and tagged with the query that found them.
+
+    Parameters:
+        suggestions (list[str]): Corrected queries, best first.
+        build_body (callable): Returns the search body of a query, or None to skip it.
+        hits (list): Hits of the original query, extended in place.
+    """
+    if es is None:
+        es = get_es()
+
+    if not suggestions or len(hits) >= top_k:
+        return hits
+
+    searches, searched = build_suggestion_searches(suggestions, build_body, index_name)
+    if not searches:
+        return hits
+    responses = es.msearch(searches=searches)["responses"]
+    return merge_suggestion_hits(searched, responses, hits, top_k)
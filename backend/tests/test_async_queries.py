@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from queries.async_queries import run_search
+from queries.suggestions import clear_term_cache
+
+
+class FakeAsyncES:
+    """
+    Async client returning `hits` for the searches of `text`, and suggesting "cat" for every word.
+    """
+
+    def __init__(self, hits):
+        self.hits = hits
+        self.requests = []
+
+    async def search(self, index=None, body=None, **kwargs):
+        if "suggest" in body:
+            self.requests.append("suggest")
+            text = body["suggest"]["suggestion"]["text"]
+            return {"suggest": {"suggestion": [
+                {"text": text, "offset": 0, "length": len(text), "options": [{"text": "cat", "score": 0.9}]}
+            ]}}
+        self.requests.append("search")
+        return {"hits": {"hits": [{"_source": {"show_id": "s", "episode_id": f"e{i}"}} for i in range(self.hits)]}}
+
+    async def msearch(self, searches=None):
+        self.requests.append("msearch")
+        return {"responses": [{"hits": {"hits": [{"_source": {"show_id": "s", "episode_id": "suggested"}}]}}]}
+
+
+def build_body(text):
+    return {"query": {"match": {"chunks.sentence": text}}}
+
+
+@pytest.fixture(autouse=True)
+def term_cache():
+    clear_term_cache()
+    yield
+    clear_term_cache()
+
+
+def test_full_page_sends_no_suggest():
+    es = FakeAsyncES(hits=10)
+    hits = asyncio.run(run_search("dog", build_body, 10, es, "index", speculative=False))
+
+    assert len(hits) == 10
+    assert es.requests == ["search"]
+
+
+def test_short_page_suggests_after_the_first_search():
+    es = FakeAsyncES(hits=1)
+    hits = asyncio.run(run_search("dgo", build_body, 10, es, "index", speculative=False))
+
+    assert es.requests == ["search", "suggest", "msearch"]
+    assert [hit["_source"]["query"] for hit in hits] == ["dgo", "cat"]
+
+
+def test_speculative_suggest_goes_with_the_first_search():
+    es = FakeAsyncES(hits=10)
+    asyncio.run(run_search("dog", build_body, 10, es, "index", speculative=True))
+
+    assert sorted(es.requests) == ["search", "suggest"]
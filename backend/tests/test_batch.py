@@ -0,0 +1,84 @@
+import pytest
+
+from queries.batch import run_batch
+from queries.metadata import clear_metadata_cache
+from queries.suggestions import clear_term_cache
+
+
+class FakeES:
+    """
+    _msearch over transcripts holding one chunk with the episode id, ranked per query text,
+    with the term suggester correcting the words of `corrections`.
+    """
+
+    def __init__(self, results, corrections):
+        self.results = results
+        self.corrections = corrections
+        self.msearches = []
+
+    def hit(self, episode_id):
+        return {
+            "_source": {"show_id": "show", "episode_id": episode_id,
+                        "chunks": [{"sentence": episode_id, "start_time": 0.0, "end_time": 30.0}]},
+            "_score": 1.0,
+        }
+
+    def response(self, body):
+        if "suggest" in body:
+            text = body["suggest"]["suggestion"]["text"]
+            return {"suggest": {"suggestion": [
+                {"text": word, "offset": text.index(word), "length": len(word),
+                 "options": [{"text": self.corrections[word], "score": 0.9}] if word in self.corrections else []}
+                for word in text.split()
+            ]}}
+        text = body["query"]["function_score"]["query"]["bool"]["must"][0]["match"]["chunks.sentence"]["query"]
+        return {"hits": {"hits": [self.hit(episode_id) for episode_id in self.results.get(text, [])[:body["size"]]]}}
+
+    def msearch(self, searches=None):
+        bodies = searches[1::2]
+        self.msearches.append(["suggest" if "suggest" in body else "search" for body in bodies])
+        return {"responses": [self.response(body) for body in bodies]}
+
+    def mget(self, index=None, ids=None, source=None):
+        return {"docs": [{"found": True, "_source": {"show_id": "show", "episode_id": episode_id}} for episode_id in ids]}
+
+
+@pytest.fixture(autouse=True)
+def caches():
+    clear_term_cache()
+    clear_metadata_cache()
+    yield
+    clear_term_cache()
+    clear_metadata_cache()
+
+
+def payload(q, **overrides):
+    return {"q": q, "type": "Ranking", "time": 30, "filter": "general", "selectedEpisodes": [], **overrides}
+
+
+def test_batch_runs_one_msearch_per_stage():
+    es = FakeES(
+        {"dog": [f"dog{i}" for i in range(12)], "dgo": ["dgo0"], "cat": [f"cat{i}" for i in range(3)]},
+        corrections={"dgo": "dog"},
+    )
+
+    output = run_batch([payload("dog"), payload("dgo"), payload("dog", type="Unknown")], es, layout="episode")
+
+    assert [result["transcript"]["episode_id"] for result in output[0]["results"]] == [f"dog{i}" for i in range(10)]
+    # the short payload is completed with the hits of its suggestion, tagged with it
+    assert [(result["transcript"]["episode_id"], result["transcript"]["query"]) for result in output[1]["results"]] == (
+        [("dgo0", "dgo")] + [(f"dog{i}", "dog") for i in range(9)]
+    )
+    assert output[1]["results"][0]["metadata"]["episode_id"] == "dgo0"
+    assert "error" in output[2]
+    # first searches, term suggest of the short payload, suggestion searches
+    assert es.msearches == [["search", "search"], ["suggest"], ["search"]]
+
+
+def test_cached_words_are_not_suggested_again():
+    es = FakeES({"dgo": ["dgo0"]}, corrections={"dgo": "dog"})
+    run_batch([payload("dgo")], es, layout="episode")
+    es.msearches.clear()
+
+    run_batch([payload("dgo", time=60)], es, layout="episode")
+    assert ["suggest"] not in es.msearches
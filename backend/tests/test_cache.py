@@ -0,0 +1,122 @@
+import pytest
+
+import cache
+from cache import ResultCache, get_index_generation, make_cache_key
+from queries.suggestions import cache_terms, get_cached_terms, get_term_cache_key
+
+
+class FakeIndices:
+    def __init__(self, indices):
+        self.indices = indices
+
+    def stats(self, **kwargs):
+        return {"indices": {
+            name: {"uuid": uuid, "shards": {"0": [{"seq_no": {"max_seq_no": max_seq_no}, "routing": {"primary": True}}]}}
+            for name, (uuid, max_seq_no) in self.indices.items()
+        }}
+
+
+class FakeES:
+    def __init__(self, indices):
+        self.indices = FakeIndices(indices)
+
+
+@pytest.fixture(autouse=True)
+def generation():
+    cache._generation.update(value=None, checked_at=float("-inf"))
+    yield
+    cache._generation.update(value=None, checked_at=float("-inf"))
+
+
+def params(q, **overrides):
+    return {"q": q, "type": "Ranking", "time": 30, "filter": "general", "selectedEpisodes": [], **overrides}
+
+
+def test_cache_key_normalises_the_query():
+    assert make_cache_key(params("Climate  Change "), "g1") == make_cache_key(params("climate change"), "g1")
+    assert make_cache_key(params("climate", selectedEpisodes=None), "g1") == make_cache_key(params("climate"), "g1")
+
+
+def test_cache_key_depends_on_the_parameters_and_the_generation():
+    key = make_cache_key(params("climate"), "g1")
+
+    assert make_cache_key(params("climate", type="Phrase"), "g1") != key
+    assert make_cache_key(params("climate", time=60), "g1") != key
+    assert make_cache_key(params("climate"), "g2") != key
+
+
+def test_entries_are_copies():
+    results = ResultCache(max_bytes=1000, ttl=60)
+    value = [{"episode_id": "e1"}]
+    results.set("key", value)
+    value.append({"episode_id": "e2"})
+
+    cached = results.get("key")
+    cached.append({"episode_id": "e3"})
+    assert results.get("key") == [{"episode_id": "e1"}]
+
+
+def test_least_recently_used_entries_are_evicted_by_size():
+    # 12 bytes of JSON per entry, room for two of them
+    results = ResultCache(max_bytes=30, ttl=60)
+    results.set("a", "x" * 10)
+    results.set("b", "x" * 10)
+    results.get("a")
+    results.set("c", "x" * 10)
+
+    assert results.get("b") is None
+    assert results.get("a") == "x" * 10
+    assert results.get("c") == "x" * 10
+    assert results.stats()["evictions"] == 1
+
+    # a value larger than the whole cache is not stored
+    results.set("d", "x" * 100)
+    assert results.get("d") is None
+
+
+def test_entries_expire():
+    results = ResultCache(max_bytes=1000, ttl=-1)
+    results.set("key", [1])
+
+    assert results.get("key") is None
+    assert results.stats()["expired"] == 1
+
+
+def test_generation_changes_with_writes_and_new_indices():
+    es = FakeES({"episodes": ("u1", 10), "podcast_transcripts": ("u2", 5), "other": ("u3", 1)})
+    first = get_index_generation(es, index_names=["episodes", "podcast_transcripts"])
+
+    # writes to an index that no result depends on don't matter
+    es.indices.indices["other"] = ("u3", 2)
+    cache._generation["checked_at"] = float("-inf")
+    assert get_index_generation(es, index_names=["episodes", "podcast_transcripts"]) == first
+
+    es.indices.indices["podcast_transcripts"] = ("u2", 6)
+    cache._generation["checked_at"] = float("-inf")
+    written = get_index_generation(es, index_names=["episodes", "podcast_transcripts"])
+    assert written != first
+
+    es.indices.indices["podcast_transcripts"] = ("u4", 6)
+    cache._generation["checked_at"] = float("-inf")
+    assert get_index_generation(es, index_names=["episodes", "podcast_transcripts"]) not in (first, written)
+
+
+def test_new_generation_flushes_the_caches(monkeypatch):
+    results = ResultCache(max_bytes=1000, ttl=60)
+    monkeypatch.setattr(cache, "_cache", results)
+    es = FakeES({"episodes": ("u1", 10)})
+    get_index_generation(es, index_names=["episodes"])
+
+    results.set("key", [1])
+    term_key = get_term_cache_key("episodes", "show_name", {})
+    cache_terms(term_key, "cat", {"suggest": {"suggestion": [{"text": "cat", "offset": 0, "length": 3, "options": []}]}})
+
+    # checked again within SEARCH_CACHE_GENERATION_CHECK: nothing is flushed
+    es.indices.indices["episodes"] = ("u1", 11)
+    get_index_generation(es, index_names=["episodes"])
+    assert results.get("key") == [1]
+
+    cache._generation["checked_at"] = float("-inf")
+    get_index_generation(es, index_names=["episodes"])
+    assert results.get("key") is None
+    assert get_cached_terms(term_key, ["cat"]) == {}
@@ -0,0 +1,32 @@
+import pytest
+
+from queries.chunks import get_window_slice, get_window_range, build_window
+
+
+def chunks(count):
+    return {i: {"sentence": f"s{i}", "start_time": 30.0 * i, "end_time": 30.0 * (i + 1)} for i in range(count)}
+
+
+@pytest.mark.parametrize("num_chunks", range(1, 9))
+@pytest.mark.parametrize("n", range(1, 11))
+def test_window_slice_matches_the_chunk_walk(num_chunks, n):
+    for idx in range(num_chunks):
+        start, stop = get_window_slice(num_chunks, idx, n)
+        window = build_window(chunks(num_chunks), idx, n)
+
+        assert window["chunk"] == " ".join(f"s{i}" for i in range(start, stop))
+        assert stop - start == min(n, num_chunks)
+
+
+@pytest.mark.parametrize("n", range(1, 11))
+def test_window_range_holds_the_window(n):
+    num_chunks = 12
+    for idx in range(num_chunks):
+        first, last = get_window_range(idx, n)
+        fetched = {i: chunk for i, chunk in chunks(num_chunks).items() if first <= i <= last}
+
+        assert build_window(fetched, idx, n) == build_window(chunks(num_chunks), idx, n)
+
+
+def test_window_of_a_missing_chunk_is_empty():
+    assert build_window(chunks(3), 5, 2) == {}
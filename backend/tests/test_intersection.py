@@ -0,0 +1,33 @@
+import random
+
+import pytest
+
+from queries.intersection import TOKEN_PATTERN, has_token, get_intersection_chunk_indices, clear_chunk_text_cache
+
+
+def random_text(rng, length):
+    return "".join(rng.choice("ab'_ 1é.,") for _ in range(length))
+
+
+def test_has_token_matches_the_tokenizer():
+    rng = random.Random(0)
+    for _ in range(20000):
+        text = random_text(rng, rng.randint(0, 12))
+        words = set(TOKEN_PATTERN.findall(text))
+        for token in words | set(TOKEN_PATTERN.findall(random_text(rng, 6))):
+            assert has_token(text, token) == (token in words)
+
+
+@pytest.mark.parametrize("query", ["nice", "don't", "really nice morning", "rock"])
+def test_cold_and_cached_passes_find_the_same_chunks(query):
+    sentences = [
+        "Really nice, morning people.", "a really nice morning", "nicer mornings really",
+        "don't stop", "Don", "rock'n'roll", "'rock' and roll", "nice_morning really",
+    ]
+    hit = {"_source": {"show_id": "show", "episode_id": "episode", "chunks": [{"sentence": s} for s in sentences]}}
+    tokens = set(TOKEN_PATTERN.findall(query.lower()))
+    expected = [i for i, s in enumerate(sentences) if tokens <= set(TOKEN_PATTERN.findall(s.lower()))]
+
+    clear_chunk_text_cache()
+    assert get_intersection_chunk_indices(hit, query) == expected
+    assert get_intersection_chunk_indices(hit, query) == expected
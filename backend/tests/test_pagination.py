@@ -0,0 +1,188 @@
+import pytest
+
+from queries.pagination import CURSOR_VERSION, CursorError, encode_cursor, decode_cursor, first_page_cursor, fetch_page
+from queries.suggestions import clear_term_cache
+
+
+def find_query_text(body):
+    """
+    Text of the match, match_phrase or more_like_this clause of a search body ("mlt:<text>" for the latter).
+    """
+    if isinstance(body, list):
+        return next(filter(None, (find_query_text(item) for item in body)), None)
+    if not isinstance(body, dict):
+        return None
+    for key, value in body.items():
+        if key in ("match", "match_phrase"):
+            value = next(iter(value.values()))
+            return value["query"] if isinstance(value, dict) else value
+        if key == "more_like_this":
+            return f"mlt:{value['like']}"
+        if key != "post_filter" and (text := find_query_text(value)) is not None:
+            return text
+    return None
+
+
+def find_inner_hits_names(body):
+    if isinstance(body, list):
+        return [name for item in body for name in find_inner_hits_names(item)]
+    if not isinstance(body, dict):
+        return []
+    names = [body["inner_hits"]["name"]] if "inner_hits" in body else []
+    return names + [name for value in body.values() for name in find_inner_hits_names(value)]
+
+
+class FakeES:
+    """
+    Point in time searches over ranked episode ids per query text, with the term suggester
+    correcting the words of `corrections`. Like ES, a body with two inner hits of the same
+    name is rejected.
+    """
+
+    def __init__(self, results, corrections=None):
+        self.results = results
+        self.corrections = corrections or {}
+        self.bodies = []
+        self.closed = []
+
+    def open_point_in_time(self, index=None, keep_alive=None):
+        return {"id": "pit-0"}
+
+    def close_point_in_time(self, id=None):
+        self.closed.append(id)
+
+    def search(self, index=None, body=None, **kwargs):
+        if "suggest" in body:
+            text = body["suggest"]["suggestion"]["text"]
+            return {"suggest": {"suggestion": [
+                {"text": word, "offset": text.index(word), "length": len(word),
+                 "options": [{"text": self.corrections[word], "score": 0.9}] if word in self.corrections else []}
+                for word in text.split()
+            ]}}
+
+        self.bodies.append(body)
+        names = find_inner_hits_names(body)
+        if len(names) != len(set(names)):
+            raise ValueError(f"[inner_hits] already contains an entry for key {names}")
+
+        ids = self.results.get(find_query_text(body), [])
+        if body.get("size") == 0:
+            return {"pit_id": "pit-0", "hits": {"total": {"value": min(len(ids), body["track_total_hits"])}, "hits": []}}
+
+        seen = [
+            episode_id
+            for clause in body.get("post_filter", {}).get("bool", {}).get("must_not", [])
+            for episode_id in clause["terms"]["episode_id"]
+        ]
+        after = body.get("search_after", [None, -1])[1]
+        hits = [
+            {"_source": {"show_id": "show", "episode_id": episode_id}, "_score": 1.0, "sort": [1.0, position]}
+            for position, episode_id in enumerate(ids)
+            if position > after and episode_id not in seen
+        ]
+        return {"pit_id": "pit-0", "hits": {"hits": hits[:body["size"]]}}
+
+
+def episode_ids(prefix, count):
+    return [f"{prefix}{i}" for i in range(count)]
+
+
+def first_page(ids, q, query_of=None):
+    query_of = query_of or {}
+    return [
+        {"transcript": {"show_id": "show", "episode_id": episode_id, "query": query_of.get(episode_id, q)}, "metadata": {}}
+        for episode_id in ids
+    ]
+
+
+def params(q, filter="general"):
+    return {"q": q, "type": "Ranking", "time": 30, "filter": filter, "selectedEpisodes": []}
+
+
+@pytest.fixture(autouse=True)
+def term_cache():
+    clear_term_cache()
+    yield
+    clear_term_cache()
+
+
+def test_cursor_round_trip():
+    state = {"v": CURSOR_VERSION, "params": params("dog"), "seen": ["e1"]}
+
+    assert decode_cursor(encode_cursor(state)) == state
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor", encode_cursor([1, 2]), encode_cursor({"v": CURSOR_VERSION - 1})])
+def test_invalid_cursor(cursor):
+    with pytest.raises(CursorError):
+        decode_cursor(cursor)
+
+
+def test_no_cursor_in_the_chunk_layouts_or_after_an_empty_page():
+    results = first_page(["e1"], "dog")
+
+    assert first_page_cursor(params("dog"), results, layout="chunk") is None
+    assert first_page_cursor(params("dog"), [], layout="episode") is None
+    with pytest.raises(CursorError):
+        fetch_page(first_page_cursor(params("dog"), results, layout="episode"), FakeES({}), layout="window")
+
+
+def test_query_pages_until_exhausted():
+    ids = episode_ids("dog", 25)
+    es = FakeES({"dog": ids})
+
+    cursor = first_page_cursor(params("dog"), first_page(ids[:10], "dog"), layout="episode")
+    _, hits, cursor = fetch_page(cursor, es, layout="episode")
+    assert [hit["_source"]["episode_id"] for hit in hits] == ids[10:20]
+    assert es.bodies[0]["post_filter"] == {"bool": {"must_not": [{"terms": {"episode_id": ids[:10]}}]}}
+
+    _, hits, cursor = fetch_page(cursor, es, layout="episode")
+    assert [hit["_source"]["episode_id"] for hit in hits] == ids[20:]
+    # the query has more than a page of hits, so the plain search had no fallback to continue
+    assert cursor is None
+    assert es.closed == ["pit-0"]
+
+
+def test_full_first_page_from_the_suggestions_goes_on_with_them():
+    misspelled, corrected = episode_ids("dgo", 4), episode_ids("dog", 15)
+    es = FakeES({"dgo": misspelled, "dog": corrected}, corrections={"dgo": "dog"})
+    # the plain search filled its page with hits of the suggestion "dog"
+    results = first_page(misspelled + corrected[:6], "dgo", {episode_id: "dog" for episode_id in corrected})
+
+    cursor = first_page_cursor(params("dgo"), results, layout="episode")
+    _, hits, cursor = fetch_page(cursor, es, layout="episode")
+
+    assert [hit["_source"]["episode_id"] for hit in hits] == corrected[6:]
+    assert {hit["_source"]["query"] for hit in hits} == {"dog"}
+    assert cursor is None
+
+
+def test_episode_filter_goes_on_with_the_more_like_this_fill():
+    # show_name matches of "cats" filled with more_like_this hits on the first page
+    matches, similar = episode_ids("cat", 3), episode_ids("similar", 12)
+    es = FakeES({"cats": matches, "mlt:cats": matches + similar})
+    results = [{"transcript": {}, "metadata": {"episode_id": episode_id, "query": "cats"}} for episode_id in matches + similar[:7]]
+
+    cursor = first_page_cursor(params("cats", filter="show_name"), results, layout="episode")
+    _, hits, cursor = fetch_page(cursor, es, layout="episode")
+
+    assert [hit["_source"]["episode_id"] for hit in hits] == similar[7:]
+    assert cursor is None
+
+
+def test_nested_suggestion_stage_excludes_episodes_without_repeating_inner_hits():
+    misspelled, corrected = episode_ids("dgo", 2), episode_ids("dog", 30)
+    es = FakeES({"dgo": misspelled, "dog": corrected}, corrections={"dgo": "dog"})
+    results = first_page(misspelled + corrected[:8], "dgo", {episode_id: "dog" for episode_id in corrected})
+
+    cursor = first_page_cursor(params("dgo"), results, layout="nested")
+    _, hits, cursor = fetch_page(cursor, es, layout="nested")
+    assert [hit["_source"]["episode_id"] for hit in hits] == corrected[8:18]
+
+    _, hits, cursor = fetch_page(cursor, es, layout="nested")
+    assert [hit["_source"]["episode_id"] for hit in hits] == corrected[18:28]
+
+    second_stage = es.bodies[-1]
+    assert find_query_text(second_stage) == "dog"
+    assert find_inner_hits_names(second_stage) == ["matched_chunk"]
+    assert second_stage["post_filter"] == {"bool": {"must_not": [{"terms": {"episode_id": misspelled + corrected[:18]}}]}}
@@ -0,0 +1,65 @@
+import re
+
+import pytest
+
+from queries.suggestions import clear_term_cache, get_suggested_queries, search_with_suggestions
+
+
+class FakeES:
+    """
+    Term suggester appending "x" to every token of the suggested text.
+    """
+
+    def __init__(self):
+        self.suggested_texts = []
+
+    def suggest_response(self, text):
+        self.suggested_texts.append(text)
+        return {
+            "hits": {"hits": []},
+            "suggest": {
+                "suggestion": [
+                    {
+                        "text": match.group(),
+                        "offset": match.start(),
+                        "length": len(match.group()),
+                        "options": [{"text": match.group() + "x", "score": 0.9}],
+                    }
+                    for match in re.finditer(r"\S+", text)
+                ]
+            },
+        }
+
+    def search(self, index=None, body=None, **kwargs):
+        return self.suggest_response(body["suggest"]["suggestion"]["text"])
+
+
+@pytest.fixture(autouse=True)
+def term_cache():
+    clear_term_cache()
+    yield
+    clear_term_cache()
+
+
+def test_speculative_suggestions_with_repeated_word():
+    es = FakeES()
+    _, suggestions = search_with_suggestions({"query": {"match_all": {}}}, "cat the cat", es, "index", speculative=True)
+
+    assert suggestions[0] == "catx thex catx"
+    assert es.suggested_texts == ["cat the"]
+
+
+def test_repeated_word_is_cached_once():
+    es = FakeES()
+    search_with_suggestions({"query": {"match_all": {}}}, "cat the cat", es, "index", speculative=True)
+
+    # "cat" comes from the term cache, only "dog" is suggested
+    assert get_suggested_queries("cat dog", es, "index")[0] == "catx dogx"
+    assert es.suggested_texts[-1] == "dog"
+
+
+def test_suggested_queries_with_repeated_word():
+    es = FakeES()
+
+    assert get_suggested_queries("cat the cat", es, "index")[0] == "catx thex catx"
+    assert get_suggested_queries("the cat", es, "index")[0] == "thex catx"
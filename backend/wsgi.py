@@ -0,0 +1,42 @@
+"""
+Production entry point of the Flask backend.
+
+    python wsgi.py --workers 4 --threads 8 --bind 127.0.0.1:5000
+
+runs app.py under gunicorn with the settings of gunicorn.conf.py (also read by a plain
+`gunicorn wsgi:app` started from the backend folder). The app is imported once and forked
+into the workers, each worker opens its own Elasticsearch connections, and SIGTERM lets
+in-flight requests finish before the workers close their clients and exit.
+"""
+import argparse
+import os
+import sys
+
+from app import app
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn.conf.py")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the backend under gunicorn")
+    parser.add_argument("--bind", help="host:port (default WEB_BIND or 127.0.0.1:5000)")
+    parser.add_argument("--workers", type=int, help="worker processes (default WEB_CONCURRENCY or the CPU count)")
+    parser.add_argument("--threads", type=int, help="threads per worker (default WEB_THREADS or 8)")
+    args = parser.parse_args()
+
+    argv = ["gunicorn", "--config", CONFIG_PATH, "--chdir", os.path.dirname(CONFIG_PATH)]
+    if args.bind:
+        argv += ["--bind", args.bind]
+    if args.workers:
+        argv += ["--workers", str(args.workers)]
+    if args.threads:
+        argv += ["--threads", str(args.threads)]
+    argv.append("wsgi:app")
+
+    from gunicorn.app.wsgiapp import run
+    sys.argv = argv
+    run()
+
+
+if __name__ == "__main__":
+    main()
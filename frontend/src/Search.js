@@ -31,6 +31,8 @@ const Search = () => {
     const [isAccordionOpen, setIsAccordionOpen] = useState(false);
     const [selectedTag, setSelectedTag] = useState(FILTER_MAPPING[0].value);
     const [isLoading, setIsLoading] = useState(false);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [isLoadingMore, setIsLoadingMore] = useState(false);
     const audioRef = useRef(null);
     const [isAudioVisible, setIsAudioVisible] = useState(false);
     const [uniqueQueryTypes, setUniqueQueryTypes] = useState([]);
@@ -103,9 +105,73 @@ const Search = () => {
     };
     
 
+    // Posts a search (or {cursor} for the next page) with stream=ndjson: one {transcript, metadata}
+    // result per line, appended to `received` and rendered as it arrives. Returns the cursor of
+    // the next page, sent as the last line.
+    const streamResults = async (body, received) => {
+        const response = await fetch(`${API_BASE_URL}/search?stream=ndjson`, {
+            method:"POST",
+            headers: {
+                "Content-Type": "application/json",
+            },
+            body: JSON.stringify(body),
+        });
+        if (!response.ok || !response.body) {
+            console.error("Unexpected API response:", response.status);
+            return null;
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        let cursor = null;
+
+        const addResult = (line) => {
+            if (!line.trim()) {
+                return;
+            }
+            const result = JSON.parse(line);
+            if (result.error) {
+                console.error("Error during search:", result.error);
+                return;
+            }
+            if ("cursor" in result) {
+                cursor = result.cursor;
+                return;
+            }
+            received.push({ ...result, id: result.id || received.length });
+            setResults([...received]);
+            setIsLoading(false);
+        };
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split("\n");
+            buffer = lines.pop();
+            lines.forEach(addResult);
+        }
+        addResult(buffer + decoder.decode());
+        return cursor;
+    };
+
+    const saveQueryTypes = (received) => {
+        // Extract and save unique query types
+        const queries = received
+            .map((result) => result.transcript?.query)
+            .filter((query) => query !== undefined && query !== null);
+        const uniqueQueries = [...new Set(queries)];
+        console.log("Unique Query Types:", uniqueQueries);
+        setUniqueQueryTypes(uniqueQueries); // Save to state
+    };
+
     const handleSearch = async () => {
         setIsLoading(true);
         setSelectedShow(null);
+        setNextCursor(null);
         const params = {
             q: query,
             filter: selectedTag,
@@ -113,42 +179,20 @@ const Search = () => {
             ranking: searchType === "Ranking" ? rankingType : undefined,
             time: timeRange.value,
             selectedEpisodes: checkedEpisodes,
+            paginate: true,
         };
 
         console.log("Search Parameters:", params);
         
         try {
-            const response = await fetch(`${API_BASE_URL}/search?`, {
-                method:"POST",
-                headers: {
-                    "Content-Type": "application/json",
-                },
-                body: JSON.stringify(params),
-            });
-            const data = await response.json();
-            console.log(data);
+            const received = [];
+            setNextCursor(await streamResults(params, received));
+            console.log(received);
 
-            if (!Array.isArray(data)) {
-                console.error("Unexpected API response format:", data);
+            if (received.length === 0) {
                 setResults([]);
-                return;
             }
-
-            const resultsWithIds = data.map((result, index) => ({
-                ...result,
-                id: result.id || index,
-            }));
-
-            setResults(resultsWithIds);
-
-            // Extract and save unique query types
-            const queries = resultsWithIds
-                .map((result) => result.transcript?.query)
-                .filter((query) => query !== undefined && query !== null);
-            const uniqueQueries = [...new Set(queries)];
-            console.log("Unique Query Types:", uniqueQueries);
-            setUniqueQueryTypes(uniqueQueries); // Save to state
-            console.log("Unique Query Types:", uniqueQueryTypes);
+            saveQueryTypes(received);
         } catch (error) {
             console.error("Error fetching search results:", error);
             setResults([]);
@@ -157,6 +201,20 @@ const Search = () => {
             setIsLoading(false);
         }
     };
+
+    const handleLoadMore = async () => {
+        setIsLoadingMore(true);
+        try {
+            const received = [...results];
+            setNextCursor(await streamResults({ cursor: nextCursor }, received));
+            saveQueryTypes(received);
+        } catch (error) {
+            console.error("Error fetching more results:", error);
+            setNextCursor(null);
+        } finally {
+            setIsLoadingMore(false);
+        }
+    };
     
     return (
         <div className="container-fluid podcast-container px-4 py-5">
@@ -372,6 +430,13 @@ const Search = () => {
                                             </div>
                                         ))}
                                     </div>
+                                    {nextCursor && (
+                                        <div className="text-center mt-4">
+                                            <button className="btn btn-outline-primary" onClick={handleLoadMore} disabled={isLoadingMore}>
+                                                {isLoadingMore ? "Loading..." : "Load more"}
+                                            </button>
+                                        </div>
+                                    )}
                                 </div>
 
                                 {/* Selected Podcast Details */}
@@ -504,7 +569,7 @@ const Search = () => {
                                                                         <i className="bi bi-quote me-2"></i>
                                                                         Relevant Transcript Found
                                                                     </h6>
-                                                                    {selectedShow.transcript.start_time && selectedShow.transcript.end_time && (
+                                                                    {selectedShow.transcript.start_time != null && selectedShow.transcript.end_time != null && (
                                                                     <div className="d-flex justify-content-end align-items-center m-2">
                                                                         <span className="badge bg-secondary">
                                                                             {Math.round(parseFloat(selectedShow.transcript.start_time))}s